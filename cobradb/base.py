@@ -1,13 +1,17 @@
 """Module to implement ORM to the ome database"""
 import logging
 
-from cobradb import settings
+from cobradb import settings, ids
 
 from sqlalchemy.orm import sessionmaker, relationship, aliased
 from sqlalchemy.orm.session import Session as _SA_Session
 from sqlalchemy import (Table, MetaData, create_engine, Column, Integer, String,
-                        Float, Numeric, ForeignKey, Boolean, Enum, DateTime)
-from sqlalchemy.schema import UniqueConstraint
+                        Float, Numeric, ForeignKey, Boolean, Enum, DateTime,
+                        func, event)
+from sqlalchemy.exc import UnboundExecutionError
+from sqlalchemy.pool import NullPool
+from sqlalchemy.schema import UniqueConstraint, Index
+from sqlalchemy.dialects.postgresql import INT4RANGE
 from sqlalchemy.ext.declarative import declarative_base
 from types import MethodType
 from os import system
@@ -15,11 +19,99 @@ from contextlib import contextmanager
 from sqlalchemy.schema import Sequence
 
 
-# connect to postgres
-engine = create_engine(settings.db_connection_string)
-Base = declarative_base(bind=engine)
-metadata = MetaData(bind=engine)
-Session = sessionmaker(bind=engine, class_=_SA_Session)
+def make_engine(connection_string=None, **overrides):
+    """Create an engine with the pool and connection settings from settings.ini
+    or environment variables (see settings.engine_settings).
+
+    Bulk loaders and read services can create separate engines with different
+    pool behavior by passing overrides, e.g. make_engine(pool_size=1,
+    statement_timeout=0).
+
+    Arguments
+    ---------
+
+    connection_string: A database URL. Defaults to settings.db_connection_string.
+
+    overrides: Values for any of the names in settings.engine_settings.
+
+    """
+    if connection_string is None:
+        connection_string = settings.db_connection_string
+    opts = {name: overrides.pop(name, getattr(settings, name))
+            for name in settings.engine_settings}
+    if len(overrides) > 0:
+        raise TypeError('Unknown engine settings: %s' % ', '.join(overrides))
+
+    kwargs = {'pool_pre_ping': opts['pool_pre_ping'],
+              'server_side_cursors': opts['server_side_cursors']}
+    if opts['executemany_mode'] != 'default':
+        kwargs['executemany_mode'] = opts['executemany_mode']
+    if opts['pgbouncer']:
+        # let PgBouncer do the pooling
+        kwargs['poolclass'] = NullPool
+    else:
+        kwargs.update(pool_size=opts['pool_size'],
+                      max_overflow=opts['max_overflow'],
+                      pool_timeout=opts['pool_timeout'],
+                      pool_recycle=opts['pool_recycle'])
+        if opts['statement_timeout'] > 0:
+            kwargs['connect_args'] = {
+                'options': '-c statement_timeout=%d' % opts['statement_timeout']
+            }
+
+    new_engine = create_engine(connection_string, **kwargs)
+
+    if opts['pgbouncer'] and opts['statement_timeout'] > 0:
+        # PgBouncer rejects startup options and shares server connections
+        # between clients, so scope the timeout to each transaction
+        @event.listens_for(new_engine, 'begin')
+        def set_statement_timeout(conn):
+            conn.execute('SET LOCAL statement_timeout = %d' %
+                         opts['statement_timeout'])
+
+    ids.use_id_blocks(new_engine, opts['id_block_size'])
+
+    return new_engine
+
+
+_engine = None
+
+
+def get_engine():
+    """Get the default engine, creating it from the settings on first use. Also
+    available as base.engine.
+
+    """
+    global _engine
+    if _engine is None:
+        _engine = make_engine()
+        Base.metadata.bind = _engine
+        metadata.bind = _engine
+    return _engine
+
+
+def __getattr__(name):
+    # connect to postgres lazily, so importing cobradb does not need settings
+    if name == 'engine':
+        return get_engine()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+class _LazySession(_SA_Session):
+    """Session that falls back to the default engine when it has no bind."""
+
+    def get_bind(self, mapper=None, clause=None):
+        try:
+            return super(_LazySession, self).get_bind(mapper=mapper,
+                                                      clause=clause)
+        except UnboundExecutionError:
+            return get_engine()
+
+
+Base = declarative_base()
+metadata = MetaData()
+Session = sessionmaker(class_=_LazySession)
+event.listen(_LazySession, 'before_flush', ids.assign_new_ids)
 
 
 # make the enums
@@ -115,6 +207,21 @@ class GenomeRegion(Base):
                 .format(self=self))
 
 
+def genome_region_range(leftpos=None, rightpos=None):
+    """SQL int4range expression for the positions of a GenomeRegion, or for the
+    given positions. The GiST index below is built on the default expression,
+    so range queries on genome regions should use it."""
+    if leftpos is None and rightpos is None:
+        leftpos, rightpos = GenomeRegion.leftpos, GenomeRegion.rightpos
+    return func.int4range(func.least(leftpos, rightpos),
+                          func.greatest(leftpos, rightpos),
+                          type_=INT4RANGE)
+
+
+Index('genome_region_range_idx', genome_region_range(),
+      postgresql_using='gist')
+
+
 class Component(Base):
     __tablename__ = 'component'
 
@@ -147,6 +254,9 @@ class Reaction(Base):
 
     __table_args__ = (
         UniqueConstraint('cobra_id'),
+        # for prefix searches on incremented IDs, e.g. cobra_id LIKE 'GAPD\_%'
+        Index('reaction_cobra_id_prefix_idx', 'cobra_id',
+              postgresql_ops={'cobra_id': 'varchar_pattern_ops'}),
     )
 
     __mapper_args__ = {
@@ -232,6 +342,10 @@ class OldIDSynonym(Base):
                         ForeignKey('synonym.id', ondelete='CASCADE'),
                         nullable=False)
     ome_id = Column(Integer, nullable=False)
+    # the model of the ome_id row, so the table can be partitioned
+    model_id = Column(Integer,
+                      ForeignKey('model.id', ondelete='CASCADE'),
+                      nullable=False)
 
     __table_args__ = (
         UniqueConstraint('synonym_id', 'ome_id'),
@@ -0,0 +1,5 @@
+"""Benchmarks for the loaders with synthetic genome-scale models.
+
+Run bin/run_benchmarks against a local PostgreSQL instance.
+
+"""
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+"""Run the loader benchmarks against a local PostgreSQL database.
+
+The SQL statement and inserted row counts of the synthetic loads do not depend
+on the machine, so they are kept in counts.json next to this module and every
+run is checked against them. Timings do depend on the machine, so their
+baselines are recorded locally with save_baselines.
+
+"""
+
+from cobradb import base, settings, profiling
+# import the table definitions, so create_all makes every table
+from cobradb import models, components, datasets
+from cobradb.benchmarks import synthetic
+
+from collections import OrderedDict
+from os.path import join, realpath, dirname
+from time import time
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+
+test_data_dir = realpath(join(dirname(dirname(__file__)), 'test_data'))
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+COUNTS_FILE = join(dirname(__file__), 'counts.json')
+
+# measurements that are the same on every machine
+COUNT_KEYS = ['sql_statements', 'rows_inserted']
+
+
+def prepare_database(database=None):
+    """Drop and create the benchmark database, create the schema and bind
+    base.Session to it. Returns the engine.
+
+    Arguments
+    ---------
+
+    database: The database name. Defaults to the database in settings.ini with
+    the suffix _benchmark.
+
+    """
+    if database is None:
+        database = '%s_benchmark' % settings.postgres_database
+    os.system('dropdb --if-exists %s' % database)
+    os.system('createdb %s -U %s' % (database, settings.postgres_user))
+    logging.info('Dropped and created database %s' % database)
+
+    engine = base.make_engine('postgresql://%s:%s@%s:%s/%s' %
+                              (settings.postgres_user,
+                               settings.postgres_password,
+                               settings.postgres_host,
+                               settings.postgres_port, database))
+    base.Base.metadata.create_all(engine)
+    base.Session.configure(bind=engine)
+    return engine
+
+
+def _measure(name, items, function, *args):
+    profiler = profiling.start(name)
+    start = time()
+    try:
+        result = function(*args)
+    finally:
+        seconds = time() - start
+        profiling.stop()
+    report = profiler.report()
+    return result, OrderedDict([
+        ('seconds', round(seconds, 3)),
+        ('items', items),
+        ('items_per_second', round(items / seconds, 1) if seconds > 0 else None),
+        ('sql_statements', report['sql']['statements']),
+        ('sql_seconds', report['sql']['seconds']),
+        ('rows_inserted', sum(report['rows_inserted'].values())),
+        ('peak_rss_mb', report['peak_rss_mb']),
+    ])
+
+
+def run_benchmark(n_reactions, session, work_dir):
+    """Generate the synthetic data for one model size, then load the genome,
+    the model and a map, and dump the model. Returns the measurements for each
+    step.
+
+    Arguments
+    ---------
+
+    n_reactions: The number of reactions in the synthetic model.
+
+    session: An SQLAlchemy session for the benchmark database.
+
+    work_dir: A directory for the generated files.
+
+    """
+    from cobradb.loading.component_loading import load_genome
+    from cobradb.loading.model_loading import load_model
+    from cobradb.loading.map_loading import load_the_map
+    from cobradb.dumping.model_dumping import dump_model
+    from cobradb.models import Model
+
+    counts = synthetic.sizes_for(n_reactions)
+    accession = 'NC_SYN%d' % n_reactions
+    genome_ref = ('ncbi_accession', accession + '.1')
+    model_id = 'synthetic_%d' % n_reactions
+
+    logging.info('Generating synthetic data with %d reactions' % n_reactions)
+    gb_path = join(work_dir, '%s.gb' % accession)
+    model_path = join(work_dir, '%s.xml' % model_id)
+    synthetic.write_genbank(counts['genes'], accession, gb_path)
+    model = synthetic.make_model(n_reactions, model_id)
+    synthetic.write_model(model, model_path)
+    map_name = '%s.Synthetic map' % model_id
+    map_json = synthetic.make_map_json(model, map_name)
+
+    results = OrderedDict()
+    _, results['load_genome'] = _measure('load_genome', counts['genes'],
+                                         load_genome, genome_ref, [gb_path],
+                                         session)
+    _, results['load_model'] = _measure('load_model', n_reactions, load_model,
+                                        model_path, None, genome_ref, session)
+    model_db_id = (session
+                   .query(Model.id)
+                   .filter(Model.cobra_id == model_id)
+                   .one())[0]
+    map_reactions = min(n_reactions, synthetic.MAX_MAP_REACTIONS)
+    _, results['load_the_map'] = _measure('load_the_map', map_reactions,
+                                          load_the_map, session, model_db_id,
+                                          map_name, map_json)
+    dumped, results['dump_model'] = _measure('dump_model', n_reactions,
+                                             dump_model, model_id)
+    if len(dumped.reactions) != len(model.reactions):
+        logging.warning('Dumped %d reactions for %s, expected %d' %
+                        (len(dumped.reactions), model_id, len(model.reactions)))
+    return results
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, database=None, work_dir=None):
+    """Run the benchmarks for each model size in a fresh database. Returns the
+    results keyed by size, then by step.
+
+    Arguments
+    ---------
+
+    sizes: A list of model sizes, in reactions.
+
+    database: The database name. See prepare_database.
+
+    work_dir: A directory for the generated files. Defaults to a temporary
+    directory that is removed afterwards.
+
+    """
+    temp_dir = None
+    if work_dir is None:
+        temp_dir = work_dir = tempfile.mkdtemp(prefix='cobradb_benchmark_')
+    elif not os.path.exists(work_dir):
+        os.makedirs(work_dir)
+
+    # prefs used by the loaders
+    settings.reaction_id_prefs = join(test_data_dir, 'reaction-id-prefs.txt')
+    settings.reaction_hash_prefs = join(test_data_dir, 'reaction-hash-prefs.txt')
+    settings.gene_reaction_rule_prefs = join(test_data_dir, 'gene-reaction-rule-prefs.txt')
+    settings.data_source_preferences = join(test_data_dir, 'data-source-prefs.txt')
+    settings.compartment_names = join(work_dir, 'compartment-names.tsv')
+    with open(settings.compartment_names, 'w') as f:
+        f.write('c\tcytosol\ne\textracellular space\n')
+
+    results = OrderedDict()
+    try:
+        for n_reactions in sizes:
+            engine = prepare_database(database)
+            session = base.Session()
+            try:
+                results[str(n_reactions)] = run_benchmark(n_reactions, session,
+                                                          work_dir)
+            finally:
+                session.close()
+                base.Session.close_all()
+                engine.dispose()
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir)
+    return results
+
+
+def load_baselines(filepath):
+    """Read the timing baselines that save_baselines stored. Timings depend on
+    the machine, so no timing baselines are shipped with cobradb.
+
+    """
+    with open(filepath, 'r') as f:
+        return json.load(f)
+
+
+def _save(results, filepath, keys):
+    try:
+        baselines = load_baselines(filepath)
+    except IOError:
+        baselines = {}
+    for size, steps in results.items():
+        baselines[size] = {step: {key: values[key] for key in keys}
+                           for step, values in steps.items()}
+    with open(filepath, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def save_baselines(results, filepath):
+    """Store the seconds of the results as baselines, keeping the baselines for
+    other sizes.
+
+    """
+    _save(results, filepath, ['seconds'])
+
+
+def load_counts(filepath=COUNTS_FILE):
+    """Read the SQL statement and inserted row counts for the synthetic loads,
+    by default the ones shipped with cobradb.
+
+    """
+    with open(filepath, 'r') as f:
+        return json.load(f)
+
+
+def save_counts(results, filepath=COUNTS_FILE):
+    """Store the SQL statement and inserted row counts of the results, keeping
+    the counts for other sizes. Run this when a change to the loaders changes
+    the counts on purpose.
+
+    """
+    _save(results, filepath, COUNT_KEYS)
+
+
+def compare_to_baselines(results, baselines, tolerance=0.25, keys=['seconds']):
+    """Get a list of messages for each result that is higher than its baseline
+    by more than the tolerance. Results without a baseline are skipped.
+
+    Arguments
+    ---------
+
+    results: Results from run_benchmarks.
+
+    baselines: Baselines from load_baselines or load_counts.
+
+    tolerance: The allowed fraction above the baseline.
+
+    keys: The measurements to compare, e.g. COUNT_KEYS with the counts from
+    load_counts.
+
+    """
+    regressions = []
+    for size, steps in results.items():
+        for step, values in steps.items():
+            try:
+                baseline = baselines[size][step]
+            except KeyError:
+                logging.warning('No baseline for %s with %s reactions' % (step, size))
+                continue
+            for key in keys:
+                if values[key] > baseline[key] * (1 + tolerance):
+                    regressions.append('%s with %s reactions: %s is %s, baseline %s'
+                                       % (step, size, key, values[key],
+                                          baseline[key]))
+    return regressions
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+"""Generate synthetic genome-scale models, GenBank files and Escher maps.
+
+The generated data are deterministic for a given size and seed. Models use
+BiGG-style IDs, and the genes in a model are the locus tags of the matching
+synthetic GenBank file, so the model genes map to the genome.
+
+"""
+
+import json
+import random
+import six
+
+
+GENE_LENGTH = 30
+GENE_SPACING = 10
+# a map larger than 1e6 bytes is skipped by load_the_map
+MAX_MAP_REACTIONS = 500
+
+
+def sizes_for(n_reactions):
+    """Get the number of metabolites and genes for a model size."""
+    return {'reactions': n_reactions,
+            'metabolites': max(2, int(n_reactions * 0.8)),
+            'genes': max(1, int(n_reactions * 0.6))}
+
+
+def locus_tag(i):
+    return 'syn%06d' % (i + 1)
+
+
+def make_model(n_reactions, model_id=None, seed=0):
+    """Make a cobra Model with about n_reactions reactions, 0.8 metabolites
+    and 0.6 genes per reaction, exchange reactions, and a biomass reaction.
+
+    Arguments
+    ---------
+
+    n_reactions: The number of reactions.
+
+    model_id: The ID of the model. Defaults to synthetic_<n_reactions>.
+
+    seed: The seed for the random number generator.
+
+    """
+    from cobra import Model, Metabolite, Reaction
+
+    rand = random.Random(seed)
+    counts = sizes_for(n_reactions)
+    model = Model(model_id or 'synthetic_%d' % n_reactions)
+
+    metabolites = [Metabolite('syn%d_c' % i, name='Synthetic metabolite %d' % i,
+                              formula='C%dH%dO%d' % (i % 12 + 1, i % 20 + 1, i % 7),
+                              charge=-(i % 3), compartment='c')
+                   for i in range(counts['metabolites'])]
+    n_exchanges = max(1, n_reactions // 20)
+    extracellular = [Metabolite('syn%d_e' % i, name='Synthetic metabolite %d' % i,
+                                formula=metabolites[i].formula, charge=0,
+                                compartment='e')
+                     for i in range(n_exchanges)]
+    model.add_metabolites(metabolites + extracellular)
+    model.compartments = {'c': 'cytosol', 'e': 'extracellular space'}
+
+    reactions = []
+    # transport and exchange reactions
+    for i, met_e in enumerate(extracellular):
+        transport = Reaction('SYNt%d' % i, name='Synthetic transport %d' % i,
+                             lower_bound=-1000, upper_bound=1000)
+        transport.add_metabolites({met_e: -1, metabolites[i]: 1})
+        exchange = Reaction('EX_syn%d_e' % i, name='Exchange %d' % i,
+                            lower_bound=-10, upper_bound=1000)
+        exchange.add_metabolites({met_e: -1})
+        reactions.extend([transport, exchange])
+
+    # biomass
+    biomass = Reaction('BIOMASS_synthetic', name='Synthetic biomass',
+                       lower_bound=0, upper_bound=1000)
+    biomass.add_metabolites({met: -0.1 for met in
+                             rand.sample(metabolites, min(20, len(metabolites)))})
+    reactions.append(biomass)
+
+    # internal reactions
+    i = 0
+    while len(reactions) < n_reactions:
+        reaction = Reaction('SYN%d' % i, name='Synthetic reaction %d' % i,
+                            lower_bound=rand.choice([-1000, 0]),
+                            upper_bound=1000)
+        mets = rand.sample(metabolites, min(rand.randint(2, 4), len(metabolites)))
+        split = rand.randint(1, len(mets) - 1)
+        stoich = {}
+        for met in mets[:split]:
+            stoich[met] = -rand.randint(1, 3)
+        for met in mets[split:]:
+            stoich[met] = rand.randint(1, 3)
+        reaction.add_metabolites(stoich)
+        genes = [locus_tag(rand.randrange(counts['genes']))
+                 for _ in range(rand.choice([0, 1, 1, 2]))]
+        reaction.gene_reaction_rule = ' or '.join(sorted(set(genes)))
+        reactions.append(reaction)
+        i += 1
+
+    model.add_reactions(reactions)
+    model.objective = biomass
+    return model
+
+
+def write_model(model, filepath):
+    """Write a model to an SBML file."""
+    import cobra.io
+    cobra.io.write_sbml_model(model, filepath)
+
+
+def _format_sequence(sequence):
+    lines = []
+    for start in six.moves.range(0, len(sequence), 60):
+        chunk = sequence[start:start + 60]
+        blocks = ' '.join(chunk[j:j + 10] for j in range(0, len(chunk), 10))
+        lines.append('%9d %s\n' % (start + 1, blocks))
+    return ''.join(lines)
+
+
+def genbank_text(n_genes, accession, organism='Synthetic organism'):
+    """Get a GenBank record with n_genes CDS features as a string.
+
+    Arguments
+    ---------
+
+    n_genes: The number of genes. Gene i has the locus tag locus_tag(i).
+
+    accession: The accession for the chromosome.
+
+    organism: The organism name.
+
+    """
+    length = n_genes * (GENE_LENGTH + GENE_SPACING)
+    lines = [
+        'LOCUS       %-16s %11d bp    DNA     circular BCT 01-JAN-2000\n' % (accession, length),
+        'DEFINITION  %s, synthetic chromosome for benchmarks.\n' % organism,
+        'ACCESSION   %s\n' % accession,
+        'VERSION     %s.1\n' % accession,
+        'KEYWORDS    .\n',
+        'SOURCE      %s\n' % organism,
+        '  ORGANISM  %s\n' % organism,
+        '            Bacteria.\n',
+        'FEATURES             Location/Qualifiers\n',
+        '     source          1..%d\n' % length,
+        '                     /organism="%s"\n' % organism,
+        '                     /mol_type="genomic DNA"\n',
+        '                     /db_xref="taxon:0"\n',
+    ]
+    for i in six.moves.range(n_genes):
+        start = i * (GENE_LENGTH + GENE_SPACING) + 1
+        location = '%d..%d' % (start, start + GENE_LENGTH - 1)
+        if i % 2 == 1:
+            location = 'complement(%s)' % location
+        lines.append('     CDS             %s\n' % location)
+        lines.append('                     /locus_tag="%s"\n' % locus_tag(i))
+        lines.append('                     /gene="syn%d"\n' % i)
+        lines.append('                     /product="synthetic protein %d"\n' % i)
+    lines.append('ORIGIN\n')
+    lines.append(_format_sequence(('atgc' * (length // 4 + 1))[:length]))
+    lines.append('//\n')
+    return ''.join(lines)
+
+
+def write_genbank(n_genes, accession, filepath):
+    """Write a synthetic GenBank file. See genbank_text."""
+    with open(filepath, 'w') as f:
+        f.write(genbank_text(n_genes, accession))
+
+
+def make_map_json(model, map_name, max_reactions=MAX_MAP_REACTIONS):
+    """Make an Escher map, as a JSON string, with nodes for the metabolites of
+    the first max_reactions reactions of the model.
+
+    """
+    reactions = {}
+    nodes = {}
+    met_nodes = {}
+    element_id = 0
+    for reaction in model.reactions[:max_reactions]:
+        for met in reaction.metabolites:
+            if met.id not in met_nodes:
+                element_id += 1
+                met_nodes[met.id] = str(element_id)
+                nodes[str(element_id)] = {'node_type': 'metabolite',
+                                          'cobra_id': met.id, 'name': met.name,
+                                          'x': 0, 'y': 0, 'label_x': 0,
+                                          'label_y': 0, 'node_is_primary': True}
+        element_id += 1
+        reactions[str(element_id)] = {'cobra_id': reaction.id,
+                                      'name': reaction.name,
+                                      'reversibility': reaction.reversibility,
+                                      'label_x': 0, 'label_y': 0,
+                                      'gene_reaction_rule': reaction.gene_reaction_rule,
+                                      'genes': [], 'metabolites': [],
+                                      'segments': {}}
+    return json.dumps([{'map_name': map_name, 'map_id': map_name,
+                        'map_description': 'Synthetic map for benchmarks',
+                        'homepage': '', 'schema': ''},
+                       {'reactions': reactions, 'nodes': nodes,
+                        'text_labels': {}, 'canvas': {'x': 0, 'y': 0,
+                                                      'width': 0, 'height': 0}}])
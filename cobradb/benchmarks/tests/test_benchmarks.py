@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+from cobradb.benchmarks import synthetic
+from cobradb.benchmarks.runner import (compare_to_baselines, load_counts,
+                                       COUNT_KEYS)
+
+import json
+
+
+def test_make_model():
+    model = synthetic.make_model(200)
+    assert len(model.reactions) == 200
+    assert len(model.metabolites) == 160 + 10
+    assert 'EX_syn0_e' in model.reactions
+    genes = {g.id for g in model.genes}
+    assert genes <= {synthetic.locus_tag(i) for i in range(120)}
+    # deterministic
+    assert ([r.reaction for r in synthetic.make_model(200).reactions] ==
+            [r.reaction for r in model.reactions])
+
+
+def test_genbank_text():
+    text = synthetic.genbank_text(3, 'NC_SYN1')
+    assert text.startswith('LOCUS       NC_SYN1')
+    assert text.count('     CDS ') == 3
+    assert '/locus_tag="syn000003"' in text
+    assert 'complement(41..70)' in text
+    assert '        1 atgcatgcat gcatgcatgc' in text
+    assert text.endswith('//\n')
+
+
+def test_make_map_json():
+    model = synthetic.make_model(50)
+    map_object = json.loads(synthetic.make_map_json(model, 'm', max_reactions=10))
+    assert len(map_object[1]['reactions']) == 10
+    assert all(n['node_type'] == 'metabolite'
+               for n in map_object[1]['nodes'].values())
+
+
+def test_compare_to_baselines():
+    baselines = {'1000': {'load_model': {'seconds': 10},
+                          'dump_model': {'seconds': 1}}}
+    results = {'1000': {'load_model': {'seconds': 11, 'sql_statements': 200},
+                        'dump_model': {'seconds': 2, 'sql_statements': 5},
+                        'load_genome': {'seconds': 1, 'sql_statements': 5}}}
+    regressions = compare_to_baselines(results, baselines, tolerance=0.25)
+    assert len(regressions) == 1
+    assert 'dump_model' in regressions[0]
+
+
+def test_compare_to_counts():
+    counts = {'1000': {'load_model': {'sql_statements': 100, 'rows_inserted': 50}}}
+    results = {'1000': {'load_model': {'seconds': 11, 'sql_statements': 101,
+                                       'rows_inserted': 50}}}
+    regressions = compare_to_baselines(results, counts, tolerance=0,
+                                       keys=COUNT_KEYS)
+    assert len(regressions) == 1
+    assert 'sql_statements' in regressions[0]
+    # the shipped counts can be read
+    assert isinstance(load_counts(), dict)
@@ -1,10 +1,11 @@
 from cobradb.base import (Base, Component, GenomeRegion, Session)
 
-from sqlalchemy.orm import relationship, backref, aliased
+from sqlalchemy.orm import relationship, backref, aliased, object_session
 from sqlalchemy import Table, MetaData, create_engine, Column, Integer, \
-    String, Float, ForeignKey, select, Boolean
+    String, Float, ForeignKey, select, Boolean, tuple_, or_
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.schema import UniqueConstraint,PrimaryKeyConstraint
+import six
 
 
 class Gene(GenomeRegion):
@@ -48,32 +49,122 @@ class Complex(Component):
                             primaryjoin=id == ComplexComposition.complex_id,
                             backref="parent")
 
-    @hybrid_property
+    @property
     def all_children(self):
+        """All components nested anywhere below this complex."""
+        session = object_session(self)
+        if session is not None:
+            return get_complex_children(session, [self.id])[self.id]
         session = Session()
-        included_components = (session
-                               .query(ComplexComposition.complex_id, ComplexComposition.component_id)
-                               .filter(ComplexComposition.complex_id == self.id)
-                               .cte(name="included_components", recursive=True))
-
-        incl_alias = aliased(included_components, name="incl_cplx")
-        complex_alias = aliased(ComplexComposition, name="cplx")
-        included_components = (included_components
-                               .union_all(session
-                                          .query(complex_alias.complex_id, complex_alias.component_id)
-                                          .filter(complex_alias.complex_id == incl_alias.c.component_id)))
-
-        return (session
-                .query(Component)
-                .join(included_components,
-                      Component.id == included_components.c.component_id)
-                .all())
+        try:
+            return get_complex_children(session, [self.id])[self.id]
+        finally:
+            session.close()
 
     def __repr__(self):
         return "Complex (#%d):  %s" % \
             (self.id, self.cobra_id)
 
 
+def _complex_children_cte(session, complex_ids):
+    """Recursive CTE with one (root_id, component_id) row for every component
+    nested below each of the complexes in complex_ids."""
+    included_components = (session
+                           .query(ComplexComposition.complex_id.label('root_id'),
+                                  ComplexComposition.component_id.label('component_id'))
+                           .filter(ComplexComposition.complex_id.in_(complex_ids))
+                           .cte(name='included_components', recursive=True))
+
+    incl_alias = aliased(included_components, name='incl_cplx')
+    complex_alias = aliased(ComplexComposition, name='cplx')
+    return (included_components
+            .union(session
+                   .query(incl_alias.c.root_id, complex_alias.component_id)
+                   .filter(complex_alias.complex_id == incl_alias.c.component_id)))
+
+
+def get_complex_children_ids(session, complex_ids):
+    """Expand many complexes at once with a single recursive query.
+
+    Returns a dictionary where keys are the complex IDs and values are sorted
+    lists of the IDs of every component nested below that complex. Complexes
+    without children map to an empty list.
+
+    Arguments
+    ---------
+
+    session: An SQLAlchemy session.
+
+    complex_ids: An iterable of Complex database IDs.
+
+    """
+    complex_ids = list(set(complex_ids))
+    out = {complex_id: [] for complex_id in complex_ids}
+    if len(complex_ids) == 0:
+        return out
+    included_components = _complex_children_cte(session, complex_ids)
+    res_db = (session
+              .query(included_components.c.root_id,
+                     included_components.c.component_id)
+              .order_by(included_components.c.root_id,
+                        included_components.c.component_id))
+    for root_id, component_id in res_db:
+        out[root_id].append(component_id)
+    return out
+
+
+def get_complex_children(session, complex_ids):
+    """Like get_complex_children_ids, but the values are lists of Component
+    objects. All components are loaded in the same query.
+
+    Arguments
+    ---------
+
+    session: An SQLAlchemy session.
+
+    complex_ids: An iterable of Complex database IDs.
+
+    """
+    complex_ids = list(set(complex_ids))
+    out = {complex_id: [] for complex_id in complex_ids}
+    if len(complex_ids) == 0:
+        return out
+    included_components = _complex_children_cte(session, complex_ids)
+    res_db = (session
+              .query(included_components.c.root_id, Component)
+              .join(Component,
+                    Component.id == included_components.c.component_id)
+              .order_by(included_components.c.root_id, Component.id))
+    for root_id, component_db in res_db:
+        out[root_id].append(component_db)
+    return out
+
+
+def _resolve_genome_region_id(session, genome_region_id, cobra_id,
+                              chromosome_id, leftpos, rightpos, strand):
+    """Return genome_region_id if it is given. Otherwise, find or create the
+    GenomeRegion with the given session. With neither, the region is left
+    unset."""
+    if genome_region_id is not None or session is None:
+        return genome_region_id
+    # look up by the unique key only, so a region that is already loaded with
+    # other positions is reused
+    genome_region_db = (session
+                        .query(GenomeRegion)
+                        .filter(GenomeRegion.cobra_id == cobra_id)
+                        .filter(GenomeRegion.chromosome_id == chromosome_id)
+                        .first())
+    if genome_region_db is None:
+        genome_region_db = GenomeRegion(cobra_id=cobra_id,
+                                        chromosome_id=chromosome_id,
+                                        leftpos=leftpos,
+                                        rightpos=rightpos,
+                                        strand=strand)
+        session.add(genome_region_db)
+        session.flush()
+    return genome_region_db.id
+
+
 class DNA(Component):
     __tablename__ = 'dna'
 
@@ -88,15 +179,16 @@ class DNA(Component):
         'polymorphic_on': dna_type
     }
 
-    def __init__(self, cobra_id, name, leftpos=None, rightpos=None, strand=None, chromosome_id=None):
-        super(DNA, self).__init__(cobra_id, name)
-        session = Session()
-        self.genome_region_id = session.get_or_create(GenomeRegion, name=name,
-                                                      leftpos=leftpos,
-                                                      rightpos=rightpos,
-                                                      chromosome_id=chromosome_id,
-                                                      strand=strand).id
-        session.close()
+    def __init__(self, cobra_id, name=None, leftpos=None, rightpos=None,
+                 strand=None, chromosome_id=None, genome_region_id=None,
+                 session=None):
+        super(DNA, self).__init__(cobra_id=cobra_id, name=name)
+        self.genome_region_id = _resolve_genome_region_id(session,
+                                                          genome_region_id,
+                                                          cobra_id,
+                                                          chromosome_id,
+                                                          leftpos, rightpos,
+                                                          strand)
 
     def __repr__(self):
         return ("DNA (#%d, %s) %d-%d %s" % (self.id, self.cobra_id,
@@ -114,19 +206,109 @@ class RNA(Component):
 
     __mapper_args__ = {'polymorphic_identity': 'rna'}
 
-    def __init__(self, cobra_id, name, leftpos=None, rightpos=None, strand=None, chromosome_id=None):
-        super(RNA, self).__init__(cobra_id, name)
-        session = Session()
-        self.genome_region_id = session.get_or_create(GenomeRegion, name=name, leftpos=leftpos,\
-                                                      rightpos=rightpos, strand=strand,
-                                                      chromosome_id=chromosome_id).id
-        session.close()
+    def __init__(self, cobra_id, name=None, leftpos=None, rightpos=None,
+                 strand=None, chromosome_id=None, genome_region_id=None,
+                 session=None):
+        super(RNA, self).__init__(cobra_id=cobra_id, name=name)
+        self.genome_region_id = _resolve_genome_region_id(session,
+                                                          genome_region_id,
+                                                          cobra_id,
+                                                          chromosome_id,
+                                                          leftpos, rightpos,
+                                                          strand)
 
     def __repr__(self):
         return "RNA (#%d, %s)" % \
             (self.id, self.cobra_id)
 
 
+def _bulk_create_with_genome_regions(session, component_class, rows):
+    """Create many components that each sit on a GenomeRegion. Existing regions
+    are found with one query, missing regions are added together, and
+    everything is committed in one transaction."""
+    keys = {(row['cobra_id'], row.get('chromosome_id')) for row in rows}
+    region_ids = {}
+    if len(keys) > 0:
+        # a NULL chromosome_id never matches in a tuple comparison
+        with_chromosome = [key for key in keys if key[1] is not None]
+        without_chromosome = [key[0] for key in keys if key[1] is None]
+        conditions = []
+        if len(with_chromosome) > 0:
+            conditions.append(tuple_(GenomeRegion.cobra_id,
+                                     GenomeRegion.chromosome_id).in_(with_chromosome))
+        if len(without_chromosome) > 0:
+            conditions.append(GenomeRegion.cobra_id.in_(without_chromosome) &
+                              GenomeRegion.chromosome_id.is_(None))
+        res_db = (session
+                  .query(GenomeRegion.cobra_id, GenomeRegion.chromosome_id,
+                         GenomeRegion.id)
+                  .filter(or_(*conditions)))
+        region_ids = {(cobra_id, chromosome_id): region_id
+                      for cobra_id, chromosome_id, region_id in res_db}
+
+    new_regions = {}
+    for row in rows:
+        key = (row['cobra_id'], row.get('chromosome_id'))
+        if key in region_ids or key in new_regions or row.get('genome_region_id') is not None:
+            continue
+        new_regions[key] = GenomeRegion(cobra_id=row['cobra_id'],
+                                        chromosome_id=row.get('chromosome_id'),
+                                        leftpos=row.get('leftpos'),
+                                        rightpos=row.get('rightpos'),
+                                        strand=row.get('strand'))
+    session.add_all(list(new_regions.values()))
+    session.flush()
+    for key, region_db in six.iteritems(new_regions):
+        region_ids[key] = region_db.id
+
+    components = []
+    for row in rows:
+        genome_region_id = row.get('genome_region_id')
+        if genome_region_id is None:
+            genome_region_id = region_ids[(row['cobra_id'], row.get('chromosome_id'))]
+        components.append(component_class(cobra_id=row['cobra_id'],
+                                          name=row.get('name'),
+                                          genome_region_id=genome_region_id))
+    session.add_all(components)
+    session.commit()
+    return [x.id for x in components]
+
+
+def bulk_create_dna(session, rows):
+    """Create DNA components and their GenomeRegions in one transaction.
+
+    Returns a list of the new DNA IDs, in the same order as rows.
+
+    Arguments
+    ---------
+
+    session: An SQLAlchemy session.
+
+    rows: A list of dictionaries with the key cobra_id and the optional keys
+    name, leftpos, rightpos, strand, chromosome_id, and genome_region_id. If
+    genome_region_id is missing, the GenomeRegion with the same cobra_id and
+    chromosome_id is used, or a new one is created.
+
+    """
+    return _bulk_create_with_genome_regions(session, DNA, rows)
+
+
+def bulk_create_rna(session, rows):
+    """Create RNA components and their GenomeRegions in one transaction.
+
+    Returns a list of the new RNA IDs, in the same order as rows.
+
+    Arguments
+    ---------
+
+    session: An SQLAlchemy session.
+
+    rows: A list of dictionaries with the same keys as for bulk_create_dna.
+
+    """
+    return _bulk_create_with_genome_regions(session, RNA, rows)
+
+
 class Protein(Component):
     __tablename__ = 'protein'
 
@@ -1,14 +1,16 @@
 # -*- coding: utf-8 -*-
 
 from cobradb import settings
-from cobradb import base
+from cobradb import base, ids, schema
 from cobradb.loading.component_loading import load_genome
 from cobradb.loading.model_loading import load_model
+from cobradb.loading.identity_cache import clear_identity_cache
 
 import pytest
 from sqlalchemy import create_engine
 import sys
 import os
+import tempfile
 from os.path import join, realpath, dirname
 import cobra.io
 import logging
@@ -87,10 +89,47 @@ def test_db(request, test_db_create):
         base.Session.close_all()
         # clear the db for the next test
         base.Base.metadata.drop_all(engine)
+        # made by schema.defer_constraints, outside the metadata
+        engine.execute('DROP TABLE IF EXISTS deferred_ddl')
+        clear_identity_cache()
+        ids.clear_id_blocks()
         logging.info('Dropped database schema')
     request.addfinalizer(teardown)
 
 
+@pytest.fixture(scope='function')
+def scratch_schema(request, test_db, session):
+    """Make schemas next to the test tables, e.g. to partition or rebuild the
+    tables without changing the test database. Returns a function that takes a
+    schema name, creates the schema, with the cobradb tables unless
+    create_tables is False, and returns an engine for it. The schemas are
+    dropped after the test.
+
+    """
+    session.commit()
+    live_engine = session.get_bind()
+    names = []
+    engines = []
+
+    def make_schema(name, create_tables=True):
+        schema.create_shadow_schema(live_engine, name)
+        names.append(name)
+        engine = schema.schema_engine(name, str(live_engine.url))
+        engines.append(engine)
+        if create_tables:
+            base.Base.metadata.create_all(engine)
+        return engine
+
+    def teardown():
+        for engine in engines:
+            engine.dispose()
+        for name in names:
+            live_engine.execute('DROP SCHEMA IF EXISTS %s CASCADE' % name)
+    request.addfinalizer(teardown)
+
+    return make_schema
+
+
 @pytest.fixture(scope='session')
 def load_genomes(test_db, test_genbank_files, test_prefs, session):
     # preferences
@@ -98,6 +137,9 @@ def load_genomes(test_db, test_genbank_files, test_prefs, session):
     settings.reaction_hash_prefs = test_prefs['reaction_hash_prefs']
     settings.gene_reaction_rule_prefs = test_prefs['gene_reaction_rule_prefs']
     settings.data_source_preferences = test_prefs['data_source_preferences']
+    # reuse the normalized test models between runs
+    settings.model_cache_directory = join(tempfile.gettempdir(),
+                                          'cobradb_test_model_cache')
 
     # load the test genomes
     for genome_ref, gb in test_genbank_files:
@@ -1,14 +1,16 @@
 """Module to implement ORM for the experimental portion of the OME database"""
 
+from cobradb import settings
 from cobradb.base import (Base, DataSource, Session)
-from cobradb.util import get_or_create
+from cobradb.util import get_or_create, load_tsv, _find_data_source_url
 
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, backref
 from sqlalchemy import (Table, Column, Integer, String, Float, ForeignKey)
 from sqlalchemy.schema import UniqueConstraint, Sequence
-from sqlalchemy.types import Text
+from sqlalchemy.types import Text, LargeBinary
 
 from sqlalchemy.dialects.postgresql import JSONB
+import six
 
 
 class Dataset(Base):
@@ -40,14 +42,10 @@ class Dataset(Base):
             (self.id, self.name)
 
 
-    def __init__(self, name, data_source_id=None, group_name=None, attributes=None):
-
-        session = Session()
-        if data_source_id is None:
-            data_source, exists = get_or_create(session, DataSource, cobra_id='-1',
-                                                name='generic', url_prefix='')
-            data_source_id = data_source.id
-        session.close()
+    def __init__(self, name, data_source_id=None, group_name=None,
+                 attributes=None, session=None):
+        if data_source_id is None and session is not None:
+            data_source_id = get_generic_data_source_id(session)
 
         self.name = name
         self.data_source_id = data_source_id
@@ -55,6 +53,77 @@ class Dataset(Base):
         self.attributes = attributes
 
 
+def get_generic_data_source_id(session):
+    """Get the ID of the generic DataSource used for datasets without a source,
+    creating it if necessary."""
+    data_source, exists = get_or_create(session, DataSource, cobra_id='-1',
+                                        name='generic', url_prefix='')
+    return data_source.id
+
+
+def bulk_create_datasets(session, rows, dataset_class=None):
+    """Create many datasets and their DataSources in one transaction.
+
+    Returns a list of the new dataset IDs, in the same order as rows.
+
+    Arguments
+    ---------
+
+    session: An SQLAlchemy session.
+
+    rows: A list of dictionaries with the key name and the optional keys
+    group_name, attributes, and either data_source_id or data_source (the
+    cobra_id of a DataSource). DataSources that do not exist yet are created
+    using the data source preferences file. Rows with neither use the generic
+    DataSource.
+
+    dataset_class: The class to create. Defaults to Dataset.
+
+    """
+    if dataset_class is None:
+        dataset_class = Dataset
+
+    # resolve all the data sources with one query
+    source_cobra_ids = {row['data_source'] for row in rows
+                        if row.get('data_source') is not None}
+    source_ids = {}
+    if len(source_cobra_ids) > 0:
+        res_db = (session
+                  .query(DataSource.cobra_id, DataSource.id)
+                  .filter(DataSource.cobra_id.in_(source_cobra_ids)))
+        source_ids = dict(res_db)
+    missing = source_cobra_ids - set(source_ids)
+    if len(missing) > 0:
+        url_prefs = load_tsv(settings.data_source_preferences)
+        new_sources = {}
+        for cobra_id in missing:
+            _, name, url_prefix = _find_data_source_url(cobra_id, url_prefs)
+            new_sources[cobra_id] = DataSource(cobra_id=cobra_id, name=name,
+                                               url_prefix=url_prefix)
+        session.add_all(list(new_sources.values()))
+        session.flush()
+        for cobra_id, data_source_db in six.iteritems(new_sources):
+            source_ids[cobra_id] = data_source_db.id
+
+    generic_id = None
+    datasets = []
+    for row in rows:
+        data_source_id = row.get('data_source_id')
+        if data_source_id is None and row.get('data_source') is not None:
+            data_source_id = source_ids[row['data_source']]
+        if data_source_id is None:
+            if generic_id is None:
+                generic_id = get_generic_data_source_id(session)
+            data_source_id = generic_id
+        datasets.append(dataset_class(row['name'],
+                                      data_source_id=data_source_id,
+                                      group_name=row.get('group_name'),
+                                      attributes=row.get('attributes')))
+    session.add_all(datasets)
+    session.commit()
+    return [x.id for x in datasets]
+
+
 class AnalysisComposition(Base):
     """
     A many to many table which allows for graph-like nesting of analysis
@@ -88,8 +157,11 @@ class Analysis(Dataset):
     __mapper_args__ = {'polymorphic_identity': 'analysis',
                        'polymorphic_on': 'type'}
 
-    def __init__(self, name, group_name=None, meta_data=None):
-        super(Analysis, self).__init__(name, group_name=group_name, meta_data=meta_data)
+    def __init__(self, name, data_source_id=None, group_name=None,
+                 attributes=None, session=None):
+        super(Analysis, self).__init__(name, data_source_id=data_source_id,
+                                       group_name=group_name,
+                                       attributes=attributes, session=session)
 
     def __repr__(self):
         return "Analysis (#%d):  %s" % \
@@ -125,3 +197,39 @@ class GenomeData(Base):
         self.dataset_id = dataset_id
         self.genome_region_id = genome_region_id
         self.value = value
+
+
+class GenomeRegionOrder(Base):
+    """
+    A fixed ordering of the genome regions of a genome, stored as a packed array
+    of little-endian int64 IDs. New regions are only ever appended, so arrays
+    aligned to an older, shorter ordering stay valid.
+    """
+    __tablename__ = 'genome_region_order'
+
+    genome_id = Column(Integer, ForeignKey('genome.id', ondelete='CASCADE'), primary_key=True)
+    region_count = Column(Integer, nullable=False)
+    region_ids = Column(LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return "Genome Region Order (genome #%d): %d regions" % \
+            (self.genome_id, self.region_count)
+
+
+class GenomeDataArray(Base):
+    """
+    Alternative storage for a dataset: all values in one packed array of
+    little-endian float64, aligned to the GenomeRegionOrder of the genome.
+    Regions without a value are NaN.
+    """
+    __tablename__ = 'genome_data_array'
+
+    dataset_id = Column(Integer, ForeignKey('dataset.id', ondelete='CASCADE'), primary_key=True)
+    dataset = relationship('Dataset', backref=backref('data_array', uselist=False))
+    genome_id = Column(Integer, ForeignKey('genome_region_order.genome_id'), nullable=False)
+    value_count = Column(Integer, nullable=False)
+    values = Column(LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return "Genome Data Array (dataset #%d): %d values" % \
+            (self.dataset_id, self.value_count)
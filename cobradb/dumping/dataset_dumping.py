@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""Vectorized reads of dataset values as NumPy arrays."""
+
+from cobradb.datasets import GenomeData, GenomeDataArray, GenomeRegionOrder
+
+import numpy as np
+
+
+def get_genome_region_order(session, genome_id):
+    """Get the region ordering for a genome as an int64 array, or an empty array
+    if no dataset has been stored in array mode for the genome.
+
+    Arguments
+    ---------
+
+    session: An SQLAlchemy session.
+
+    genome_id: The database ID of the genome.
+
+    """
+    res_db = (session
+              .query(GenomeRegionOrder.region_ids)
+              .filter(GenomeRegionOrder.genome_id == genome_id)
+              .first())
+    if res_db is None:
+        return np.empty(0, dtype='<i8')
+    return np.frombuffer(res_db[0], dtype='<i8')
+
+
+def get_dataset_matrix(session, dataset_ids, genome_id):
+    """Get the values for many datasets on one genome as a matrix.
+
+    Returns a tuple (region_ids, matrix) where region_ids is the int64 region
+    ordering of the genome and matrix is a float64 array with one row per
+    dataset (in the order of dataset_ids) and one column per region. Missing
+    values are NaN.
+
+    Datasets in array storage mode are read with one query and decoded without
+    copying row by row. Datasets stored as GenomeData rows are read with one
+    additional query.
+
+    Arguments
+    ---------
+
+    session: An SQLAlchemy session.
+
+    dataset_ids: A list of Dataset database IDs.
+
+    genome_id: The database ID of the genome.
+
+    """
+    dataset_ids = list(dataset_ids)
+    row_index = {dataset_id: i for i, dataset_id in enumerate(dataset_ids)}
+    region_ids = get_genome_region_order(session, genome_id)
+    matrix = np.full((len(dataset_ids), len(region_ids)), np.nan)
+
+    # array mode
+    array_mode = set()
+    if len(dataset_ids) > 0:
+        res_db = (session
+                  .query(GenomeDataArray.dataset_id, GenomeDataArray.values)
+                  .filter(GenomeDataArray.dataset_id.in_(dataset_ids))
+                  .filter(GenomeDataArray.genome_id == genome_id))
+        for dataset_id, values in res_db:
+            # arrays saved before new regions were appended are shorter
+            array = np.frombuffer(values, dtype='<f8')
+            matrix[row_index[dataset_id], :len(array)] = array
+            array_mode.add(dataset_id)
+
+    # row mode
+    row_mode = [x for x in dataset_ids if x not in array_mode]
+    if len(row_mode) > 0:
+        res_db = (session
+                  .query(GenomeData.dataset_id, GenomeData.genome_region_id,
+                         GenomeData.value)
+                  .filter(GenomeData.dataset_id.in_(row_mode))
+                  .all())
+        if len(res_db) > 0:
+            rows = np.array([row_index[x[0]] for x in res_db], dtype=np.int64)
+            regions = np.array([x[1] for x in res_db], dtype=np.int64)
+            values = np.array([x[2] for x in res_db], dtype=np.float64)
+
+            # add regions that are not in the stored ordering
+            extra = np.unique(regions[~np.isin(regions, region_ids)])
+            if len(extra) > 0:
+                region_ids = np.concatenate([region_ids, extra])
+                matrix = np.hstack([matrix,
+                                    np.full((len(dataset_ids), len(extra)), np.nan)])
+
+            sorter = np.argsort(region_ids)
+            columns = sorter[np.searchsorted(region_ids, regions, sorter=sorter)]
+            matrix[rows, columns] = values
+
+    return region_ids, matrix
+
+
+def get_dataset_values(session, dataset_id, genome_id):
+    """Get the values for a single dataset.
+
+    Returns a tuple (region_ids, values) of NumPy arrays. See
+    get_dataset_matrix.
+
+    Arguments
+    ---------
+
+    session: An SQLAlchemy session.
+
+    dataset_id: The database ID of the Dataset.
+
+    genome_id: The database ID of the genome.
+
+    """
+    region_ids, matrix = get_dataset_matrix(session, [dataset_id], genome_id)
+    return region_ids, matrix[0]
@@ -2,7 +2,6 @@
 
 import logging
 import six
-import cobra
 
 from cobradb.base import Session, OldIDSynonym, Synonym, Reaction, Component
 from cobradb.models import (Model, ModelGene, ModelReaction, ModelCompartmentalizedComponent,
@@ -15,6 +14,8 @@ from collections import defaultdict
 
 @timing
 def dump_model(cobra_id):
+    import cobra
+
     session = Session()
 
     # find the model
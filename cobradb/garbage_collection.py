@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+"""Remove universal rows that no model or genome uses anymore.
+
+Synonym.ome_id and OldIDSynonym.ome_id point into different tables depending
+on their type, so they have no foreign keys, and nothing removes them when the
+rows they describe are deleted. Reactions, metabolites and compartmentalized
+components are shared by models, so they are kept when a model is dropped.
+
+collect_garbage finds these orphans with anti-joins and deletes them in small
+batches, each in its own short transaction. Readers are never blocked, and rows
+that another transaction has locked, e.g. because a loader is inserting a row
+that references them, are skipped until the next run. The steps run in order,
+so the rows orphaned by one step are removed by the later ones.
+
+Loaders cache the IDs of universal rows, so do not collect garbage while
+models are being loaded in other processes.
+
+"""
+
+from cobradb.loading.identity_cache import clear_identity_cache
+
+from sqlalchemy import text
+import logging
+
+
+# (table, condition on the table alias t that makes a row an orphan)
+GC_STEPS = [
+    ('old_id_model_synonym',
+     'NOT EXISTS (SELECT 1 FROM model_reaction x WHERE x.id = t.ome_id) '
+     'AND NOT EXISTS (SELECT 1 FROM model_gene x WHERE x.id = t.ome_id) '
+     'AND NOT EXISTS (SELECT 1 FROM model_compartmentalized_component x '
+     '                WHERE x.id = t.ome_id)'),
+    ('escher_map_matrix',
+     'NOT EXISTS (SELECT 1 FROM model_reaction x WHERE x.id = t.ome_id) '
+     'AND NOT EXISTS (SELECT 1 FROM model_compartmentalized_component x '
+     '                WHERE x.id = t.ome_id)'),
+    ('reaction_matrix',
+     'NOT EXISTS (SELECT 1 FROM model_reaction x '
+     '            WHERE x.reaction_id = t.reaction_id)'),
+    ('reaction',
+     'NOT EXISTS (SELECT 1 FROM model_reaction x WHERE x.reaction_id = t.id) '
+     'AND NOT EXISTS (SELECT 1 FROM reaction_matrix x WHERE x.reaction_id = t.id)'),
+    ('compartmentalized_component',
+     'NOT EXISTS (SELECT 1 FROM model_compartmentalized_component x '
+     '            WHERE x.compartmentalized_component_id = t.id) '
+     'AND NOT EXISTS (SELECT 1 FROM reaction_matrix x '
+     '                WHERE x.compartmentalized_component_id = t.id)'),
+    # metabolite rows are deleted with their component rows
+    ('component',
+     "t.type = 'metabolite' "
+     'AND NOT EXISTS (SELECT 1 FROM compartmentalized_component x '
+     '                WHERE x.component_id = t.id) '
+     'AND NOT EXISTS (SELECT 1 FROM complex_composition x '
+     '                WHERE x.component_id = t.id)'),
+    # old_id_model_synonym rows cascade
+    ('synonym',
+     "(t.type = 'reaction' AND NOT EXISTS "
+     '  (SELECT 1 FROM reaction x WHERE x.id = t.ome_id)) '
+     "OR (t.type = 'component' AND NOT EXISTS "
+     '  (SELECT 1 FROM component x WHERE x.id = t.ome_id)) '
+     "OR (t.type = 'compartmentalized_component' AND NOT EXISTS "
+     '  (SELECT 1 FROM compartmentalized_component x WHERE x.id = t.ome_id)) '
+     "OR (t.type = 'gene' AND NOT EXISTS "
+     '  (SELECT 1 FROM gene x WHERE x.id = t.ome_id))'),
+]
+
+_delete_batch_sql = """
+DELETE FROM {table} WHERE id IN (
+    SELECT t.id FROM {table} t
+    WHERE t.id > :after AND ({condition})
+    ORDER BY t.id
+    LIMIT :batch_size
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING id
+"""
+
+_count_sql = 'SELECT count(*) FROM {table} t WHERE {condition}'
+
+
+def count_orphans(engine):
+    """Count the orphans in each table without deleting anything. Later steps
+    will also remove the rows that are orphaned by earlier steps, so the totals
+    from collect_garbage can be higher.
+
+    Arguments
+    ---------
+
+    engine: An SQLAlchemy engine.
+
+    """
+    with engine.connect() as connection:
+        return {table: connection.execute(
+                    _count_sql.format(table=table, condition=condition)
+                ).scalar()
+                for table, condition in GC_STEPS}
+
+
+def _collect_table(engine, table, condition, batch_size):
+    statement = text(_delete_batch_sql.format(table=table, condition=condition))
+    deleted = 0
+    after = 0
+    while True:
+        with engine.begin() as connection:
+            ids = [row[0] for row in connection.execute(statement, after=after,
+                                                        batch_size=batch_size)]
+        if len(ids) == 0:
+            return deleted
+        deleted += len(ids)
+        after = max(ids)
+
+
+def collect_garbage(engine, batch_size=1000, vacuum=True):
+    """Delete the orphaned rows from the universal tables. Returns a dictionary
+    with the number of deleted rows for each table.
+
+    Arguments
+    ---------
+
+    engine: An SQLAlchemy engine.
+
+    batch_size: The number of rows to delete in each transaction.
+
+    vacuum: If True, VACUUM ANALYZE the tables with deleted rows, so their
+    space can be reused and the planner sees the new sizes.
+
+    """
+    reclaimed = {}
+    for table, condition in GC_STEPS:
+        reclaimed[table] = _collect_table(engine, table, condition, batch_size)
+        if reclaimed[table] > 0:
+            logging.info('Deleted %d orphaned rows from %s' %
+                         (reclaimed[table], table))
+    if sum(reclaimed.values()) > 0:
+        # the cached IDs might point to deleted rows
+        clear_identity_cache()
+    if vacuum:
+        # VACUUM cannot run in a transaction
+        with engine.connect() as connection:
+            connection = connection.execution_options(isolation_level='AUTOCOMMIT')
+            for table, n in reclaimed.items():
+                if n > 0:
+                    connection.execute('VACUUM ANALYZE %s' % table)
+    logging.info('Deleted %d orphaned rows in total' % sum(reclaimed.values()))
+    return reclaimed
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+"""Allocate primary keys from the shared wids sequence in blocks.
+
+Most tables draw their IDs from the wids sequence, so an ID is unique across
+tables, which Synonym.ome_id and OldIDSynonym.ome_id rely on. By default every
+ORM insert calls nextval('wids') and returns the new ID, one row at a time.
+
+An IdBlockAllocator reserves a block of IDs from the same sequence with one
+query, and assign_new_ids hands them out to new objects before a flush, so the
+inserts can be sent with executemany. IDs that are reserved but never used
+leave gaps in the sequence, just like rolled back inserts do.
+
+A forked process, e.g. a multiprocessing worker, starts without reserved IDs,
+so it does not hand out the same IDs as its parent.
+
+"""
+
+from sqlalchemy import inspect, text
+from collections import deque
+import logging
+import os
+import threading
+import weakref
+
+
+SEQUENCE_NAME = 'wids'
+
+# allocators keyed by engine, so a shadow schema uses its own sequence
+_allocators = weakref.WeakKeyDictionary()
+
+
+def _reserve(connection, n):
+    return [row[0] for row in connection.execute(
+        text("SELECT nextval('%s') FROM generate_series(1, :n)" % SEQUENCE_NAME),
+        n=n
+    )]
+
+
+class IdBlockAllocator(object):
+    """Hands out IDs from blocks reserved from the wids sequence. Thread safe.
+
+    Arguments
+    ---------
+
+    block_size: The number of IDs to reserve at a time.
+
+    """
+
+    def __init__(self, block_size):
+        self.block_size = block_size
+        self._ids = deque()
+        self._lock = threading.Lock()
+
+    def allocate(self, connection, n):
+        """Get n new IDs, reserving more with the connection if necessary."""
+        with self._lock:
+            if len(self._ids) < n:
+                count = max(self.block_size, n - len(self._ids))
+                self._ids.extend(_reserve(connection, count))
+                logging.debug('Reserved %d IDs from %s' % (count, SEQUENCE_NAME))
+            return [self._ids.popleft() for _ in range(n)]
+
+
+def use_id_blocks(engine, block_size):
+    """Allocate the IDs of new objects in blocks for sessions bound to the
+    engine. A block_size of 0 turns block allocation off.
+
+    """
+    if block_size > 0 and engine.dialect.name == 'postgresql':
+        _allocators[engine] = IdBlockAllocator(block_size)
+    else:
+        _allocators.pop(engine, None)
+
+
+def clear_id_blocks():
+    """Forget all reserved IDs. Call this after dropping the wids sequence."""
+    for engine in list(_allocators):
+        _allocators[engine] = IdBlockAllocator(_allocators[engine].block_size)
+
+
+# the parent keeps using the IDs it reserved, so a child must not
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=clear_id_blocks)
+
+
+def allocate_ids(session, n):
+    """Get n new IDs from the wids sequence, e.g. for rows written with COPY.
+
+    Arguments
+    ---------
+
+    session: An SQLAlchemy session.
+
+    n: The number of IDs.
+
+    """
+    if n == 0:
+        return []
+    allocator = _allocators.get(session.get_bind())
+    if allocator is None:
+        return _reserve(session.connection(), n)
+    return allocator.allocate(session.connection(), n)
+
+
+def _uses_wids(obj):
+    primary_key = inspect(obj).mapper.primary_key
+    return (len(primary_key) == 1 and
+            getattr(primary_key[0].default, 'name', None) == SEQUENCE_NAME)
+
+
+def assign_new_ids(session, flush_context, instances):
+    """Give the new objects in the session IDs from a reserved block. Listens to
+    the before_flush event of base.Session.
+
+    """
+    allocator = _allocators.get(session.get_bind())
+    if allocator is None:
+        return
+    new = [obj for obj in session.new
+           if getattr(obj, 'id', None) is None and _uses_wids(obj)]
+    if len(new) == 0:
+        return
+    for obj, new_id in zip(new, allocator.allocate(session.connection(), len(new))):
+        obj.id = new_id
@@ -138,18 +138,24 @@ def load_genome(genome_ref, genome_file_paths, session):
         .filter(Genome.accession_value == genome_ref[1])).count() > 0:
         raise AlreadyLoadedError('Genome with %s %s already loaded' % genome_ref)
 
-    logging.debug('Adding new genome: {}'.format(genome_ref))
-    genome_db = base.Genome(accession_type=genome_ref[0],
-                            accession_value=genome_ref[1])
-    session.add(genome_db)
-    session.commit()
-
-    n = len(genome_file_paths)
-    for i, genbank_file_path in enumerate(genome_file_paths):
-        logging.info('Loading chromosome [{} of {}] {}'
-                     .format(i + 1, n, basename(genbank_file_path)))
-        gb_file = _load_gb_file(genbank_file_path)
-        load_chromosome(gb_file, genome_db, session)
+    # load the genome in one transaction, so a failed load leaves nothing behind
+    try:
+        logging.debug('Adding new genome: {}'.format(genome_ref))
+        genome_db = base.Genome(accession_type=genome_ref[0],
+                                accession_value=genome_ref[1])
+        session.add(genome_db)
+        session.flush()
+
+        n = len(genome_file_paths)
+        for i, genbank_file_path in enumerate(genome_file_paths):
+            logging.info('Loading chromosome [{} of {}] {}'
+                         .format(i + 1, n, basename(genbank_file_path)))
+            gb_file = _load_gb_file(genbank_file_path)
+            load_chromosome(gb_file, genome_db, session)
+        session.commit()
+    except:
+        session.rollback()
+        raise
 
 
 def load_chromosome(gb_file, genome_db, session):
@@ -163,7 +169,7 @@ def load_chromosome(gb_file, genome_db, session):
         chromosome = base.Chromosome(ncbi_accession=gb_file.id,
                                      genome_id=genome_db.id)
         session.add(chromosome)
-        session.commit()
+        session.flush()
     else:
         logging.debug('Chromosome already loaded: %s' % gb_file.id)
 
@@ -243,7 +249,7 @@ def load_chromosome(gb_file, genome_db, session):
                            strand=strand,
                            mapped_to_genbank=True)
             session.add(gene_db)
-            session.commit()
+            session.flush()
         else:
             # warn about duplicate genes.
             #
@@ -284,4 +290,4 @@ def load_chromosome(gb_file, genome_db, session):
                 if len(sp) == 2 and sp[0] == 'ORF_ID':
                     load_gene_synonym(session, gene_db, sp[1], 'refseq_orf_id')
 
-    session.commit()
+    session.flush()
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+
+"""Bulk loading of experimental datasets into genome_data."""
+
+from cobradb import base
+from cobradb.base import Chromosome, GenomeRegion, Synonym
+from cobradb.components import Gene
+from cobradb.datasets import GenomeData, GenomeRegionOrder, GenomeDataArray
+from cobradb.util import copy_rows
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+import logging
+import multiprocessing
+import numpy as np
+import six
+
+
+# (database url, genome_id, key_type) -> {key: genome_region_id}
+_genome_region_id_cache = {}
+
+
+def clear_genome_region_cache():
+    """Forget all cached genome region lookups, e.g. after loading new genes."""
+    _genome_region_id_cache.clear()
+
+
+def _genome_region_key_query(session, genome_id, key_type):
+    if key_type == 'cobra_id':
+        query = (session
+                 .query(GenomeRegion.cobra_id, GenomeRegion.id)
+                 .join(Chromosome, Chromosome.id == GenomeRegion.chromosome_id))
+    elif key_type == 'locus_tag':
+        query = (session
+                 .query(Gene.locus_tag, Gene.id)
+                 .join(Chromosome, Chromosome.id == Gene.chromosome_id))
+    elif key_type == 'name':
+        query = (session
+                 .query(Gene.name, Gene.id)
+                 .join(Chromosome, Chromosome.id == Gene.chromosome_id))
+    elif key_type == 'synonym':
+        query = (session
+                 .query(Synonym.synonym, Gene.id)
+                 .join(Gene, Gene.id == Synonym.ome_id)
+                 .join(Chromosome, Chromosome.id == Gene.chromosome_id)
+                 .filter(Synonym.type == 'gene'))
+    else:
+        raise ValueError('Bad key_type %s. Must be cobra_id, locus_tag, name, '
+                         'or synonym' % key_type)
+    return query.filter(Chromosome.genome_id == genome_id)
+
+
+def get_genome_region_ids(session, genome_id, key_type='locus_tag'):
+    """Get a dictionary that maps keys to genome region IDs for a genome. The
+    lookup is made with one query and then cached for the process.
+
+    Arguments
+    ---------
+
+    session: An SQLAlchemy session.
+
+    genome_id: The database ID of the genome.
+
+    key_type: The kind of key to map. One of cobra_id, locus_tag, name (for
+    genes), or synonym (for gene synonyms).
+
+    """
+    cache_key = (str(session.get_bind().url), genome_id, key_type)
+    try:
+        return _genome_region_id_cache[cache_key]
+    except KeyError:
+        pass
+
+    lookup = {}
+    duplicates = 0
+    for key, region_id in _genome_region_key_query(session, genome_id, key_type):
+        if key is None:
+            continue
+        if key in lookup and lookup[key] != region_id:
+            duplicates += 1
+            continue
+        lookup[key] = region_id
+    if duplicates > 0:
+        logging.warning('%d ambiguous %s keys in genome %d. Using the first match.'
+                        % (duplicates, key_type, genome_id))
+    _genome_region_id_cache[cache_key] = lookup
+    return lookup
+
+
+def _resolve_region_values(session, dataset_id, keys, values, genome_id,
+                           key_type):
+    """Map keys to genome region IDs. Returns sorted, unique region IDs and the
+    matching values, dropping unknown keys."""
+    values = np.asarray(values, dtype=np.float64)
+    if len(keys) != len(values):
+        raise ValueError('Got %d keys but %d values' % (len(keys), len(values)))
+
+    lookup = get_genome_region_ids(session, genome_id, key_type)
+    region_ids = np.fromiter((lookup.get(k, -1) for k in keys), dtype=np.int64,
+                             count=len(values))
+
+    found = region_ids >= 0
+    missing = len(region_ids) - int(found.sum())
+    if missing > 0:
+        logging.warning('Could not find %d of %d %s keys for dataset %d'
+                        % (missing, len(region_ids), key_type, dataset_id))
+    region_ids = region_ids[found]
+    values = values[found]
+
+    # one value per genome region
+    region_ids, first_index = np.unique(region_ids, return_index=True)
+    if len(first_index) < len(values):
+        logging.warning('Dropping %d duplicate genome regions for dataset %d'
+                        % (len(values) - len(first_index), dataset_id))
+    return region_ids, values[first_index]
+
+
+def load_genome_data(session, dataset_id, keys, values, genome_id,
+                     key_type='locus_tag', replace=False):
+    """Load the values for a dataset with a single COPY.
+
+    Returns the number of rows written.
+
+    Arguments
+    ---------
+
+    session: An SQLAlchemy session.
+
+    dataset_id: The database ID of the Dataset.
+
+    keys: A sequence or array of genome region keys, e.g. locus tags.
+
+    values: A sequence or array of floats, the same length as keys. NaN values
+    are stored as NULL.
+
+    genome_id: The database ID of the genome the keys refer to.
+
+    key_type: The kind of keys. See get_genome_region_ids.
+
+    replace: If True, first remove any existing values for the dataset.
+
+    """
+    region_ids, values = _resolve_region_values(session, dataset_id, keys,
+                                                values, genome_id, key_type)
+
+    if replace:
+        (session
+         .query(GenomeData)
+         .filter(GenomeData.dataset_id == dataset_id)
+         .delete(synchronize_session=False))
+
+    copy_rows(session, 'genome_data',
+              ['dataset_id', 'genome_region_id', 'value', 'type'],
+              ((dataset_id, int(region_id), float(value), 'genome_data')
+               for region_id, value in six.moves.zip(region_ids, values)))
+    session.commit()
+    return len(region_ids)
+
+
+def _genome_region_ids_in_order(session, genome_id):
+    res_db = (session
+              .query(GenomeRegion.id)
+              .join(Chromosome, Chromosome.id == GenomeRegion.chromosome_id)
+              .filter(Chromosome.genome_id == genome_id)
+              .order_by(GenomeRegion.chromosome_id, GenomeRegion.leftpos,
+                        GenomeRegion.id))
+    return np.fromiter((x[0] for x in res_db), dtype='<i8')
+
+
+def update_genome_region_order(session, genome_id):
+    """Get the region ordering for a genome as an int64 array. The ordering is
+    created on first use, sorted by chromosome and position, and any regions
+    added since are appended to the end.
+
+    Arguments
+    ---------
+
+    session: An SQLAlchemy session.
+
+    genome_id: The database ID of the genome.
+
+    """
+    all_ids = _genome_region_ids_in_order(session, genome_id)
+    order_db = (session
+                .query(GenomeRegionOrder)
+                .filter(GenomeRegionOrder.genome_id == genome_id)
+                .populate_existing()
+                .first())
+    if order_db is not None:
+        existing = np.frombuffer(order_db.region_ids, dtype='<i8')
+        if np.isin(all_ids, existing).all():
+            return existing
+
+    # Create an empty ordering if there is none, and lock it, so loaders for
+    # the same genome in other processes append in turn instead of
+    # overwriting each other.
+    session.execute(pg_insert(GenomeRegionOrder.__table__)
+                    .values(genome_id=genome_id, region_count=0, region_ids=b'')
+                    .on_conflict_do_nothing(index_elements=['genome_id']))
+    order_db = (session
+                .query(GenomeRegionOrder)
+                .filter(GenomeRegionOrder.genome_id == genome_id)
+                .populate_existing()
+                .with_for_update()
+                .one())
+    existing = np.frombuffer(order_db.region_ids, dtype='<i8')
+    new_ids = all_ids[~np.isin(all_ids, existing)]
+    if len(new_ids) == 0:
+        return existing
+
+    ordering = np.concatenate([existing, new_ids])
+    order_db.region_count = len(ordering)
+    order_db.region_ids = ordering.tobytes()
+    session.flush()
+    return ordering
+
+
+def load_genome_data_array(session, dataset_id, keys, values, genome_id,
+                           key_type='locus_tag'):
+    """Load the values for a dataset in array storage mode: one packed float64
+    array aligned to the region ordering of the genome. Replaces any existing
+    array for the dataset.
+
+    Returns the number of values that were matched to genome regions.
+
+    Arguments
+    ---------
+
+    See load_genome_data.
+
+    """
+    region_ids, values = _resolve_region_values(session, dataset_id, keys,
+                                                values, genome_id, key_type)
+    ordering = update_genome_region_order(session, genome_id)
+
+    # position of each region in the ordering
+    sorter = np.argsort(ordering)
+    positions = sorter[np.searchsorted(ordering, region_ids, sorter=sorter)]
+    array = np.full(len(ordering), np.nan, dtype='<f8')
+    array[positions] = values
+
+    array_db = session.query(GenomeDataArray).get(dataset_id)
+    if array_db is None:
+        array_db = GenomeDataArray(dataset_id=dataset_id)
+        session.add(array_db)
+    array_db.genome_id = genome_id
+    array_db.value_count = len(array)
+    array_db.values = array.tobytes()
+    session.commit()
+    return len(region_ids)
+
+
+def load_genome_data_frame(session, dataset_id, data_frame, genome_id,
+                           key_type='locus_tag', key_column=None,
+                           value_column='value', replace=False):
+    """Load a dataset from a pandas DataFrame.
+
+    Arguments
+    ---------
+
+    session: An SQLAlchemy session.
+
+    dataset_id: The database ID of the Dataset.
+
+    data_frame: A DataFrame with the values in value_column. The keys are read
+    from key_column, or from the index when key_column is None.
+
+    genome_id, key_type, replace: See load_genome_data.
+
+    """
+    if key_column is None:
+        keys = list(data_frame.index)
+    else:
+        keys = list(data_frame[key_column])
+    return load_genome_data(session, dataset_id, keys,
+                            data_frame[value_column].values, genome_id,
+                            key_type=key_type, replace=replace)
+
+
+def _load_genome_data_job(job):
+    job = dict(job)
+    load_fn = (load_genome_data_array if job.pop('storage', 'rows') == 'array'
+               else load_genome_data)
+    session = base.Session()
+    try:
+        return load_fn(session, **job)
+    finally:
+        session.close()
+
+
+def load_genome_data_parallel(jobs, processes=None):
+    """Load many datasets in parallel, one dataset per worker process.
+
+    Returns a list with the number of rows written for each job.
+
+    Arguments
+    ---------
+
+    jobs: A list of dictionaries with the keyword arguments for
+    load_genome_data (dataset_id, keys, values, genome_id, and optionally
+    key_type and replace). Add storage='array' to a job to load it with
+    load_genome_data_array instead.
+
+    processes: The number of worker processes. Defaults to the number of CPUs.
+
+    """
+    # warm the lookups once so that forked workers share them
+    session = base.Session()
+    try:
+        for genome_id, key_type in {(j['genome_id'], j.get('key_type', 'locus_tag'))
+                                    for j in jobs}:
+            get_genome_region_ids(session, genome_id, key_type)
+        # create the orderings before forking, so the workers for a genome
+        # only read them
+        for genome_id in {j['genome_id'] for j in jobs
+                          if j.get('storage', 'rows') == 'array'}:
+            update_genome_region_order(session, genome_id)
+        session.commit()
+        engine = session.get_bind()
+    finally:
+        session.close()
+    # connections cannot be shared with the forked workers
+    engine.dispose()
+
+    pool = multiprocessing.Pool(processes=processes)
+    try:
+        return pool.map(_load_genome_data_job, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+
+"""Validate a whole model collection without a database.
+
+validate_models parses and normalizes the models in a process pool, then runs
+the reaction matching of load_reactions (decide_reaction, with the hash and ID
+prefs) over them in load order, against an in-memory universe of reactions and
+metabolites. The report lists the conflicts that a real load would work around
+or fail on:
+
+- parse_error: The model could not be parsed.
+- duplicate_model: The model ID is used by an earlier model.
+- conflicting_pseudoreaction, duplicate_reaction_id, duplicate_metabolite_id,
+  duplicate_gene_id: Found while normalizing the IDs. See parse.convert_ids.
+- unsplittable_metabolite: The metabolite ID has no compartment.
+- metabolite_formula: An earlier model has a different formula for the
+  metabolite.
+- reaction_id_conflict: An earlier model has a reaction with the same ID and a
+  different stoichiometry, so the reaction gets an incremented ID (case 2).
+- pseudoreaction_conflict: Like reaction_id_conflict, but one of the two is a
+  pseudoreaction and the other is not.
+- reaction_merged: An earlier model has the same stoichiometry with a
+  different ID, so the reaction is stored under that ID (case 3a).
+- reaction_renamed: Like reaction_merged, but the ID prefs prefer the new ID,
+  so the universal reaction is renamed.
+- reaction_moved_aside: The hash prefs give the reaction an ID that another
+  universal reaction has, which gets an incremented ID (case 0).
+- duplicate_reaction: The model has another reaction with the same
+  stoichiometry, so both are copies of one universal reaction.
+
+IDs that are freed by renaming are not reused here, so the incremented IDs can
+differ from the ones a real load would pick.
+
+"""
+
+from cobradb import settings
+from cobradb.base import NotFoundError
+from cobradb.loading import parse
+from cobradb.loading.model_loading import decide_reaction, check_hash_prefs
+from cobradb.util import load_tsv, IncrementedIdAllocator
+
+from collections import Counter
+from os.path import basename
+from time import time
+import json
+import logging
+import multiprocessing
+
+
+class UniversalReaction(object):
+    """A reaction in the in-memory universe, standing in for a Reaction row."""
+
+    def __init__(self, id, cobra_id, reaction_hash, pseudoreaction, model):
+        self.id = id
+        self.cobra_id = cobra_id
+        self.reaction_hash = reaction_hash
+        self.pseudoreaction = pseudoreaction
+        self.model = model
+
+
+def summarize_model(model_filepath):
+    """Parse and normalize a model, and return the parts that the universe
+    needs, as a dictionary that can be sent between processes.
+
+    """
+    start = time()
+    summary = {'filename': basename(model_filepath)}
+    try:
+        model, old_ids = parse.load_and_normalize(model_filepath)
+    except Exception as e:
+        summary['error'] = '%s: %s' % (type(e).__name__, e)
+        return summary
+    pseudoreactions = old_ids['pseudoreactions']
+    summary.update({
+        'model_id': model.id,
+        'reactions': [(r.id, parse.hash_reaction(r), r.id in pseudoreactions)
+                      for r in model.reactions],
+        'metabolites': [(m.id, m.formula) for m in model.metabolites],
+        'genes': len(model.genes),
+        'conflicts': old_ids.get('conflicts', []),
+        'seconds': round(time() - start, 3),
+    })
+    return summary
+
+
+class Universe(object):
+    """The universal reactions and metabolites of the models added so far.
+
+    Arguments
+    ---------
+
+    id_prefs: The rows of the reaction_id_prefs file.
+
+    hash_prefs: The rows of the reaction_hash_prefs file.
+
+    """
+
+    def __init__(self, id_prefs, hash_prefs):
+        self.id_prefs = id_prefs
+        self.hash_prefs = hash_prefs
+        self.reactions = {}
+        self._by_hash = {}
+        self._taken_ids = IncrementedIdAllocator()
+        self._formulas = {}
+        self._model_ids = {}
+        self._next_id = 1
+
+    def _new_reaction(self, cobra_id, reaction_hash, pseudoreaction, model):
+        reaction = UniversalReaction(self._next_id, cobra_id, reaction_hash,
+                                     pseudoreaction, model)
+        self._next_id += 1
+        self.reactions[cobra_id] = reaction
+        self._by_hash.setdefault((reaction_hash, pseudoreaction), reaction)
+        self._taken_ids.add(cobra_id)
+        return reaction
+
+    def _rename(self, reaction, new_id):
+        del self.reactions[reaction.cobra_id]
+        reaction.cobra_id = new_id
+        self.reactions[new_id] = reaction
+        self._taken_ids.add(new_id)
+
+    def add_model(self, summary):
+        """Add the reactions and metabolites of a model, as returned by
+        summarize_model. Returns a list of conflicts, each a dictionary with the
+        model filename, kind, ID and a message.
+
+        """
+        filename = summary['filename']
+        conflicts = []
+
+        def conflict(kind, the_id, message):
+            conflicts.append({'model': filename, 'kind': kind, 'id': the_id,
+                              'message': message})
+
+        if 'error' in summary:
+            conflict('parse_error', None, summary['error'])
+            return conflicts
+        model_id = summary['model_id']
+        if model_id in self._model_ids:
+            conflict('duplicate_model', model_id,
+                     'Model %s is also in %s' % (model_id,
+                                                 self._model_ids[model_id]))
+            return conflicts
+        self._model_ids[model_id] = filename
+
+        for kind, the_id, message in summary['conflicts']:
+            conflict(kind, the_id, message)
+
+        for met_id, formula in summary['metabolites']:
+            try:
+                component_id, _ = parse.split_compartment(met_id)
+            except NotFoundError:
+                conflict('unsplittable_metabolite', met_id,
+                         'Metabolite %s has no compartment' % met_id)
+                continue
+            if not formula:
+                continue
+            first = self._formulas.setdefault(component_id, (formula, filename))
+            if first[0] != formula:
+                conflict('metabolite_formula', component_id,
+                         'Formula %s differs from %s in %s' %
+                         (formula, first[0], first[1]))
+
+        used = set()
+        for reaction_id, reaction_hash, pseudoreaction in summary['reactions']:
+            id_match = self.reactions.get(reaction_id)
+            hash_match = self._by_hash.get((reaction_hash, pseudoreaction))
+            preferred_id = check_hash_prefs(self.hash_prefs, reaction_hash)
+            decision = decide_reaction(reaction_id, id_match, hash_match,
+                                       preferred_id, self.id_prefs)
+
+            if decision.existing is not None:
+                universal = decision.existing
+                if decision.rename is not None:
+                    conflict('reaction_renamed', reaction_id,
+                             'Universal reaction %s from %s is renamed to %s by '
+                             'the ID prefs' % (universal.cobra_id,
+                                               universal.model, reaction_id))
+                    self._rename(universal, decision.rename)
+                elif decision.case == '3a':
+                    conflict('reaction_merged', reaction_id,
+                             'Same stoichiometry as %s from %s' %
+                             (universal.cobra_id, universal.model))
+            else:
+                if decision.move_aside in self.reactions:
+                    moved = self.reactions[decision.move_aside]
+                    new_id = self._taken_ids.next_id(decision.move_aside)
+                    conflict('reaction_moved_aside', decision.move_aside,
+                             'Universal reaction %s from %s is renamed to %s by '
+                             'the hash prefs' % (decision.move_aside,
+                                                 moved.model, new_id))
+                    self._rename(moved, new_id)
+                new_id = decision.new_id
+                if new_id is None:
+                    new_id = self._taken_ids.next_id(reaction_id)
+                    kind = ('pseudoreaction_conflict'
+                            if id_match.pseudoreaction != pseudoreaction
+                            else 'reaction_id_conflict')
+                    conflict(kind, reaction_id,
+                             'Different stoichiometry from %s in %s, so it '
+                             'becomes %s' % (reaction_id, id_match.model, new_id))
+                universal = self._new_reaction(new_id, reaction_hash,
+                                               pseudoreaction, filename)
+
+            if universal.id in used:
+                conflict('duplicate_reaction', reaction_id,
+                         'Same stoichiometry as another reaction in the model, '
+                         'stored as a copy of %s' % universal.cobra_id)
+            used.add(universal.id)
+
+        return conflicts
+
+
+def validate_models(model_paths, processes=None):
+    """Parse the models in a process pool and check them against an in-memory
+    universe, in order. Returns a report that can be serialized to JSON.
+
+    Arguments
+    ---------
+
+    model_paths: The model files, in load order.
+
+    processes: The number of parsing processes. Defaults to the number of
+    CPUs.
+
+    """
+    start = time()
+    universe = Universe(load_tsv(settings.reaction_id_prefs),
+                        load_tsv(settings.reaction_hash_prefs))
+    models = []
+    conflicts = []
+
+    if processes == 1:
+        summaries = (summarize_model(path) for path in model_paths)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes)
+        summaries = pool.imap(summarize_model, model_paths)
+    try:
+        for i, summary in enumerate(summaries):
+            logging.info('Checking model ({} of {}) {}'
+                         .format(i + 1, len(model_paths), summary['filename']))
+            model_conflicts = universe.add_model(summary)
+            conflicts.extend(model_conflicts)
+            models.append({
+                'filename': summary['filename'],
+                'model_id': summary.get('model_id'),
+                'reactions': len(summary.get('reactions', [])),
+                'metabolites': len(summary.get('metabolites', [])),
+                'genes': summary.get('genes'),
+                'parse_seconds': summary.get('seconds'),
+                'conflicts': len(model_conflicts),
+            })
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return {
+        'models': models,
+        'conflicts': conflicts,
+        'counts': dict(Counter(c['kind'] for c in conflicts)),
+        'universal_reactions': len(universe.reactions),
+        'seconds': round(time() - start, 3),
+    }
+
+
+def write_report(report, filepath):
+    with open(filepath, 'w') as f:
+        json.dump(report, f, indent=2)
+    for kind, n in sorted(report['counts'].items()):
+        logging.info('%d %s' % (n, kind))
+    logging.info('Wrote the dry run report for %d models to %s' %
+                 (len(report['models']), filepath))
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+"""Process-wide maps from cobra_id to database ID for the universal
+metabolites, compartments and compartmentalized components, which are shared
+by most models.
+
+A cache is warmed with one query per table the first time it is used, and new
+rows are added as the loaders insert them. IDs added in a transaction are kept
+apart until the transaction commits, and are dropped on any rollback, so the
+cache never holds the ID of a row that was rolled back. A miss falls back to
+the database, so rows inserted by other processes are still found.
+
+"""
+
+from cobradb.components import Metabolite
+from cobradb.models import Compartment, CompartmentalizedComponent
+
+from sqlalchemy import event
+import logging
+
+
+# caches keyed by engine, so a shadow schema gets its own cache
+_identity_caches = {}
+
+KINDS = ['metabolite', 'compartment', 'compartmentalized_component']
+
+
+class IdentityCache(object):
+    """IDs for the universal metabolites, compartments and compartmentalized
+    components of one database.
+
+    Compartmentalized components are keyed by (component ID, compartment ID).
+
+    """
+
+    def __init__(self):
+        self._ids = {kind: {} for kind in KINDS}
+        self._pending = {kind: {} for kind in KINDS}
+        self.warm = False
+
+    def warm_up(self, session):
+        """Load all existing IDs, with one query per table."""
+        self._ids['metabolite'] = dict(
+            session.query(Metabolite.cobra_id, Metabolite.id)
+        )
+        self._ids['compartment'] = dict(
+            session.query(Compartment.cobra_id, Compartment.id)
+        )
+        self._ids['compartmentalized_component'] = {
+            (component_id, compartment_id): db_id for
+            component_id, compartment_id, db_id in
+            session.query(CompartmentalizedComponent.component_id,
+                          CompartmentalizedComponent.compartment_id,
+                          CompartmentalizedComponent.id)
+        }
+        self.warm = True
+        logging.debug('Warmed identity cache with %s' %
+                      ', '.join('%d %s IDs' % (len(self._ids[kind]), kind)
+                                for kind in KINDS))
+
+    def get(self, kind, key):
+        """Get a database ID, or None if it is not cached."""
+        db_id = self._pending[kind].get(key)
+        if db_id is None:
+            db_id = self._ids[kind].get(key)
+        return db_id
+
+    def add(self, kind, key, db_id):
+        """Add a database ID from the current transaction."""
+        if self._ids[kind].get(key) != db_id:
+            self._pending[kind][key] = db_id
+
+    def commit(self):
+        for kind in KINDS:
+            self._ids[kind].update(self._pending[kind])
+            self._pending[kind].clear()
+
+    def rollback(self):
+        for kind in KINDS:
+            self._pending[kind].clear()
+
+    def clear(self):
+        self.__init__()
+
+
+def _track_transactions(session, cache):
+    """Commit or roll back the pending IDs of the cache with the session."""
+    if session.info.get('identity_cache') is cache:
+        return
+    session.info['identity_cache'] = cache
+
+    @event.listens_for(session, 'after_commit')
+    def after_commit(session):
+        # savepoints fire after_commit too, but their rows are not committed yet
+        transaction = session.transaction
+        if transaction is None or transaction.parent is None:
+            cache.commit()
+
+    @event.listens_for(session, 'after_soft_rollback')
+    def after_soft_rollback(session, previous_transaction):
+        # A savepoint rollback might only undo some pending rows, but dropping
+        # them all is safe, because they will be found in the database again.
+        cache.rollback()
+
+
+def get_identity_cache(session):
+    """Get the identity cache for the database of the session, warming it if
+    necessary.
+
+    Arguments
+    ---------
+
+    session: An SQLAlchemy session.
+
+    """
+    engine = session.get_bind()
+    cache = _identity_caches.get(engine)
+    if cache is None:
+        cache = _identity_caches[engine] = IdentityCache()
+    if not cache.warm:
+        cache.warm_up(session)
+    _track_transactions(session, cache)
+    return cache
+
+
+def clear_identity_cache():
+    """Forget all cached IDs, e.g. after rows were deleted from the universal
+    tables.
+
+    """
+    _identity_caches.clear()
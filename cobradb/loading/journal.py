@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+"""A journal of the genomes, models and maps that load_db has finished, so an
+interrupted rebuild can be resumed with load_db --resume.
+
+Each unit is recorded with a fingerprint of its inputs after it is committed. A
+resumed run skips the units whose fingerprints still match before reading any
+files, so it does not scan the RefSeq directory, parse models or fetch maps
+that are already loaded. A model or map whose inputs changed is loaded again,
+replacing the loaded model. A loaded genome cannot be replaced, so a genome
+whose files changed is reported and left unrecorded until a rebuild.
+
+A crash between committing a unit and recording it only means the unit is tried
+again, and the loader then finds it already loaded.
+
+"""
+
+from cobradb import settings
+
+from sqlalchemy import text
+import hashlib
+import json
+import logging
+import os
+
+
+_create_load_journal = """
+CREATE TABLE IF NOT EXISTS load_journal (
+    kind text NOT NULL,
+    name text NOT NULL,
+    fingerprint text NOT NULL,
+    inputs text NOT NULL,
+    seconds double precision,
+    finished_at timestamp with time zone NOT NULL DEFAULT now(),
+    PRIMARY KEY (kind, name)
+)
+"""
+
+
+def create_journal(engine):
+    """Create the load_journal table if it does not exist."""
+    with engine.begin() as connection:
+        connection.execute(_create_load_journal)
+
+
+def clear_journal(engine, kinds=None):
+    """Forget the finished units, e.g. after dropping the models.
+
+    Arguments
+    ---------
+
+    engine: An SQLAlchemy engine.
+
+    kinds: A list of kinds to forget. Defaults to all.
+
+    """
+    with engine.begin() as connection:
+        if kinds is None:
+            connection.execute('DELETE FROM load_journal')
+        else:
+            connection.execute(text('DELETE FROM load_journal '
+                                    'WHERE kind = ANY(:kinds)'),
+                               kinds=list(kinds))
+
+
+def fingerprint(file_paths=(), **values):
+    """Get a fingerprint for the contents of the files and the other values,
+    which must be serializable to JSON. A missing file gives a fingerprint that
+    never matches a recorded one.
+
+    """
+    the_hash = hashlib.sha1()
+    the_hash.update(json.dumps(values, sort_keys=True).encode('utf8'))
+    for file_path in file_paths:
+        the_hash.update(os.path.basename(file_path).encode('utf8'))
+        try:
+            with open(file_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    the_hash.update(chunk)
+        except IOError:
+            return 'missing'
+    return the_hash.hexdigest()
+
+
+def model_fingerprint(model_filepath, pub_ref, genome_ref):
+    """Get the fingerprint of a model file, its references and the ID prefs
+    that change how it is loaded.
+
+    """
+    prefs = [p for p in [settings.reaction_id_prefs,
+                         settings.reaction_hash_prefs,
+                         settings.gene_reaction_rule_prefs]
+             if p is not None and os.path.exists(p)]
+    return fingerprint([model_filepath] + prefs, pub_ref=pub_ref,
+                       genome_ref=genome_ref)
+
+
+def completed(engine, kind):
+    """Get the finished units of a kind, as a dictionary from name to
+    (fingerprint, inputs).
+
+    """
+    with engine.connect() as connection:
+        return {name: (finger, json.loads(inputs))
+                for name, finger, inputs in connection.execute(
+                    text('SELECT name, fingerprint, inputs FROM load_journal '
+                         'WHERE kind = :kind'), kind=kind)}
+
+
+def is_done(engine, kind, name, finger):
+    """Check whether a unit was finished with the same fingerprint."""
+    with engine.connect() as connection:
+        return connection.execute(
+            text('SELECT count(*) > 0 FROM load_journal WHERE kind = :kind '
+                 'AND name = :name AND fingerprint = :fingerprint'),
+            kind=kind, name=name, fingerprint=finger
+        ).scalar()
+
+
+def record(engine, kind, name, finger, inputs=None, seconds=None):
+    """Record a finished unit.
+
+    Arguments
+    ---------
+
+    engine: An SQLAlchemy engine.
+
+    kind: genome, model or map.
+
+    name: A name that is unique for the kind.
+
+    finger: The fingerprint of the inputs.
+
+    inputs: Anything that a resumed run needs to rebuild the fingerprint
+    without searching for the inputs again, e.g. the paths of the files, as a
+    value that can be serialized to JSON.
+
+    seconds: The time it took to load the unit.
+
+    """
+    with engine.begin() as connection:
+        connection.execute(text(
+            'INSERT INTO load_journal (kind, name, fingerprint, inputs, seconds) '
+            'VALUES (:kind, :name, :fingerprint, :inputs, :seconds) '
+            'ON CONFLICT (kind, name) DO UPDATE SET '
+            'fingerprint = EXCLUDED.fingerprint, inputs = EXCLUDED.inputs, '
+            'seconds = EXCLUDED.seconds, finished_at = now()'
+        ), kind=kind, name=name, fingerprint=finger,
+            inputs=json.dumps(inputs), seconds=seconds)
+    logging.debug('Recorded %s %s in the load journal' % (kind, name))
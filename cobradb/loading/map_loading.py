@@ -2,20 +2,35 @@
 
 from cobradb import base
 from cobradb.models import *
-from cobradb.loading import parse
+from cobradb.loading import parse, journal
 
-from tornado.escape import url_escape
 import json
-import escher
 import logging
 import sys
 import re
 import six
 
-def load_maps_from_server(session, drop_maps=False):
+def load_maps_from_server(session, drop_maps=False, use_journal=False,
+                          resume=False):
+    """Load the Escher maps for the loaded models from the Escher server.
+
+    Arguments
+    ---------
+
+    session: An SQLAlchemy session.
+
+    drop_maps: If True, empty the map tables first.
+
+    use_journal: If True, record each loaded map in the load journal.
+
+    resume: If True, skip the maps that the load journal has.
+
+    """
+    import escher
+
     if drop_maps:
         logging.info('Dropping Escher maps')
-        connection = base.engine.connect()
+        connection = session.get_bind().connect()
         trans = connection.begin()
         try:
             connection.execute('TRUNCATE escher_map, escher_map_matrix CASCADE;')
@@ -23,6 +38,8 @@ def load_maps_from_server(session, drop_maps=False):
         except:
             logging.warn('Could not drop Escher tables')
             trans.rollback()
+        if use_journal:
+            journal.clear_journal(session.get_bind(), ['map'])
 
     logging.info('Getting index')
     index = escher.plots.server_index()
@@ -41,8 +58,18 @@ def load_maps_from_server(session, drop_maps=False):
                 # TODO remove: trick for matching E coli core to e_coli_core
                 m['map_name'].split('.')[0] == 'E coli core' and model_cobra_id == 'e_coli_core']
         for map_name, org in maps:
+            # a replaced model has a new ID and lost its maps, so they are
+            # loaded again
+            finger = journal.fingerprint(map_name=map_name, model=model_cobra_id,
+                                         model_id=model_id, organism=org)
+            if resume and journal.is_done(session.get_bind(), 'map', map_name,
+                                          finger):
+                logging.info('Skipping map %s, which is already loaded' % map_name)
+                continue
             map_json = escher.plots.map_json_for_name(map_name)
             load_the_map(session, model_id, map_name, map_json)
+            if use_journal:
+                journal.record(session.get_bind(), 'map', map_name, finger)
 
 def load_the_map(session, model_id, map_name, map_json):
     size = sys.getsizeof(map_json)
@@ -114,7 +141,8 @@ def load_the_map(session, model_id, map_name, map_json):
             mat_db = EscherMapMatrix(escher_map_id=escher_map_db.id,
                                      ome_id=model_reaction_id,
                                      escher_map_element_id=element_id,
-                                     type='model_reaction')
+                                     type='model_reaction',
+                                     model_id=escher_map_db.model_id)
             session.add(mat_db)
 
     logging.info('Adding metabolites')
@@ -172,7 +200,8 @@ def load_the_map(session, model_id, map_name, map_json):
             mat_db = EscherMapMatrix(escher_map_id=escher_map_db.id,
                                      ome_id=model_comp_comp_id,
                                      escher_map_element_id=element_id,
-                                     type='model_compartmentalized_component')
+                                     type='model_compartmentalized_component',
+                                     model_id=escher_map_db.model_id)
             session.add(mat_db)
     session.commit()
 
@@ -1,15 +1,18 @@
 # -*- coding: utf-8 -*-
 
-from cobradb import base, settings, components
+from cobradb import base, settings, components, profiling, schema, ids
 from cobradb.loading import AlreadyLoadedError
 from cobradb.dumping.model_dumping import dump_model
 from cobradb.base import *
 from cobradb.models import *
 from cobradb.components import *
 from cobradb.loading import parse
-from cobradb.util import (increment_id, check_pseudoreaction, load_tsv,
+from cobradb.loading.identity_cache import get_identity_cache
+from cobradb.util import (check_pseudoreaction, load_tsv,
+                          split_incremented_id, IncrementedIdAllocator,
                           get_or_create_data_source, format_formula, scrub_name,
-                          check_none, timing)
+                          check_none, timing, savepoint,
+                          insert_or_get_id)
 
 from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
 from sqlalchemy import func
@@ -22,7 +25,6 @@ try:
     import itertools.ifilter as filter
 except ImportError:
     pass
-import cobra.io
 import six
 
 
@@ -48,7 +50,7 @@ def check_for_model(name):
 
 
 @timing
-def load_model(model_filepath, pub_ref, genome_ref, session):
+def load_model(model_filepath, pub_ref, genome_ref, session, replace=False):
     """Load a model into the database. Returns the cobra_id for the new model.
 
     Arguments
@@ -69,15 +71,48 @@ def load_model(model_filepath, pub_ref, genome_ref, session):
 
     session: An instance of base.Session.
 
+    replace: If True, drop a loaded model with the same cobra_id in the same
+    transaction. Otherwise, raise AlreadyLoadedError.
+
     """
     # apply id normalization
     logging.debug('Parsing SBML')
     model, old_parsed_ids = parse.load_and_normalize(model_filepath)
+
+    # creating partitions locks the partitioned tables, so reserve the model ID
+    # and create them in a short transaction of their own
+    model_db_id = ids.allocate_ids(session, 1)[0]
+    schema.create_model_partitions(session.get_bind(), model_db_id)
+
+    # load everything in one transaction, so a failed load leaves nothing behind
+    try:
+        model_cobra_id = _load_model_objects(session, model, old_parsed_ids,
+                                             model_filepath, genome_ref,
+                                             pub_ref, replace, model_db_id)
+        session.commit()
+    except:
+        session.rollback()
+        schema.drop_model_partitions(session.get_bind(), model_db_id)
+        raise
+
+    return model_cobra_id
+
+
+def _load_model_objects(session, model, old_parsed_ids, model_filepath,
+                        genome_ref, pub_ref, replace=False, model_db_id=None):
     model_cobra_id = model.id
 
     # check that the model doesn't already exist
-    if session.query(Model).filter_by(cobra_id=model_cobra_id).count() > 0:
-        raise AlreadyLoadedError('Model %s already loaded' % model_cobra_id)
+    existing_ids = [x[0] for x in (session
+                                   .query(Model.id)
+                                   .filter(Model.cobra_id == model_cobra_id))]
+    if len(existing_ids) > 0:
+        if not replace:
+            raise AlreadyLoadedError('Model %s already loaded' % model_cobra_id)
+        logging.info('Replacing model %s' % model_cobra_id)
+        for model_db_id in existing_ids:
+            schema.drop_model(session.connection(), model_db_id)
+        session.expire_all()
 
     # check for a genome annotation for this model
     if genome_ref is not None and genome_ref[0] == 'organism':
@@ -103,7 +138,8 @@ def load_model(model_filepath, pub_ref, genome_ref, session):
     logging.debug('Loading objects for model {}'.format(model.id))
     published_filename = os.path.basename(model_filepath)
     model_database_id = load_new_model(session, model, genome_id, pub_ref,
-                                       published_filename, organism)
+                                       published_filename, organism,
+                                       model_db_id)
 
     # metabolites/components and linkouts
     # get compartment names
@@ -119,27 +155,29 @@ def load_model(model_filepath, pub_ref, genome_ref, session):
     else:
         logging.warn('No compartment names file')
         compartment_names = {}
-    load_metabolites(session, model_database_id, model, compartment_names,
-                     old_parsed_ids['metabolites'])
+    with profiling.phase('metabolites'):
+        load_metabolites(session, model_database_id, model, compartment_names,
+                         old_parsed_ids['metabolites'])
 
     # reactions
-    model_db_rxn_ids = load_reactions(session, model_database_id, model,
-                                      old_parsed_ids['reactions'])
+    with profiling.phase('reactions'):
+        model_db_rxn_ids = load_reactions(session, model_database_id, model,
+                                          old_parsed_ids['reactions'],
+                                          old_parsed_ids.get('pseudoreactions'))
 
     # genes
-    load_genes(session, model_database_id, model, model_db_rxn_ids,
-               old_parsed_ids['genes'])
+    with profiling.phase('genes'):
+        load_genes(session, model_database_id, model, model_db_rxn_ids,
+                   old_parsed_ids['genes'])
 
     # count model objects for the model summary web page
     load_model_count(session, model_database_id)
 
-    session.commit()
-
     return model_cobra_id
 
 
 def load_new_model(session, model, genome_db_id, pub_ref, published_filename,
-                   organism):
+                   organism, model_db_id=None):
     """Load the model.
 
     Arguments:
@@ -161,37 +199,37 @@ def load_new_model(session, model, genome_db_id, pub_ref, published_filename,
 
     organism: The organism. Can be None.
 
+    model_db_id: The database ID for the new model row, e.g. one reserved for
+    schema.create_model_partitions. If None, the ID comes from the sequence.
+
     Returns:
     -------
 
     The database ID of the new model row.
 
     """
-    model_db = Model(cobra_id=model.id, genome_id=genome_db_id,
+    model_db = Model(id=model_db_id, cobra_id=model.id,
+                     genome_id=genome_db_id,
                      published_filename=published_filename, organism=organism)
     session.add(model_db)
     if pub_ref is not None:
         ref_type, ref_id = pub_ref
-        publication_db = (session
-                            .query(Publication)
-                            .filter(Publication.reference_type==ref_type)
-                            .filter(Publication.reference_id==ref_id)
-                            .first())
-        if publication_db is None:
-            publication_db = Publication(reference_type=ref_type,
+        # models loaded at the same time can share a publication
+        publication_db_id, _ = insert_or_get_id(session, Publication,
+                                                ['reference_type', 'reference_id'],
+                                                reference_type=ref_type,
                                                 reference_id=ref_id)
-            session.add(publication_db)
-            session.commit()
+        session.flush()
         publication_model_db = (session
                                 .query(PublicationModel)
-                                .filter(PublicationModel.publication_id == publication_db.id)
+                                .filter(PublicationModel.publication_id == publication_db_id)
                                 .filter(PublicationModel.model_id == model_db.id)
                                 .first())
         if publication_model_db is None:
             publication_model_db = PublicationModel(model_id=model_db.id,
-                                                            publication_id=publication_db.id)
+                                                            publication_id=publication_db_id)
             session.add(publication_model_db)
-    session.commit()
+    session.flush()
     return model_db.id
 
 
@@ -270,6 +308,7 @@ def load_metabolites(session, model_id, model, compartment_names,
 
     # only grab this once
     data_source_id = get_or_create_data_source(session, 'old_cobra_id')
+    identity_cache = get_identity_cache(session)
 
     # for each metabolite in the model
     for metabolite in model.metabolites:
@@ -280,13 +319,6 @@ def load_metabolites(session, model_id, model, compartment_names,
                             'model %s' % (metabolite.id, model.id)))
             continue
 
-        # If there is no metabolite, add a new one.
-        # TODO we could also double check these ID matches with linkouts and formula
-        metabolite_db = (session
-                         .query(Metabolite)
-                         .filter(Metabolite.cobra_id == component_cobra_id)
-                         .first())
-
         # Look for the formula in these places
         formula_fns = [lambda m: getattr(m, 'formula', None), # support cobra v0.3 and 0.4
                        lambda m: m.notes.get('FORMULA', None),
@@ -310,23 +342,34 @@ def load_metabolites(session, model_id, model, compartment_names,
                               .format(metabolite.id, model.id, metabolite.charge))
             charge = None
 
-        # if necessary, add the new metabolite, and keep track of the ID
-        if metabolite_db is None:
+        # If there is no metabolite, add a new one, and keep track of the ID.
+        # TODO we could also double check these ID matches with linkouts and formula
+        metabolite_db_id = identity_cache.get('metabolite', component_cobra_id)
+        if metabolite_db_id is None:
+            metabolite_db_id = (session
+                                .query(Metabolite.id)
+                                .filter(Metabolite.cobra_id == component_cobra_id)
+                                .scalar())
+        if metabolite_db_id is None:
             # make the new metabolite
             metabolite_db = Metabolite(cobra_id=component_cobra_id,
                                        name=scrub_name(getattr(metabolite, 'name', None)))
             session.add(metabolite_db)
-            session.commit()
+            session.flush()
+            metabolite_db_id = metabolite_db.id
+        identity_cache.add('metabolite', component_cobra_id, metabolite_db_id)
 
         # load the linkouts for the universal metabolite
-        # _load_metabolite_linkouts(session, metabolite, metabolite_db.id)
+        # _load_metabolite_linkouts(session, metabolite, metabolite_db_id)
 
         # if there is no compartment, add a new one
-        compartment_db = (session
-                          .query(Compartment)
-                          .filter(Compartment.cobra_id == compartment_cobra_id)
-                          .first())
-        if compartment_db is None:
+        compartment_db_id = identity_cache.get('compartment', compartment_cobra_id)
+        if compartment_db_id is None:
+            compartment_db_id = (session
+                                 .query(Compartment.id)
+                                 .filter(Compartment.cobra_id == compartment_cobra_id)
+                                 .scalar())
+        if compartment_db_id is None:
             try:
                 name = compartment_names[compartment_cobra_id]
             except KeyError:
@@ -334,56 +377,65 @@ def load_metabolites(session, model_id, model, compartment_names,
                 name = ''
             compartment_db = Compartment(cobra_id=compartment_cobra_id, name=name)
             session.add(compartment_db)
-            session.commit()
+            session.flush()
+            compartment_db_id = compartment_db.id
+        identity_cache.add('compartment', compartment_cobra_id, compartment_db_id)
 
         # if there is no compartmentalized compartment, add a new one
-        comp_component_db = (session
-                             .query(CompartmentalizedComponent)
-                             .filter(CompartmentalizedComponent.component_id == metabolite_db.id)
-                             .filter(CompartmentalizedComponent.compartment_id == compartment_db.id)
-                             .first())
-        if comp_component_db is None:
-            comp_component_db = CompartmentalizedComponent(component_id=metabolite_db.id,
-                                                           compartment_id=compartment_db.id)
+        comp_key = (metabolite_db_id, compartment_db_id)
+        comp_component_db_id = identity_cache.get('compartmentalized_component',
+                                                  comp_key)
+        if comp_component_db_id is None:
+            comp_component_db_id = (session
+                                    .query(CompartmentalizedComponent.id)
+                                    .filter(CompartmentalizedComponent.component_id == metabolite_db_id)
+                                    .filter(CompartmentalizedComponent.compartment_id == compartment_db_id)
+                                    .scalar())
+        if comp_component_db_id is None:
+            comp_component_db = CompartmentalizedComponent(component_id=metabolite_db_id,
+                                                           compartment_id=compartment_db_id)
             session.add(comp_component_db)
-            session.commit()
+            session.flush()
+            comp_component_db_id = comp_component_db.id
+        identity_cache.add('compartmentalized_component', comp_key,
+                           comp_component_db_id)
 
         # if there is no model compartmentalized compartment, add a new one
         model_comp_comp_db = (session
                               .query(ModelCompartmentalizedComponent)
-                              .filter(ModelCompartmentalizedComponent.compartmentalized_component_id == comp_component_db.id)
+                              .filter(ModelCompartmentalizedComponent.compartmentalized_component_id == comp_component_db_id)
                               .filter(ModelCompartmentalizedComponent.model_id == model_id)
                               .first())
         if model_comp_comp_db is None:
             model_comp_comp_db = ModelCompartmentalizedComponent(model_id=model_id,
-                                                                 compartmentalized_component_id=comp_component_db.id,
+                                                                 compartmentalized_component_id=comp_component_db_id,
                                                                  formula=_formula,
                                                                  charge=charge)
             session.add(model_comp_comp_db)
-            session.commit()
+            session.flush()
         else:
             if model_comp_comp_db.formula is None:
                 model_comp_comp_db.formula = _formula
             if model_comp_comp_db.charge is None:
                 model_comp_comp_db.charge = charge
-            session.commit()
+            session.flush()
 
         # add synonyms
         for old_cobra_id_c in old_metabolite_ids[metabolite.id]:
             synonym_db = (session
                           .query(Synonym)
                           .filter(Synonym.type == 'compartmentalized_component')
-                          .filter(Synonym.ome_id == comp_component_db.id)
+                          .filter(Synonym.ome_id == comp_component_db_id)
                           .filter(Synonym.synonym == old_cobra_id_c)
                           .filter(Synonym.data_source_id == data_source_id)
                           .first())
             if synonym_db is None:
                 synonym_db = Synonym(type='compartmentalized_component',
-                                     ome_id=comp_component_db.id,
+                                     ome_id=comp_component_db_id,
                                      synonym=old_cobra_id_c,
                                      data_source_id=data_source_id)
                 session.add(synonym_db)
-                session.commit()
+                session.flush()
 
             # add OldIDSynonym
             old_id_db = (session
@@ -395,9 +447,10 @@ def load_metabolites(session, model_id, model, compartment_names,
             if old_id_db is None:
                 old_id_db = OldIDSynonym(type='model_compartmentalized_component',
                                          ome_id=model_comp_comp_db.id,
-                                         synonym_id=synonym_db.id)
+                                         synonym_id=synonym_db.id,
+                                         model_id=model_id)
                 session.add(old_id_db)
-                session.commit()
+                session.flush()
 
 
 def _new_reaction(session, reaction, cobra_id, reaction_hash, model_db_id, model,
@@ -410,7 +463,7 @@ def _new_reaction(session, reaction, cobra_id, reaction_hash, model_db_id, model
                            reaction_hash=reaction_hash,
                            pseudoreaction=is_pseudoreaction)
     session.add(reaction_db)
-    session.commit
+    session.flush()
 
     # for each reactant, add to the reaction matrix
     for metabolite, stoich in six.iteritems(reaction.metabolites):
@@ -455,7 +508,129 @@ def _new_reaction(session, reaction, cobra_id, reaction_hash, model_db_id, model
 
     return reaction_db
 
-def load_reactions(session, model_db_id, model, old_reaction_ids):
+def check_id_prefs(id_prefs, an_id, versus_id):
+    """Return True if an_id is preferred over versus_id in the rows of the
+    reaction_id_prefs file."""
+    for row in id_prefs:
+        try:
+            idx1 = row.index(an_id)
+            idx2 = row.index(versus_id)
+        except ValueError:
+            continue
+
+        return idx1 < idx2
+    return False
+
+
+def check_hash_prefs(hash_prefs, a_hash):
+    """Return the preferred BiGG ID for a_hash in the rows of the
+    reaction_hash_prefs file, or None."""
+    for row in hash_prefs:
+        if row[0] == a_hash:
+            return row[1]
+    return None
+
+
+class ReactionDecision(object):
+    """What load_reactions does with a reaction. See decide_reaction.
+
+    Attributes
+    ----------
+
+    case: The case in load_reactions, one of 0, 1, 2, 3a or 3b.
+
+    existing: The matching universal reaction to use, or None to make a new
+    one.
+
+    new_id: The cobra_id for the new reaction. None for case 2, where the new
+    reaction gets the next incremented ID for the reaction ID.
+
+    move_aside: For case 0, the cobra_id that a different universal reaction
+    might already have. That reaction gets an incremented ID first.
+
+    rename: For case 3a, the new cobra_id for the existing reaction, if the ID
+    prefs prefer the ID in the model.
+
+    """
+
+    def __init__(self, case, existing=None, new_id=None, move_aside=None,
+                 rename=None):
+        self.case = case
+        self.existing = existing
+        self.new_id = new_id
+        self.move_aside = move_aside
+        self.rename = rename
+
+
+def decide_reaction(reaction_id, id_match, hash_match, preferred_id, id_prefs):
+    """Decide how to match a model reaction to the universal reactions, without
+    touching the database. Used by load_reactions and the dry run.
+
+    Arguments
+    ---------
+
+    reaction_id: The reaction ID in the model.
+
+    id_match: The universal reaction with the same cobra_id, or None. Anything
+    with id and cobra_id attributes.
+
+    hash_match: A universal reaction with the same hash and pseudoreaction
+    flag, or None.
+
+    preferred_id: The preferred ID for the reaction hash from the
+    reaction_hash_prefs file, or None.
+
+    id_prefs: The rows of the reaction_id_prefs file.
+
+    """
+    # cobra_id match  hash match b==h  pseudoreaction  example                   function
+    #  n               n               n            first GAPD                _new_reaction (1)
+    #  n               n               y            first EX_glc_e            _new_reaction (1)
+    #  y               n               n            incorrect GAPD            _new_reaction & increment (2)
+    #  y               n               y            incorrect EX_glc_e        _new_reaction & increment (2)
+    #  n               y               n            GAPDH after GAPD          reaction = hash_reaction (3a)
+    #  n               y               y            EX_glc__e after EX_glc_e  reaction = hash_reaction (3a)
+    #  y               y         n     n            ?                         reaction = hash_reaction (3a)
+    #  y               y         n     y            ?                         reaction = hash_reaction (3a)
+    #  y               y         y     n            second GAPD               reaction = bigg_reaction (3b)
+    #  y               y         y     y            second EX_glc_e           reaction = bigg_reaction (3b)
+    # NOTE: only check pseudoreaction hash against other pseudoreactions
+
+    # (0) If there is a preferred ID, make that the new ID, and increment any old IDs
+    if preferred_id is not None:
+        # if the reaction already matches, just continue
+        if hash_match is not None and hash_match.cobra_id == preferred_id:
+            return ReactionDecision('0', existing=hash_match)
+        # otherwise, make the new reaction, moving aside any existing reaction
+        # with the preferred ID
+        return ReactionDecision('0', new_id=preferred_id, move_aside=preferred_id)
+
+    # (1) no cobra_id matches, no stoichiometry match or pseudoreaction, then
+    # make a new reaction
+    if id_match is None and hash_match is None:
+        return ReactionDecision('1', new_id=reaction_id)
+
+    # (2) cobra_id matches, but not the hash, then increment the cobra_id
+    if hash_match is None:
+        return ReactionDecision('2')
+
+    # (3) but found a stoichiometry match, then use the hash reaction match.
+    # WARNING TODO this requires that loaded metabolites always match on
+    # cobra_id, which should be the case.
+
+    # (3a)
+    if id_match is None or id_match.id != hash_match.id:
+        rename = (reaction_id
+                  if check_id_prefs(id_prefs, reaction_id, hash_match.cobra_id)
+                  else None)
+        return ReactionDecision('3a', existing=hash_match, rename=rename)
+
+    # (3b) BIGG ID matches a reaction with the same hash, then just continue
+    return ReactionDecision('3b', existing=id_match)
+
+
+def load_reactions(session, model_db_id, model, old_reaction_ids,
+                   pseudoreaction_ids=None):
     """Load the reactions and stoichiometries into the model.
 
     TODO if the reaction is already loaded, we need to check the stoichometry
@@ -474,6 +649,10 @@ def load_reactions(session, model_db_id, model, old_reaction_ids):
     old_reaction_ids: A dictionary where keys are new IDs and values are old IDs
     for reactions.
 
+    pseudoreaction_ids: The set of pseudoreaction IDs found by
+    parse.convert_ids. If None, each reaction ID is checked with
+    check_pseudoreaction.
+
     Returns
     -------
 
@@ -485,200 +664,145 @@ def load_reactions(session, model_db_id, model, old_reaction_ids):
     # only grab this once
     data_source_id = get_or_create_data_source(session, 'old_cobra_id')
 
-    # get reaction id_prefs
+    # get reaction id_prefs and hash_prefs
     id_prefs = load_tsv(settings.reaction_id_prefs)
-    def _check_id_prefs(an_id, versus_id):
-        """Return True if an_id is preferred over versus_id."""
-        for row in id_prefs:
-            try:
-                idx1 = row.index(an_id)
-                idx2 = row.index(versus_id)
-            except ValueError:
-                continue
-
-            return idx1 < idx2
-        return False
-
-    # get reaction hash_prefs
     hash_prefs = load_tsv(settings.reaction_hash_prefs)
-    def _check_hash_prefs(a_hash):
-        """Return the preferred BiGG ID for a_hash, or None."""
-        for row in hash_prefs:
-            if row[0] == a_hash:
-                return row[1]
-        return None
 
     model_db_rxn_ids = {}
     for reaction in model.reactions:
-        # get the reaction
-        reaction_db = (session
+        with savepoint(session, 'reaction %s in model %s' % (reaction.id, model.id)):
+            # get the reaction
+            reaction_db = (session
+                           .query(Reaction)
+                           .filter(Reaction.cobra_id == reaction.id)
+                           .first())
+
+            # check for pseudoreaction
+            if pseudoreaction_ids is None:
+                is_pseudoreaction = check_pseudoreaction(reaction.id)
+            else:
+                is_pseudoreaction = reaction.id in pseudoreaction_ids
+
+            # calculate the hash
+            reaction_hash = parse.hash_reaction(reaction)
+            hash_db = (session
                        .query(Reaction)
-                       .filter(Reaction.cobra_id == reaction.id)
+                       .filter(Reaction.reaction_hash == reaction_hash)
+                       .filter(Reaction.pseudoreaction == is_pseudoreaction)
                        .first())
 
-        # check for pseudoreaction
-        is_pseudoreaction = check_pseudoreaction(reaction.id)
-
-        # calculate the hash
-        reaction_hash = parse.hash_reaction(reaction)
-        hash_db = (session
-                   .query(Reaction)
-                   .filter(Reaction.reaction_hash == reaction_hash)
-                   .filter(Reaction.pseudoreaction == is_pseudoreaction)
-                   .first())
-
-        # cobra_id match  hash match b==h  pseudoreaction  example                   function
-        #  n               n               n            first GAPD                _new_reaction (1)
-        #  n               n               y            first EX_glc_e            _new_reaction (1)
-        #  y               n               n            incorrect GAPD            _new_reaction & increment (2)
-        #  y               n               y            incorrect EX_glc_e        _new_reaction & increment (2)
-        #  n               y               n            GAPDH after GAPD          reaction = hash_reaction (3a)
-        #  n               y               y            EX_glc__e after EX_glc_e  reaction = hash_reaction (3a)
-        #  y               y         n     n            ?                         reaction = hash_reaction (3a)
-        #  y               y         n     y            ?                         reaction = hash_reaction (3a)
-        #  y               y         y     n            second GAPD               reaction = bigg_reaction (3b)
-        #  y               y         y     y            second EX_glc_e           reaction = bigg_reaction (3b)
-        # NOTE: only check pseudoreaction hash against other pseudoreactions
-
-        def _find_new_incremented_id(session, original_id):
-            """Look for a reaction cobra_id that is not already taken."""
-            new_id = increment_id(original_id)
-            while True:
-                if session.query(Reaction).filter(Reaction.cobra_id == new_id).first() is None:
-                    return new_id
-                new_id = increment_id(new_id)
-
-        preferred_id = _check_hash_prefs(reaction_hash)
-        # (0) If there is a preferred ID, make that the new ID, and increment any old IDs
-        if preferred_id is not None:
-            # if the reaction already matches, just continue
-            if hash_db is not None and hash_db.cobra_id == preferred_id:
-                reaction_db = hash_db
-            # otherwise, make the new reaction
+            def _find_new_incremented_id(session, original_id):
+                """Look for a reaction cobra_id that is not already taken. All the
+                incremented IDs for the base ID are found with one prefix query."""
+                base, _ = split_incremented_id(original_id)
+                prefix = re.sub(r'([\\%_])', r'\\\1', base + '_')
+                taken = (session
+                         .query(Reaction.cobra_id)
+                         .filter(Reaction.cobra_id.like(prefix + '%', escape='\\')))
+                allocator = IncrementedIdAllocator(x[0] for x in taken)
+                return allocator.next_id(original_id)
+
+            decision = decide_reaction(reaction.id, reaction_db, hash_db,
+                                       check_hash_prefs(hash_prefs, reaction_hash),
+                                       id_prefs)
+            if decision.existing is not None:
+                reaction_db = decision.existing
+                if decision.rename is not None:
+                    logging.warn('Switching database reaction {} to cobra_id {} based on reaction hash and id_prefs file'
+                                .format(reaction_db.cobra_id, decision.rename, model.id))
+                    reaction_db.cobra_id = decision.rename
+                    session.flush()
             else:
-                # if existing reactions match the preferred reaction find a new,
-                # incremented id for the existing match
-                preferred_id_db = session.query(Reaction).filter(Reaction.cobra_id == preferred_id).first()
-                if preferred_id_db is not None:
-                    new_id = _find_new_incremented_id(session, preferred_id)
-                    logging.warn('Incrementing database reaction {} to {} and prefering {} (from model {}) based on hash preferences'
-                                .format(preferred_id, new_id, preferred_id, model.id))
-                    preferred_id_db.cobra_id = new_id
-                    session.commit()
-
-                # make a new reaction for the preferred_id
-                reaction_db = _new_reaction(session, reaction, preferred_id,
+                if decision.move_aside is not None:
+                    # if existing reactions match the preferred reaction find a new,
+                    # incremented id for the existing match
+                    preferred_id_db = session.query(Reaction).filter(Reaction.cobra_id == decision.move_aside).first()
+                    if preferred_id_db is not None:
+                        new_id = _find_new_incremented_id(session, decision.move_aside)
+                        logging.warn('Incrementing database reaction {} to {} and prefering {} (from model {}) based on hash preferences'
+                                    .format(decision.move_aside, new_id, decision.move_aside, model.id))
+                        preferred_id_db.cobra_id = new_id
+                        session.flush()
+                new_id = decision.new_id
+                if new_id is None:
+                    new_id = _find_new_incremented_id(session, reaction.id)
+                    logging.warn('Incrementing cobra_id {} to {} (from model {}) based on conflicting reaction hash'
+                                .format(reaction.id, new_id, model.id))
+                reaction_db = _new_reaction(session, reaction, new_id,
                                             reaction_hash, model_db_id, model,
                                             is_pseudoreaction)
 
-        # (1) no cobra_id matches, no stoichiometry match or pseudoreaction, then
-        # make a new reaction
-        elif reaction_db is None and hash_db is None:
-            reaction_db = _new_reaction(session, reaction, reaction.id,
-                                        reaction_hash, model_db_id, model,
-                                        is_pseudoreaction)
-
-        # (2) cobra_id matches, but not the hash, then increment the cobra_id
-        elif reaction_db is not None and hash_db is None:
-            # loop until we find a non-matching find non-matching ID
-            new_id = _find_new_incremented_id(session, reaction.id)
-            logging.warn('Incrementing cobra_id {} to {} (from model {}) based on conflicting reaction hash'
-                        .format(reaction.id, new_id, model.id))
-            reaction_db = _new_reaction(session, reaction, new_id,
-                                        reaction_hash, model_db_id, model,
-                                        is_pseudoreaction)
-
-        # (3) but found a stoichiometry match, then use the hash reaction match.
-        elif hash_db is not None:
-            # WARNING TODO this requires that loaded metabolites always match on
-            # cobra_id, which should be the case.
-
-            # (3a)
-            if reaction_db is None or reaction_db.id != hash_db.id:
-                is_preferred = _check_id_prefs(reaction.id, hash_db.cobra_id)
-                if is_preferred:
-                    logging.warn('Switching database reaction {} to cobra_id {} based on reaction hash and id_prefs file'
-                                .format(hash_db.cobra_id, reaction.id, model.id))
-                    hash_db.cobra_id = reaction.id
-                    session.commit()
-                reaction_db = hash_db
-            # (3b) BIGG ID matches a reaction with the same hash, then just continue
-            else:
-                pass
-
-        else:
-            raise Exception('Should not get here')
-
-        # subsystem
-        subsystem = check_none(reaction.subsystem.strip())
-
-        # get the model reaction
-        model_reaction_db = (session
-                             .query(ModelReaction)
-                             .filter(ModelReaction.reaction_id == reaction_db.id)
-                             .filter(ModelReaction.model_id == model_db_id)
-                             .filter(ModelReaction.lower_bound == reaction.lower_bound)
-                             .filter(ModelReaction.upper_bound == reaction.upper_bound)
-                             .filter(ModelReaction.gene_reaction_rule == reaction.gene_reaction_rule)
-                             .filter(ModelReaction.objective_coefficient == reaction.objective_coefficient)
-                             .filter(ModelReaction.subsystem == subsystem)
+            # subsystem
+            subsystem = check_none(reaction.subsystem.strip())
+
+            # get the model reaction
+            model_reaction_db = (session
+                                 .query(ModelReaction)
+                                 .filter(ModelReaction.reaction_id == reaction_db.id)
+                                 .filter(ModelReaction.model_id == model_db_id)
+                                 .filter(ModelReaction.lower_bound == reaction.lower_bound)
+                                 .filter(ModelReaction.upper_bound == reaction.upper_bound)
+                                 .filter(ModelReaction.gene_reaction_rule == reaction.gene_reaction_rule)
+                                 .filter(ModelReaction.objective_coefficient == reaction.objective_coefficient)
+                                 .filter(ModelReaction.subsystem == subsystem)
+                                 .first())
+            if model_reaction_db is None:
+                # get the number of existing copies of this reaction in the model
+                copy_number = (session
+                               .query(ModelReaction)
+                               .filter(ModelReaction.reaction_id == reaction_db.id)
+                               .filter(ModelReaction.model_id == model_db_id)
+                               .count()) + 1
+                # make a new reaction
+                model_reaction_db = ModelReaction(model_id=model_db_id,
+                                                  reaction_id=reaction_db.id,
+                                                  gene_reaction_rule=reaction.gene_reaction_rule,
+                                                  original_gene_reaction_rule=reaction.gene_reaction_rule,
+                                                  upper_bound=reaction.upper_bound,
+                                                  lower_bound=reaction.lower_bound,
+                                                  objective_coefficient=reaction.objective_coefficient,
+                                                  copy_number=copy_number,
+                                                  subsystem=subsystem)
+                session.add(model_reaction_db)
+                session.flush()
+
+            # remember the changed ids
+            model_db_rxn_ids[reaction.id] = model_reaction_db.id
+
+            # add synonyms
+            #
+            # get the id from the published model
+            for old_cobra_id in old_reaction_ids[reaction.id]:
+                # add a synonym
+                synonym_db = (session
+                              .query(Synonym)
+                              .filter(Synonym.type == 'reaction')
+                              .filter(Synonym.ome_id == reaction_db.id)
+                              .filter(Synonym.synonym == old_cobra_id)
+                              .filter(Synonym.data_source_id == data_source_id)
+                              .first())
+                if synonym_db is None:
+                    synonym_db = Synonym(type='reaction',
+                                         ome_id=reaction_db.id,
+                                         synonym=old_cobra_id,
+                                         data_source_id=data_source_id)
+                    session.add(synonym_db)
+                    session.flush()
+
+                # add OldIDSynonym
+                old_id_db = (session
+                             .query(OldIDSynonym)
+                             .filter(OldIDSynonym.type == 'model_reaction')
+                             .filter(OldIDSynonym.ome_id == model_reaction_db.id)
+                             .filter(OldIDSynonym.synonym_id == synonym_db.id)
                              .first())
-        if model_reaction_db is None:
-            # get the number of existing copies of this reaction in the model
-            copy_number = (session
-                           .query(ModelReaction)
-                           .filter(ModelReaction.reaction_id == reaction_db.id)
-                           .filter(ModelReaction.model_id == model_db_id)
-                           .count()) + 1
-            # make a new reaction
-            model_reaction_db = ModelReaction(model_id=model_db_id,
-                                              reaction_id=reaction_db.id,
-                                              gene_reaction_rule=reaction.gene_reaction_rule,
-                                              original_gene_reaction_rule=reaction.gene_reaction_rule,
-                                              upper_bound=reaction.upper_bound,
-                                              lower_bound=reaction.lower_bound,
-                                              objective_coefficient=reaction.objective_coefficient,
-                                              copy_number=copy_number,
-                                              subsystem=subsystem)
-            session.add(model_reaction_db)
-            session.commit()
-
-        # remember the changed ids
-        model_db_rxn_ids[reaction.id] = model_reaction_db.id
-
-        # add synonyms
-        #
-        # get the id from the published model
-        for old_cobra_id in old_reaction_ids[reaction.id]:
-            # add a synonym
-            synonym_db = (session
-                          .query(Synonym)
-                          .filter(Synonym.type == 'reaction')
-                          .filter(Synonym.ome_id == reaction_db.id)
-                          .filter(Synonym.synonym == old_cobra_id)
-                          .filter(Synonym.data_source_id == data_source_id)
-                          .first())
-            if synonym_db is None:
-                synonym_db = Synonym(type='reaction',
-                                     ome_id=reaction_db.id,
-                                     synonym=old_cobra_id,
-                                     data_source_id=data_source_id)
-                session.add(synonym_db)
-                session.commit()
-
-            # add OldIDSynonym
-            old_id_db = (session
-                         .query(OldIDSynonym)
-                         .filter(OldIDSynonym.type == 'model_reaction')
-                         .filter(OldIDSynonym.ome_id == model_reaction_db.id)
-                         .filter(OldIDSynonym.synonym_id == synonym_db.id)
-                         .first())
-            if old_id_db is None:
-                old_id_db = OldIDSynonym(type='model_reaction',
-                                         ome_id=model_reaction_db.id,
-                                         synonym_id=synonym_db.id)
-                session.add(old_id_db)
-                session.commit()
+                if old_id_db is None:
+                    old_id_db = OldIDSynonym(type='model_reaction',
+                                             ome_id=model_reaction_db.id,
+                                             synonym_id=synonym_db.id,
+                                             model_id=model_db_id)
+                    session.add(old_id_db)
+                    session.flush()
 
     return model_db_rxn_ids
 
@@ -829,142 +953,145 @@ def load_genes(session, model_db_id, model, model_db_rxn_ids, old_gene_ids):
     for reaction in model.reactions:
         # find the ModelReaction that corresponds to this particular reaction in
         # the model
-        model_reaction_db = (session
-                             .query(ModelReaction)
-                             .get(model_db_rxn_ids[reaction.id]))
+        model_reaction_id = model_db_rxn_ids.get(reaction.id)
+        model_reaction_db = (None if model_reaction_id is None else
+                             session.query(ModelReaction).get(model_reaction_id))
         if model_reaction_db is None:
             logging.error('Could not find ModelReaction {} for {} in model {}. Cannot load GeneReactionMatrix entries'
-                          .format(model_db_rxn_ids[reaction.id], reaction.id, model.id))
+                          .format(model_reaction_id, reaction.id, model.id))
             continue
         for gene in reaction.genes:
             gene_cobra_id_to_model_reaction_db_ids[gene.id].add(model_reaction_db.id)
 
     # load the genes
     for gene in model.genes:
-        if len(chromosome_ids) == 0:
-            gene_db = None; is_alternative_transcript = False
-        else:
-            # find a matching gene
-            fns = [_by_cobra_id, _by_name, _by_synonym, _by_alternative_transcript,
-                   _by_alternative_transcript_name, _by_alternative_transcript_synonym,
-                   _by_cobra_id_no_underscore]
-            gene_db, is_alternative_transcript = _match_gene_by_fns(fns, session,
-                                                                    gene.id,
-                                                                    chromosome_ids)
-
-        if not gene_db:
-            # add
-            if len(chromosome_ids) > 0:
-                logging.warn('Gene not in genbank file: {} from model {}'
-                            .format(gene.id, model.id))
-            gene_db = Gene(cobra_id=gene.id,
-                           # name is optional in cobra 0.4b2. This will probably change back.
-                           name=scrub_name(getattr(gene, 'name', None)),
-                           mapped_to_genbank=False)
-            session.add(gene_db)
-            session.commit()
-
-        elif is_alternative_transcript:
-            # duplicate gene for the alternative transcript
-            old_gene_db = gene_db
-            ome_gene = {}
-            ome_gene['cobra_id'] = gene.id
-            ome_gene['name'] = old_gene_db.name
-            ome_gene['leftpos'] = old_gene_db.leftpos
-            ome_gene['rightpos'] = old_gene_db.rightpos
-            ome_gene['chromosome_id'] = old_gene_db.chromosome_id
-            ome_gene['strand'] = old_gene_db.strand
-            ome_gene['mapped_to_genbank'] = True
-            ome_gene['alternative_transcript_of'] = old_gene_db.id
-            gene_db = Gene(**ome_gene)
-            session.add(gene_db)
-            session.commit()
-
-            # duplicate all the synonyms
-            synonyms_db = (session
-                           .query(Synonym)
-                           .filter(Synonym.ome_id == old_gene_db.id)
-                           .all())
-            for syn_db in synonyms_db:
-                # add a new synonym
-                ome_synonym = {}
-                ome_synonym['type'] = syn_db.type
-                ome_synonym['ome_id'] = gene_db.id
-                ome_synonym['synonym'] = syn_db.synonym
-                ome_synonym['data_source_id'] = syn_db.data_source_id
-                synonym_object = Synonym(**ome_synonym)
-                session.add(synonym_object)
-
-        # add model gene
-        model_gene_db = (session
-                         .query(ModelGene)
-                         .filter(ModelGene.gene_id == gene_db.id)
-                         .filter(ModelGene.model_id == model_db_id)
-                         .first())
-        if model_gene_db is None:
-            model_gene_db = ModelGene(gene_id=gene_db.id,
-                                      model_id=model_db_id)
-            session.add(model_gene_db)
-            session.commit()
-
-        # add old gene synonym
-        for old_cobra_id in old_gene_ids[gene.id]:
-            synonym_db = (session
-                          .query(Synonym)
-                          .filter(Synonym.type == 'gene')
-                          .filter(Synonym.ome_id == gene_db.id)
-                          .filter(Synonym.synonym == old_cobra_id)
-                          .filter(Synonym.data_source_id == data_source_id)
-                          .first())
-            if synonym_db is None:
-                synonym_db = Synonym(type='gene',
-                                     ome_id=gene_db.id,
-                                     synonym=old_cobra_id,
-                                     data_source_id=data_source_id)
-                session.add(synonym_db)
-                session.commit()
-            # add OldIDSynonym
-            old_id_db = (session
-                         .query(OldIDSynonym)
-                         .filter(OldIDSynonym.type == 'model_gene')
-                         .filter(OldIDSynonym.ome_id == model_gene_db.id)
-                         .filter(OldIDSynonym.synonym_id == synonym_db.id)
-                         .first())
-            if old_id_db is None:
-                old_id_db = OldIDSynonym(type='model_gene',
-                                        ome_id=model_gene_db.id,
-                                        synonym_id=synonym_db.id)
-                session.add(old_id_db)
-                session.commit()
-
-        # find model reaction
-        try:
-            model_reaction_db_ids = gene_cobra_id_to_model_reaction_db_ids[gene.id]
-        except KeyError:
-            # error message above
-            continue
+        with savepoint(session, 'gene %s in model %s' % (gene.id, model.id)):
+            if len(chromosome_ids) == 0:
+                gene_db = None; is_alternative_transcript = False
+            else:
+                # find a matching gene
+                fns = [_by_cobra_id, _by_name, _by_synonym, _by_alternative_transcript,
+                       _by_alternative_transcript_name, _by_alternative_transcript_synonym,
+                       _by_cobra_id_no_underscore]
+                gene_db, is_alternative_transcript = _match_gene_by_fns(fns, session,
+                                                                        gene.id,
+                                                                        chromosome_ids)
+
+            if not gene_db:
+                # add
+                if len(chromosome_ids) > 0:
+                    logging.warn('Gene not in genbank file: {} from model {}'
+                                .format(gene.id, model.id))
+                gene_db = Gene(cobra_id=gene.id,
+                               # name is optional in cobra 0.4b2. This will probably change back.
+                               name=scrub_name(getattr(gene, 'name', None)),
+                               mapped_to_genbank=False)
+                session.add(gene_db)
+                session.flush()
+
+            elif is_alternative_transcript:
+                # duplicate gene for the alternative transcript
+                old_gene_db = gene_db
+                ome_gene = {}
+                ome_gene['cobra_id'] = gene.id
+                ome_gene['name'] = old_gene_db.name
+                ome_gene['leftpos'] = old_gene_db.leftpos
+                ome_gene['rightpos'] = old_gene_db.rightpos
+                ome_gene['chromosome_id'] = old_gene_db.chromosome_id
+                ome_gene['strand'] = old_gene_db.strand
+                ome_gene['mapped_to_genbank'] = True
+                ome_gene['alternative_transcript_of'] = old_gene_db.id
+                gene_db = Gene(**ome_gene)
+                session.add(gene_db)
+                session.flush()
+
+                # duplicate all the synonyms
+                synonyms_db = (session
+                               .query(Synonym)
+                               .filter(Synonym.ome_id == old_gene_db.id)
+                               .all())
+                for syn_db in synonyms_db:
+                    # add a new synonym
+                    ome_synonym = {}
+                    ome_synonym['type'] = syn_db.type
+                    ome_synonym['ome_id'] = gene_db.id
+                    ome_synonym['synonym'] = syn_db.synonym
+                    ome_synonym['data_source_id'] = syn_db.data_source_id
+                    synonym_object = Synonym(**ome_synonym)
+                    session.add(synonym_object)
+
+            # add model gene
+            model_gene_db = (session
+                             .query(ModelGene)
+                             .filter(ModelGene.gene_id == gene_db.id)
+                             .filter(ModelGene.model_id == model_db_id)
+                             .first())
+            if model_gene_db is None:
+                model_gene_db = ModelGene(gene_id=gene_db.id,
+                                          model_id=model_db_id)
+                session.add(model_gene_db)
+                session.flush()
+
+            # add old gene synonym
+            for old_cobra_id in old_gene_ids[gene.id]:
+                synonym_db = (session
+                              .query(Synonym)
+                              .filter(Synonym.type == 'gene')
+                              .filter(Synonym.ome_id == gene_db.id)
+                              .filter(Synonym.synonym == old_cobra_id)
+                              .filter(Synonym.data_source_id == data_source_id)
+                              .first())
+                if synonym_db is None:
+                    synonym_db = Synonym(type='gene',
+                                         ome_id=gene_db.id,
+                                         synonym=old_cobra_id,
+                                         data_source_id=data_source_id)
+                    session.add(synonym_db)
+                    session.flush()
+                # add OldIDSynonym
+                old_id_db = (session
+                             .query(OldIDSynonym)
+                             .filter(OldIDSynonym.type == 'model_gene')
+                             .filter(OldIDSynonym.ome_id == model_gene_db.id)
+                             .filter(OldIDSynonym.synonym_id == synonym_db.id)
+                             .first())
+                if old_id_db is None:
+                    old_id_db = OldIDSynonym(type='model_gene',
+                                            ome_id=model_gene_db.id,
+                                            synonym_id=synonym_db.id,
+                                            model_id=model_db_id)
+                    session.add(old_id_db)
+                    session.flush()
+
+            # find model reaction
+            try:
+                model_reaction_db_ids = gene_cobra_id_to_model_reaction_db_ids[gene.id]
+            except KeyError:
+                # error message above
+                continue
 
-        for mr_db_id in model_reaction_db_ids:
-            # add to the GeneReactionMatrix, if not already present
-            found_gene_reaction_row = (session
-                                       .query(GeneReactionMatrix)
-                                       .filter(GeneReactionMatrix.model_gene_id == model_gene_db.id)
-                                       .filter(GeneReactionMatrix.model_reaction_id == mr_db_id)
-                                       .count() > 0)
-            if not found_gene_reaction_row:
-                new_object = GeneReactionMatrix(model_gene_id=model_gene_db.id,
-                                                model_reaction_id=mr_db_id)
-                session.add(new_object)
-
-            # update the gene_reaction_rule if the gene id has changed
-            if gene.id != gene_db.cobra_id:
-                mr = session.query(ModelReaction).get(mr_db_id)
-                new_rule = _replace_gene_str(mr.gene_reaction_rule, gene.id,
-                                             gene_db.cobra_id)
-                (session
-                .query(ModelReaction)
-                .filter(ModelReaction.id == mr_db_id)
-                .update({ModelReaction.gene_reaction_rule: new_rule}))
+            for mr_db_id in model_reaction_db_ids:
+                # add to the GeneReactionMatrix, if not already present
+                found_gene_reaction_row = (session
+                                           .query(GeneReactionMatrix)
+                                           .filter(GeneReactionMatrix.model_gene_id == model_gene_db.id)
+                                           .filter(GeneReactionMatrix.model_reaction_id == mr_db_id)
+                                           .count() > 0)
+                if not found_gene_reaction_row:
+                    new_object = GeneReactionMatrix(model_id=model_db_id,
+                                                    model_gene_id=model_gene_db.id,
+                                                    model_reaction_id=mr_db_id)
+                    session.add(new_object)
+
+                # update the gene_reaction_rule if the gene id has changed
+                if gene.id != gene_db.cobra_id:
+                    mr = session.query(ModelReaction).get(mr_db_id)
+                    new_rule = _replace_gene_str(mr.gene_reaction_rule, gene.id,
+                                                 gene_db.cobra_id)
+                    (session
+                    .query(ModelReaction)
+                    .filter(ModelReaction.id == mr_db_id)
+                    .update({ModelReaction.gene_reaction_rule: new_rule}))
 
 
 def load_model_count(session, model_db_id):
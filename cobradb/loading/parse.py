@@ -1,18 +1,20 @@
 # -*- coding: utf-8 -*-
 
 from cobradb.base import NotFoundError
-from cobradb.util import scrub_gene_id, load_tsv, increment_id
-from cobradb import settings
+from cobradb.util import (scrub_gene_id, load_tsv, increment_id,
+                          check_pseudoreaction, IncrementedIdAllocator)
+from cobradb import settings, profiling
 
 import re
-import cobra
-import cobra.io
-from cobra.core import Formula
-from os.path import join
+import os
+from os.path import join, dirname
 import hashlib
 import logging
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from six.moves import cPickle as pickle
 import six
+import sys
+import tempfile
 
 
 def _hash_fn(s):
@@ -54,21 +56,408 @@ def hash_reaction(reaction, string_only=False):
     return hash_metabolite_dictionary(the_dict, string_only)
 
 
-def load_and_normalize(model_filepath):
-    """Load a model, and give it a particular id style"""
+# Increase this whenever convert_ids or get_formulas_from_names change their
+# output, so cached models are normalized again.
+NORMALIZER_VERSION = 4
 
-    # load the model
-    if model_filepath.endswith('.xml'):
-        model = cobra.io.read_sbml_model(model_filepath)
-    elif model_filepath.endswith('.mat'):
-        model = cobra.io.load_matlab_model(model_filepath)
+
+def _file_hash(filepath, the_hash):
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            the_hash.update(chunk)
+
+
+def model_cache_path(model_filepath):
+    """Get the path of the normalized model cache file for a model file, or None
+    if settings.model_cache_directory is not set.
+
+    The cache key covers the model file, the gene_reaction_rule prefs, the
+    normalizer version, and the versions of cobra and Python.
+
+    """
+    import cobra
+
+    if settings.model_cache_directory is None:
+        return None
+    the_hash = hashlib.sha1()
+    _file_hash(model_filepath, the_hash)
+    rule_prefs = settings.gene_reaction_rule_prefs
+    if rule_prefs is not None and os.path.exists(rule_prefs):
+        _file_hash(rule_prefs, the_hash)
+    the_hash.update(('%d %s %d.%d' % (NORMALIZER_VERSION, cobra.__version__,
+                                      sys.version_info[0], sys.version_info[1]))
+                    .encode('utf8'))
+    return join(settings.model_cache_directory,
+                '%s.pickle' % the_hash.hexdigest())
+
+
+def _read_cached_model(cache_path):
+    try:
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f)
+    except IOError:
+        return None
+    except Exception as e:
+        logging.warning('Could not read cached model %s: %s' % (cache_path, e))
+        return None
+
+
+def _write_cached_model(cache_path, model, old_ids):
+    cache_dir = dirname(cache_path)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # write to a temporary file first, so readers never see part of a file
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((model, old_ids), f, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp_path, cache_path)
+    except (IOError, OSError) as e:
+        logging.warning('Could not write cached model %s: %s' % (cache_path, e))
+
+
+# --------------------------------------------------------------------
+# SBML
+# --------------------------------------------------------------------
+
+class UnsupportedSBML(Exception):
+    pass
+
+
+_reg_sbml_escape = re.compile(r'__(\d+)__')
+
+
+def _sbml_id(sid, prefix):
+    """Decode an SBML id and clip its prefix, like cobra.io.read_sbml_model."""
+    if prefix == 'G_':
+        sid = sid.replace('__SBML_DOT__', '.')
+    sid = _reg_sbml_escape.sub(lambda m: six.unichr(int(m.group(1))), sid)
+    return sid[len(prefix):] if sid.startswith(prefix) else sid
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _attributes(elem):
+    """Get the attributes of an element keyed by local name, so core and fbc
+    attributes are found in any namespace."""
+    return {_local_name(k): v for k, v in six.iteritems(elem.attrib)}
+
+
+def _children(elem, name):
+    return [child for child in elem
+            if isinstance(child.tag, six.string_types) and
+            _local_name(child.tag) == name]
+
+
+def _child(elem, name):
+    children = _children(elem, name)
+    return children[0] if len(children) > 0 else None
+
+
+def _sbml_notes(elem):
+    """Get the KEY: value paragraphs of the notes of an element."""
+    notes = {}
+    notes_elem = _child(elem, 'notes')
+    if notes_elem is None:
+        return notes
+    for p in notes_elem.iter():
+        if not isinstance(p.tag, six.string_types) or _local_name(p.tag) != 'p':
+            continue
+        try:
+            key, value = ''.join(p.itertext()).split(':', 1)
+        except ValueError:
+            continue
+        if value.strip() != '':
+            notes[key.strip()] = value.strip()
+    return notes
+
+
+def _gene_association(elem):
+    """Get a gene_reaction_rule string from an fbc association element."""
+    name = _local_name(elem.tag)
+    if name == 'geneProductRef':
+        return _sbml_id(_attributes(elem)['geneProduct'], 'G_')
+    elif name in ('and', 'or'):
+        parts = [_gene_association(child) for child in elem
+                 if isinstance(child.tag, six.string_types)]
+        return '(%s)' % (' %s ' % name).join(parts)
+    raise UnsupportedSBML('Unknown gene association element %s' % name)
+
+
+def _kinetic_law_parameters(reaction_elem):
+    kinetic_law = _child(reaction_elem, 'kineticLaw')
+    if kinetic_law is None:
+        return {}
+    return {attrs.get('id'): float(attrs['value'])
+            for attrs in (_attributes(p) for p in kinetic_law.iter()
+                          if isinstance(p.tag, six.string_types) and
+                          _local_name(p.tag) in ('parameter', 'localParameter'))
+            if 'value' in attrs}
+
+
+def _read_reaction(elem, level):
+    attrs = _attributes(elem)
+    stoichiometry = defaultdict(float)
+    for list_name, sign in [('listOfReactants', -1), ('listOfProducts', 1)]:
+        list_elem = _child(elem, list_name)
+        if list_elem is None:
+            continue
+        for ref in _children(list_elem, 'speciesReference'):
+            if _child(ref, 'stoichiometryMath') is not None:
+                raise UnsupportedSBML('stoichiometryMath in reaction %s' % attrs['id'])
+            ref_attrs = _attributes(ref)
+            if 'stoichiometry' in ref_attrs:
+                coefficient = float(ref_attrs['stoichiometry'])
+            elif level == 2:
+                coefficient = 1.0
+            else:
+                raise UnsupportedSBML('No stoichiometry in reaction %s' % attrs['id'])
+            stoichiometry[ref_attrs['species']] += sign * coefficient
+
+    notes = _sbml_notes(elem)
+    association = _child(elem, 'geneProductAssociation')
+    if association is not None:
+        children = [child for child in association
+                    if isinstance(child.tag, six.string_types)]
+        gene_reaction_rule = (_gene_association(children[0])
+                              if len(children) > 0 else '')
+        if gene_reaction_rule.startswith('('):
+            gene_reaction_rule = gene_reaction_rule[1:-1]
     else:
-       raise Exception('The %s file is not a valid filetype', model_filepath)
-    # convert the ids
-    model, old_ids = convert_ids(model)
+        gene_reaction_rule = notes.get('GENE_ASSOCIATION',
+                                       notes.get('GENE ASSOCIATION', ''))
+
+    parameters = _kinetic_law_parameters(elem)
+    return {'id': attrs['id'],
+            'name': attrs.get('name', '').strip(),
+            'stoichiometry': stoichiometry,
+            'lower_bound': attrs.get('lowerFluxBound',
+                                     parameters.get('LOWER_BOUND')),
+            'upper_bound': attrs.get('upperFluxBound',
+                                     parameters.get('UPPER_BOUND')),
+            'objective_coefficient': parameters.get('OBJECTIVE_COEFFICIENT', 0),
+            'gene_reaction_rule': gene_reaction_rule,
+            'subsystem': notes.get('SUBSYSTEM', ''),
+            'notes': notes}
+
+
+def _clear(elem):
+    # free the memory for elements that have been read
+    elem.clear()
+    while elem.getprevious() is not None:
+        del elem.getparent()[0]
+
+
+def read_sbml_iterparse(model_filepath):
+    """Read the parts of an SBML model that the loader uses by streaming through
+    the file with lxml, and build a cobra Model. Supports SBML level 2 with
+    COBRA notes, and level 3 with fbc version 2 and groups. Raises
+    UnsupportedSBML for anything else, including boundary species, which cobra
+    converts to exchange reactions.
+
+    Arguments
+    ---------
+
+    model_filepath: The path to an SBML file.
+
+    """
+    from lxml import etree
+    from cobra import Model, Metabolite, Reaction
+
+    level = None
+    model_attrs = None
+    compartments = OrderedDict()
+    species = OrderedDict()
+    parameters = {}
+    reactions = []
+    gene_names = {}
+    objective = None
+    active_objective = None
+    group_subsystems = {}
+
+    for event, elem in etree.iterparse(model_filepath, events=('start', 'end'),
+                                       huge_tree=True):
+        name = _local_name(elem.tag)
+        if event == 'start':
+            if name == 'sbml':
+                level = int(elem.get('level'))
+                if level not in (2, 3):
+                    raise UnsupportedSBML('SBML level %d' % level)
+                if any('/fbc/version' in ns and not ns.endswith('/fbc/version2')
+                       for ns in elem.nsmap.values()):
+                    raise UnsupportedSBML('Only fbc version 2 is supported')
+            elif name == 'model':
+                model_attrs = _attributes(elem)
+            elif name == 'listOfObjectives':
+                active_objective = _attributes(elem).get('activeObjective')
+            continue
+
+        if name == 'compartment':
+            attrs = _attributes(elem)
+            compartments[attrs['id']] = attrs.get('name', '')
+        elif name == 'species':
+            attrs = _attributes(elem)
+            if attrs.get('boundaryCondition') == 'true':
+                raise UnsupportedSBML('Boundary species %s' % attrs['id'])
+            attrs['notes'] = _sbml_notes(elem)
+            species[attrs['id']] = attrs
+            _clear(elem)
+        elif name == 'parameter' and _local_name(elem.getparent().getparent().tag) == 'model':
+            attrs = _attributes(elem)
+            parameters[attrs['id']] = float(attrs['value'])
+        elif name == 'reaction':
+            reactions.append(_read_reaction(elem, level))
+            _clear(elem)
+        elif name == 'geneProduct':
+            attrs = _attributes(elem)
+            gene_names[_sbml_id(attrs['id'], 'G_')] = attrs.get('name', '')
+            _clear(elem)
+        elif name == 'objective':
+            attrs = _attributes(elem)
+            if objective is None or attrs.get('id') == active_objective:
+                objective = {
+                    ref.get('reaction'): float(ref.get('coefficient'))
+                    for ref in ({_local_name(k): v for k, v in six.iteritems(x.attrib)}
+                                for x in elem.iter()
+                                if isinstance(x.tag, six.string_types) and
+                                _local_name(x.tag) == 'fluxObjective')
+                }
+        elif name == 'group':
+            attrs = _attributes(elem)
+            for member in elem.iter():
+                if (isinstance(member.tag, six.string_types) and
+                        _local_name(member.tag) == 'member'):
+                    member_attrs = _attributes(member)
+                    if 'idRef' in member_attrs:
+                        group_subsystems[member_attrs['idRef']] = attrs.get('name', '')
+
+    if model_attrs is None or model_attrs.get('id') is None:
+        raise UnsupportedSBML('No model ID')
+
+    model = Model(model_attrs['id'])
+    model.name = model_attrs.get('name', '')
+    model.compartments = compartments
+
+    metabolites = OrderedDict()
+    for sbml_id, attrs in six.iteritems(species):
+        notes = attrs['notes']
+        # level 2 COBRA files keep the formula and charge in the notes
+        metabolite = Metabolite(_sbml_id(sbml_id, 'M_'),
+                                formula=attrs.get('chemicalFormula',
+                                                  notes.get('FORMULA')),
+                                name=attrs.get('name', ''),
+                                compartment=attrs.get('compartment'))
+        charge = attrs.get('charge', notes.get('CHARGE'))
+        if charge is not None:
+            try:
+                metabolite.charge = int(float(charge))
+            except ValueError:
+                pass
+        metabolite.notes = notes
+        metabolites[sbml_id] = metabolite
+
+    def bound(value, reaction_id):
+        if value is None:
+            raise UnsupportedSBML('Missing flux bound for reaction %s' % reaction_id)
+        if value in parameters:
+            return parameters[value]
+        return float(value)
+
+    # Build the reactions before adding anything to the model, so cobra does
+    # not copy the metabolites and update the solver for each reaction.
+    cobra_reactions = []
+    objective_coefficients = {}
+    for values in reactions:
+        reaction = Reaction(_sbml_id(values['id'], 'R_'), name=values['name'],
+                            subsystem=group_subsystems.get(values['id'],
+                                                           values['subsystem']),
+                            lower_bound=bound(values['lower_bound'], values['id']),
+                            upper_bound=bound(values['upper_bound'], values['id']))
+        reaction.notes = values['notes']
+        try:
+            reaction.add_metabolites({metabolites[s]: c for s, c in
+                                      six.iteritems(values['stoichiometry'])})
+        except KeyError as e:
+            raise UnsupportedSBML('Unknown species %s in reaction %s' %
+                                  (e, values['id']))
+        reaction.gene_reaction_rule = values['gene_reaction_rule']
+        coefficient = values['objective_coefficient']
+        if objective is not None:
+            coefficient = objective.get(values['id'], 0)
+        if coefficient != 0:
+            objective_coefficients[reaction] = coefficient
+        cobra_reactions.append(reaction)
+    # metabolites without reactions are not added by add_reactions
+    model.add_metabolites(list(metabolites.values()))
+    model.add_reactions(cobra_reactions)
+
+    for gene in model.genes:
+        gene.name = gene_names.get(gene.id, gene.name)
+
+    if len(objective_coefficients) > 0:
+        model.objective = objective_coefficients
+
+    return model
+
+
+def read_sbml(model_filepath):
+    """Read an SBML model with read_sbml_iterparse, or with cobra if the
+    file is not supported.
+
+    """
+    import cobra.io
+
+    try:
+        return read_sbml_iterparse(model_filepath)
+    except Exception as e:
+        logging.info('Reading %s with cobra: %s' % (model_filepath, e))
+        return cobra.io.read_sbml_model(model_filepath)
+
+
+def load_and_normalize(model_filepath, use_cache=True):
+    """Load a model, and give it a particular id style.
+
+    If settings.model_cache_directory is set, the normalized model is cached
+    there, and loading the same file again skips parsing and normalization.
+
+    Arguments
+    ---------
 
-    # extract metabolite formulas from names (e.g. for iAF1260)
-    model = get_formulas_from_names(model)
+    model_filepath: The path to an SBML (.xml) or MATLAB (.mat) model.
+
+    use_cache: If False, ignore the cache.
+
+    """
+    import cobra.io
+
+    cache_path = model_cache_path(model_filepath) if use_cache else None
+    if cache_path is not None:
+        with profiling.phase('cache'):
+            cached = _read_cached_model(cache_path)
+        if cached is not None:
+            logging.debug('Using cached normalized model %s' % cache_path)
+            return cached
+
+    # load the model
+    with profiling.phase('parse'):
+        if model_filepath.endswith('.xml'):
+            model = read_sbml(model_filepath)
+        elif model_filepath.endswith('.mat'):
+            model = cobra.io.load_matlab_model(model_filepath)
+        else:
+           raise Exception('The %s file is not a valid filetype', model_filepath)
+
+    with profiling.phase('normalize'):
+        # convert the ids
+        model, old_ids = convert_ids(model)
+
+        # extract metabolite formulas from names (e.g. for iAF1260)
+        model = get_formulas_from_names(model)
+
+    if cache_path is not None:
+        _write_cached_model(cache_path, model, old_ids)
 
     return model, old_ids
 
@@ -89,20 +478,33 @@ def _check_rule_prefs(rule_prefs, rule):
 
 
 def remove_boundary_metabolites(model):
-    """Remove boundary metabolites (end in _b and only present in exchanges). Be
-    sure to loop through a static list of ids so the list does not get shorter
-    as the metabolites are deleted.
+    """Remove boundary metabolites (end in _b and present in an exchange). The
+    metabolites are found in one pass and removed together, so the metabolite
+    index is only rebuilt once.
 
     """
-    for metabolite_id in [str(x) for x in model.metabolites]:
-        metabolite = model.metabolites.get_by_id(metabolite_id)
-        if not metabolite.id.endswith("_b"):
-            continue
-        for reaction in list(metabolite._reaction):
-            if reaction.id.startswith("EX_"):
-                metabolite.remove_from_model()
-                break
-    model.metabolites._generate_index()
+    boundary = [metabolite for metabolite in model.metabolites
+                if metabolite.id.endswith('_b') and
+                any(reaction.id.startswith('EX_')
+                    for reaction in metabolite._reaction)]
+    if len(boundary) > 0:
+        model.remove_metabolites(boundary)
+
+
+def remove_orphan_genes(model):
+    """Remove the genes that are not in any reaction. Unlike
+    cobra.manipulation.remove_genes, this does not visit the rule of every
+    reaction, and rebuilds the gene index once.
+
+    """
+    orphans = [gene for gene in model.genes if len(gene._reaction) == 0]
+    if len(orphans) == 0:
+        return
+    for gene in orphans:
+        gene._model = None
+    for group in getattr(model, 'groups', []):
+        group.remove_members(orphans)
+    model.genes -= orphans
 
 
 # --------------------------------------------------------------------
@@ -133,17 +535,38 @@ def _reverse_reaction(reaction):
     logging.debug('Reversing pseudoreaction %s' % reaction.id)
 
 
-def _fix_exchange(reaction):
+class _PseudoreactionFeatures(object):
+    """The features of a reaction that the pseudoreaction checks share,
+    computed once."""
+
+    def __init__(self, reaction):
+        self.met_coeff = _reaction_single_met_coeff(reaction)
+        if self.met_coeff is not None:
+            self.compartment = split_compartment(self.met_coeff[0].id)[1]
+        else:
+            self.compartment = None
+
+
+_exchange_regex = re.compile(r'^ex_', re.IGNORECASE)
+_demand_regex = re.compile(r'^dm_', re.IGNORECASE)
+# for sink & demand functions
+_sink_regex = re.compile(r'^(sink|sk)_', re.IGNORECASE)
+_biomass_regex = re.compile(r'biomass', re.IGNORECASE)
+
+_atpm_forward = {'atp_c': -1, 'h2o_c': -1, 'pi_c': 1, 'h_c': 1, 'adp_c': 1}
+_atpm_reverse = {k: -v for k, v in six.iteritems(_atpm_forward)}
+
+
+def _fix_exchange(reaction, features):
     """Returns new id if the reaction was treated as an exchange."""
     # does it look like an exchange?
-    met_coeff = _reaction_single_met_coeff(reaction)
-    if met_coeff is None:
+    if features.met_coeff is None:
         return None
-    met, coeff = met_coeff
-    if split_compartment(met.id)[1] != 'e':
+    met, coeff = features.met_coeff
+    if features.compartment != 'e':
         return None
     # check id
-    if not re.search(r'^ex_', reaction.id, re.IGNORECASE):
+    if not _exchange_regex.search(reaction.id):
         logging.warn('Reaction {r.id} looks like an exchange but it does not start with EX_. Renaming'
                      .format(r=reaction))
     # check coefficient
@@ -157,18 +580,13 @@ def _fix_exchange(reaction):
     return 'EX_%s' % met.id, 'Extracellular exchange'
 
 
-# for sink & demand functions
-_sink_regex = re.compile(r'^(sink|sk)_', re.IGNORECASE)
-
-
-def _fix_demand(reaction):
+def _fix_demand(reaction, features):
     """Returns new ID if the reaction was treated as a demand."""
     # does it look like a demand?
-    met_coeff = _reaction_single_met_coeff(reaction)
-    if met_coeff is None:
+    if features.met_coeff is None:
         return None
-    met, coeff = met_coeff
-    if split_compartment(met.id)[1] == 'e':
+    met, coeff = features.met_coeff
+    if features.compartment == 'e':
         return None
     # source bound should be 0
     if ((coeff > 0 and reaction.upper_bound != 0) or
@@ -179,7 +597,7 @@ def _fix_demand(reaction):
     if _sink_regex.search(reaction.id):
         return None
     # check id
-    if not re.search(r'^dm_', reaction.id, re.IGNORECASE):
+    if not _demand_regex.search(reaction.id):
         logging.warn('Reaction {r.id} looks like a demand but it does not start with DM_. Renaming.'
                      .format(r=reaction))
     # check coefficient
@@ -193,14 +611,13 @@ def _fix_demand(reaction):
     return 'DM_%s' % met.id, 'Intracellular demand'
 
 
-def _fix_sink(reaction):
+def _fix_sink(reaction, features):
     """Returns new ID if the reaction was treated as a sink."""
     # does it look like a sink?
-    met_coeff = _reaction_single_met_coeff(reaction)
-    if met_coeff is None:
+    if features.met_coeff is None:
         return None
-    met, coeff = met_coeff
-    if split_compartment(met.id)[1] == 'e':
+    met, coeff = features.met_coeff
+    if features.compartment == 'e':
         return None
     # check id
     if not _sink_regex.search(reaction.id):
@@ -217,55 +634,66 @@ def _fix_sink(reaction):
     return 'SK_%s' % met.id, 'Intracellular source/sink'
 
 
-def _fix_biomass(reaction):
+def _fix_biomass(reaction, features):
     """Returns new ID if the reaction was treated as a biomass."""
     # does it look like an exchange?
-    regex = re.compile(r'biomass', re.IGNORECASE)
-    if not regex.search(reaction.id):
+    if not _biomass_regex.search(reaction.id):
         return None
-    new_id = ('BIOMASS_%s' % regex.sub('', reaction.id)).replace('__', '_')
+    new_id = ('BIOMASS_%s' % _biomass_regex.sub('', reaction.id)).replace('__', '_')
     return new_id, 'Biomass and maintenance functions'
 
 
-def _fix_atpm(reaction):
+def _fix_atpm(reaction, features):
     """Returns new ID if the reaction was treated as a biomass."""
-    # does it look like a atpm?
+    # does it look like a atpm? Only reactions with 5 metabolites can match.
+    if len(reaction.metabolites) != len(_atpm_forward):
+        return None
     mets = {k.id: v for k, v in six.iteritems(reaction.metabolites)}
     subsystem = 'Biomass and maintenance functions'
-    if mets == {'atp_c': -1, 'h2o_c': -1, 'pi_c': 1, 'h_c': 1, 'adp_c': 1}:
+    if mets == _atpm_forward:
         return 'ATPM', subsystem
-    elif mets == {'atp_c': 1, 'h2o_c': 1, 'pi_c': -1, 'h_c': -1, 'adp_c': -1}:
+    elif mets == _atpm_reverse:
         _reverse_reaction(reaction)
         return 'ATPM', subsystem
     return None
 
 
-def _normalize_pseudoreaction(reaction):
-    """If the reaction is a pseudoreaction (exchange, demand, sink, biomass, or
-    ATPM), then apply standard rules to it."""
+def classify_pseudoreaction(reaction):
+    """Check whether the reaction is a pseudoreaction (exchange, demand, sink,
+    biomass, or ATPM), reversing it if necessary to match the standard
+    direction. Returns a tuple (new_id, subsystem, is_atpm), or None if the
+    reaction is not a pseudoreaction.
 
+    """
+    features = _PseudoreactionFeatures(reaction)
     new_id = None; subsystem = None
 
     # check atpm separately because there is a good reason for an atpm-like
     # reaction with a gene_reaction_rule
-    is_atpm = False
-    if new_id is None:
-        res = _fix_atpm(reaction)
-        if res is not None:
-            new_id, subsystem = res
-            is_atpm = True
+    res = _fix_atpm(reaction, features)
+    is_atpm = res is not None
+    if is_atpm:
+        new_id, subsystem = res
 
     # check for other pseudoreactions
-    fns = [_fix_exchange, _fix_demand, _fix_sink, _fix_biomass]
     res = None
-    for fn in fns:
+    for fn in [_fix_exchange, _fix_demand, _fix_sink, _fix_biomass]:
+        res = fn(reaction, features)
         if res is not None:
+            new_id, subsystem = res
             break
-        res = fn(reaction)
-    if res is not None:
-        new_id, subsystem = res
 
-    if new_id is not None:
+    if new_id is None:
+        return None
+    return new_id, subsystem, is_atpm
+
+
+def _normalize_pseudoreaction(reaction):
+    """If the reaction is a pseudoreaction (exchange, demand, sink, biomass, or
+    ATPM), then apply standard rules to it."""
+    res = classify_pseudoreaction(reaction)
+    if res is not None:
+        new_id, subsystem, is_atpm = res
         # does it have a gene_reaction_rule? OK if atpm reaction has
         # gene_reaction_rule.
         if _has_gene_reaction_rule(reaction):
@@ -282,6 +710,15 @@ def _normalize_pseudoreaction(reaction):
     return
 
 
+def find_pseudoreactions(model):
+    """Get the set of IDs of the reactions in the model that the loader treats
+    as pseudoreactions, matching util.check_pseudoreaction.
+
+    """
+    return {reaction.id for reaction in model.reactions
+            if check_pseudoreaction(reaction.id)}
+
+
 # --------------------------------------------------------------------
 # ID fixes
 # --------------------------------------------------------------------
@@ -293,13 +730,20 @@ def convert_ids(model):
 
     {'reactions': {'new_id': 'old_id'},
      'metabolites': {'new_id': 'old_id'},
-     'genes': {'new_id': 'old_id'}}
+     'genes': {'new_id': 'old_id'},
+     'pseudoreactions': set(['new_id']),
+     'conflicts': [('kind', 'new_id', 'message')]}
+
+    The conflicts are the problems that were worked around while normalizing:
+    conflicting_pseudoreaction, duplicate_reaction_id, duplicate_metabolite_id
+    and duplicate_gene_id.
 
     """
     # loop through the ids:
     metabolite_id_dict = defaultdict(list)
     reaction_id_dict = defaultdict(list)
     gene_id_dict = defaultdict(list)
+    conflicts = []
 
     # fix metabolites
     for metabolite in model.metabolites:
@@ -315,6 +759,8 @@ def convert_ids(model):
     # load fixes for gene_reaction_rule's
     rule_prefs = _get_rule_prefs()
 
+    new_reaction_ids = IncrementedIdAllocator()
+
     # separate ids and compartments, and convert to the new_id_style
     for reaction in model.reactions:
         # save the original id
@@ -326,9 +772,16 @@ def convert_ids(model):
             _normalize_pseudoreaction(reaction)
         except ConflictingPseudoreaction as e:
             logging.warn(str(e))
+            conflicts.append(('conflicting_pseudoreaction', reaction.id, str(e)))
         # don't merge reactions with conflicting new_id's
-        while reaction.id in reaction_id_dict:
-            reaction.id = increment_id(reaction.id)
+        if reaction.id in new_reaction_ids:
+            new_id = new_reaction_ids.next_id(reaction.id)
+            conflicts.append(('duplicate_reaction_id', new_id,
+                              'Reaction %s was renamed to %s because %s is taken'
+                              % (current_id, new_id, reaction.id)))
+            reaction.id = new_id
+        else:
+            new_reaction_ids.add(reaction.id)
         reaction_id_dict[reaction.id].append(current_id)
         # fix the gene reaction rules
         reaction.gene_reaction_rule = _check_rule_prefs(rule_prefs, reaction.gene_reaction_rule)
@@ -343,17 +796,26 @@ def convert_ids(model):
                                                  reaction.gene_reaction_rule)
 
     # remove old genes
-    from cobra.manipulation import remove_genes
-    remove_genes(model, [gene for gene in model.genes
-                         if len(gene.reactions) == 0])
+    remove_orphan_genes(model)
 
     # fix the model id
     cobra_id = re.sub(r'[^a-zA-Z0-9_]', '_', model.id)
     model.id = cobra_id
 
+    for kind, id_dict in [('metabolite', metabolite_id_dict),
+                          ('gene', gene_id_dict)]:
+        for new_id, old_id_list in six.iteritems(id_dict):
+            if len(old_id_list) > 1:
+                conflicts.append(('duplicate_%s_id' % kind, new_id,
+                                  '%s IDs %s all became %s' %
+                                  (kind.capitalize(), ', '.join(old_id_list),
+                                   new_id)))
+
     old_ids = {'metabolites': metabolite_id_dict,
                'reactions': reaction_id_dict,
-               'genes': gene_id_dict}
+               'genes': gene_id_dict,
+               'pseudoreactions': find_pseudoreactions(model),
+               'conflicts': conflicts}
     return model, old_ids
 
 
@@ -397,6 +859,11 @@ def id_for_new_id_style(old_id, is_metabolite=False):
 
 
 def get_formulas_from_names(model):
+    try:
+        from cobra.core import Formula
+    except ImportError:
+        from cobra.core.formula import Formula
+
     reg = re.compile(r'.*_([A-Z][A-Z0-9]*)$')
     # support cobra 0.3 and 0.4
     for metabolite in model.metabolites:
@@ -514,6 +981,9 @@ def fix_legacy_id(id, use_hyphens=False):
         id = id.replace("-", "__")
     return id
 
+_reg_split_compartment = re.compile(r'_[a-z][a-z0-9]?$')
+
+
 def split_compartment(component_id):
     """Split the metabolite cobra_id into a metabolite and a compartment id.
 
@@ -523,7 +993,7 @@ def split_compartment(component_id):
     component_id: the cobra_id of the metabolite.
 
     """
-    match = re.search(r'_[a-z][a-z0-9]?$', component_id)
+    match = _reg_split_compartment.search(component_id)
     if match is None:
         raise NotFoundError("No compartment found for %s" % component_id)
     met = component_id[0:match.start()]
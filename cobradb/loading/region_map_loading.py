@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""Compute and store neighbor distances between genome regions."""
+
+from cobradb.base import Chromosome, GenomeRegion, GenomeRegionMap
+from cobradb.regions import region_pairs_within, region_pairs_adjacent
+from cobradb.util import copy_rows, timing
+
+import logging
+import numpy as np
+import six
+
+
+def _genome_region_positions(session, genome_id, region_type):
+    """Read the positioned regions of a genome, grouped by chromosome."""
+    query = (session
+             .query(GenomeRegion.chromosome_id, GenomeRegion.id,
+                    GenomeRegion.leftpos, GenomeRegion.rightpos)
+             .join(Chromosome, Chromosome.id == GenomeRegion.chromosome_id)
+             .filter(Chromosome.genome_id == genome_id)
+             .filter(GenomeRegion.leftpos.isnot(None))
+             .filter(GenomeRegion.rightpos.isnot(None)))
+    if region_type is not None:
+        query = query.filter(GenomeRegion.type == region_type)
+    by_chromosome = {}
+    for chromosome_id, region_id, leftpos, rightpos in query:
+        by_chromosome.setdefault(chromosome_id, []).append((region_id,
+                                                            min(leftpos, rightpos),
+                                                            max(leftpos, rightpos)))
+    return {k: [np.array(x, dtype=np.int64) for x in zip(*v)]
+            for k, v in six.iteritems(by_chromosome)}
+
+
+@timing
+def load_genome_region_map(session, genome_id, max_distance=None, k=None,
+                           region_type='gene'):
+    """Compute neighbor pairs for the regions of a genome and store them, with
+    their distances, in genome_region_map. Existing pairs for the genome are
+    replaced. Pairs are stored once, with the upstream region first.
+
+    Returns the number of pairs written.
+
+    Arguments
+    ---------
+
+    session: An SQLAlchemy session.
+
+    genome_id: The database ID of the genome.
+
+    max_distance: Store all pairs on the same chromosome within this many bp.
+
+    k: Store each region paired with its next k regions by position.
+
+    region_type: Only pair regions of this polymorphic type. Use None for all
+    regions.
+
+    """
+    if max_distance is None and k is None:
+        raise ValueError('Provide max_distance, k, or both')
+
+    genome_region_ids = (session
+                         .query(GenomeRegion.id)
+                         .join(Chromosome, Chromosome.id == GenomeRegion.chromosome_id)
+                         .filter(Chromosome.genome_id == genome_id))
+    (session
+     .query(GenomeRegionMap)
+     .filter(GenomeRegionMap.genome_region_id_1.in_(genome_region_ids.subquery()))
+     .delete(synchronize_session=False))
+
+    def pairs():
+        for chromosome_id, (region_ids, leftpos, rightpos) in \
+                six.iteritems(_genome_region_positions(session, genome_id, region_type)):
+            results = []
+            if max_distance is not None:
+                results.append(region_pairs_within(leftpos, rightpos, max_distance))
+            if k is not None:
+                results.append(region_pairs_adjacent(leftpos, rightpos, k))
+            i, j, d = [np.concatenate(x) for x in zip(*results)]
+            # drop pairs found by both methods
+            _, first = np.unique(i * len(region_ids) + j, return_index=True)
+            for a, b, c in six.moves.zip(region_ids[i[first]], region_ids[j[first]],
+                                         d[first]):
+                yield int(a), int(b), int(c)
+
+    n = copy_rows(session, 'genome_region_map',
+                  ['genome_region_id_1', 'genome_region_id_2', 'distance'],
+                  pairs())
+    session.commit()
+    logging.info('Loaded %d genome region pairs for genome %d' % (n, genome_id))
+    return n
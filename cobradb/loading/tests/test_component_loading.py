@@ -104,3 +104,19 @@ class TestWithGenomes():
                 .filter(DataSource.name == 'refseq_orf_id')
                 .filter(Synonym.synonym == 'test_orf')
                 .count()) == 1
+
+    def test_load_genome_region_map(self, session):
+        from cobradb.loading.region_map_loading import load_genome_region_map
+        from cobradb.regions import get_region_neighbors, get_neighborhoods
+
+        genome_id = session.query(Genome.id).first()[0]
+        n = load_genome_region_map(session, genome_id, max_distance=100, k=1)
+        assert n > 0
+        assert session.query(GenomeRegionMap).count() == n
+        pair = session.query(GenomeRegionMap).first()
+        neighbors = get_region_neighbors(session, [pair.genome_region_id_1])
+        assert (pair.genome_region_id_2, pair.distance) in neighbors[pair.genome_region_id_1]
+        assert len(get_neighborhoods(session, genome_id, 100)) > 0
+        # reloading replaces the pairs
+        assert load_genome_region_map(session, genome_id, max_distance=100, k=1) == n
+        assert session.query(GenomeRegionMap).count() == n
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+from cobradb.loading.dataset_loading import *
+from cobradb.base import *
+from cobradb.datasets import *
+
+import numpy as np
+import pytest
+
+
+@pytest.mark.usefixtures('load_genomes')
+class TestWithGenomes():
+    def test_load_genome_data(self, session):
+        genome_id = session.query(Genome.id).first()[0]
+        dataset_id = bulk_create_datasets(session, [{'name': 'test_rnaseq'}])[0]
+        n = load_genome_data(session, dataset_id,
+                             ['b0114', 'b0115', 'not_a_gene', 'b0114'],
+                             [1.5, float('nan'), 3.0, 4.0],
+                             genome_id)
+        assert n == 2
+        res_db = (session
+                  .query(GenomeData.value)
+                  .join(GenomeRegion)
+                  .filter(GenomeData.dataset_id == dataset_id)
+                  .filter(GenomeRegion.cobra_id == 'b0114')
+                  .one())
+        assert res_db[0] == 1.5
+
+        # replace the values
+        n = load_genome_data(session, dataset_id, ['b0114'], [2.0], genome_id,
+                             replace=True)
+        assert (session
+                .query(GenomeData)
+                .filter(GenomeData.dataset_id == dataset_id)
+                .count()) == 1
+
+    def test_load_genome_data_array(self, session):
+        from cobradb.dumping.dataset_dumping import get_dataset_matrix
+
+        genome_id = session.query(Genome.id).first()[0]
+        ids = bulk_create_datasets(session, [{'name': 'test_array_1'},
+                                             {'name': 'test_array_2'},
+                                             {'name': 'test_rows_1'}])
+        load_genome_data_array(session, ids[0], ['b0114', 'b0115'], [1.0, 2.0],
+                               genome_id)
+        load_genome_data_array(session, ids[1], ['b0115'], [3.0], genome_id)
+        load_genome_data(session, ids[2], ['b0114'], [4.0], genome_id)
+        assert session.query(GenomeData).filter(GenomeData.dataset_id == ids[0]).count() == 0
+
+        region_ids, matrix = get_dataset_matrix(session, ids, genome_id)
+        assert matrix.shape == (3, len(region_ids))
+        b0114 = (session.query(GenomeRegion.id)
+                 .join(Chromosome)
+                 .filter(Chromosome.genome_id == genome_id)
+                 .filter(GenomeRegion.cobra_id == 'b0114')
+                 .one())[0]
+        column = list(region_ids).index(b0114)
+        assert list(matrix[:, column][[0, 2]]) == [1.0, 4.0]
+        assert np.isnan(matrix[1, column])
+        assert np.nansum(matrix[1]) == 3.0
+
+    def test_load_genome_data_parallel_array(self, session):
+        genome_id = session.query(Genome.id).first()[0]
+        ids = bulk_create_datasets(session, [{'name': 'test_parallel_%d' % i}
+                                             for i in range(4)])
+        session.commit()
+        # all the workers use the same genome
+        jobs = [{'dataset_id': dataset_id, 'keys': ['b0114', 'b0115'],
+                 'values': [1.0, 2.0], 'genome_id': genome_id,
+                 'storage': 'array'} for dataset_id in ids]
+        assert load_genome_data_parallel(jobs, processes=2) == [2] * 4
+        order_db = session.query(GenomeRegionOrder).get(genome_id)
+        assert ({x[0] for x in session
+                 .query(GenomeDataArray.value_count)
+                 .filter(GenomeDataArray.dataset_id.in_(ids))} ==
+                {order_db.region_count})
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+from cobradb import settings
+from cobradb.benchmarks import synthetic
+from cobradb.loading import dry_run
+
+from os.path import join, realpath, dirname
+import json
+import re
+import pytest
+
+
+test_data_dir = realpath(join(dirname(dirname(dirname(__file__))), 'test_data'))
+
+
+@pytest.fixture()
+def prefs(monkeypatch):
+    monkeypatch.setattr(settings, 'reaction_id_prefs',
+                        join(test_data_dir, 'reaction-id-prefs.txt'))
+    monkeypatch.setattr(settings, 'reaction_hash_prefs',
+                        join(test_data_dir, 'reaction-hash-prefs.txt'))
+    monkeypatch.setattr(settings, 'gene_reaction_rule_prefs',
+                        join(test_data_dir, 'gene-reaction-rule-prefs.txt'))
+    monkeypatch.setattr(settings, 'model_cache_directory', None)
+
+
+def test_validate_models(prefs, tmpdir):
+    paths = []
+    first = synthetic.make_model(60, 'dry_1')
+    paths.append(str(tmpdir.join('dry_1.xml')))
+    synthetic.write_model(first, paths[-1])
+
+    # the same reactions, with one renamed and one changed
+    second = synthetic.make_model(60, 'dry_2')
+    renamed, changed = [r for r in second.reactions
+                        if re.match(r'SYN\d+$', r.id)][:2]
+    renamed.id = 'RENAMED'
+    met = list(changed.metabolites)[0]
+    changed.add_metabolites({met: changed.metabolites[met]})
+    paths.append(str(tmpdir.join('dry_2.xml')))
+    synthetic.write_model(second, paths[-1])
+
+    # the same model ID again, and a missing file
+    paths.append(str(tmpdir.join('dry_1_copy.xml')))
+    synthetic.write_model(first, paths[-1])
+    paths.append(str(tmpdir.join('missing.xml')))
+
+    report = dry_run.validate_models(paths, processes=2)
+    assert [m['filename'] for m in report['models']] == [
+        'dry_1.xml', 'dry_2.xml', 'dry_1_copy.xml', 'missing.xml'
+    ]
+    assert report['counts'] == {'reaction_merged': 1,
+                                'reaction_id_conflict': 1,
+                                'duplicate_model': 1,
+                                'parse_error': 1}
+    conflicts = {c['kind']: c for c in report['conflicts']}
+    assert conflicts['reaction_merged']['id'] == 'RENAMED'
+    assert conflicts['reaction_id_conflict']['id'] == changed.id
+    assert conflicts['reaction_id_conflict']['model'] == 'dry_2.xml'
+    assert report['universal_reactions'] == len(first.reactions) + 1
+
+    # the same without a pool
+    assert dry_run.validate_models(paths, processes=1)['counts'] == report['counts']
+
+    report_path = str(tmpdir.join('report.json'))
+    dry_run.write_report(report, report_path)
+    with open(report_path) as f:
+        assert json.load(f)['counts'] == report['counts']
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+
+from cobradb.loading.identity_cache import IdentityCache
+
+
+def test_identity_cache_commit_and_rollback():
+    cache = IdentityCache()
+    cache.add('metabolite', 'atp', 1)
+    assert cache.get('metabolite', 'atp') == 1
+    cache.rollback()
+    assert cache.get('metabolite', 'atp') is None
+
+    cache.add('metabolite', 'atp', 2)
+    cache.add('compartmentalized_component', (2, 3), 4)
+    cache.commit()
+    cache.rollback()
+    assert cache.get('metabolite', 'atp') == 2
+    assert cache.get('compartmentalized_component', (2, 3)) == 4
+    assert cache.get('compartment', 'c') is None
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+from cobradb.loading import journal
+
+
+def test_fingerprint(tmpdir):
+    path = str(tmpdir.join('model.xml'))
+    with open(path, 'w') as f:
+        f.write('<sbml/>')
+    finger = journal.fingerprint([path], genome_ref=['ncbi_accession', 'NC_1'])
+    assert finger == journal.fingerprint([path],
+                                         genome_ref=('ncbi_accession', 'NC_1'))
+    assert finger != journal.fingerprint([path], genome_ref=None)
+    with open(path, 'w') as f:
+        f.write('<sbml></sbml>')
+    assert finger != journal.fingerprint([path],
+                                         genome_ref=['ncbi_accession', 'NC_1'])
+    assert journal.fingerprint([str(tmpdir.join('missing.xml'))]) == 'missing'
+
+
+def test_journal(test_db, session):
+    session.commit()
+    engine = session.get_bind()
+    journal.create_journal(engine)
+    try:
+        journal.record(engine, 'model', 'a.xml', 'abc', seconds=1.5)
+        journal.record(engine, 'genome', 'ncbi_accession:NC_1', 'def',
+                       ['/refseq/NC_1.gb'])
+        assert journal.is_done(engine, 'model', 'a.xml', 'abc')
+        assert not journal.is_done(engine, 'model', 'a.xml', 'changed')
+        assert journal.completed(engine, 'genome') == {
+            'ncbi_accession:NC_1': ('def', ['/refseq/NC_1.gb'])
+        }
+
+        # a new fingerprint replaces the old one
+        journal.record(engine, 'model', 'a.xml', 'changed')
+        assert journal.is_done(engine, 'model', 'a.xml', 'changed')
+
+        journal.clear_journal(engine, ['model', 'map'])
+        assert journal.completed(engine, 'model') == {}
+        assert len(journal.completed(engine, 'genome')) == 1
+    finally:
+        engine.execute('DROP TABLE load_journal')
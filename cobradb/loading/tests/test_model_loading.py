@@ -23,6 +23,43 @@ class TestsWithModels:
             load_model(model_details['path'], model_details['pmid'],
                        model_details['genome_ref'], session)
 
+    def test_failed_load_rolls_back(self, session, test_model_files,
+                                    monkeypatch):
+        from cobradb.loading import model_loading, parse
+        original_load_and_normalize = parse.load_and_normalize
+
+        def load_and_normalize(path):
+            model, old_ids = original_load_and_normalize(path)
+            model.id = 'failed_model'
+            return model, old_ids
+
+        def load_genes(*args):
+            raise RuntimeError('failed')
+
+        monkeypatch.setattr(parse, 'load_and_normalize', load_and_normalize)
+        monkeypatch.setattr(model_loading, 'load_genes', load_genes)
+        reaction_count = session.query(ModelReaction).count()
+        model_details = test_model_files[0]
+        with pytest.raises(RuntimeError):
+            load_model(model_details['path'], model_details['pmid'],
+                       model_details['genome_ref'], session)
+        assert session.query(Model).filter(Model.cobra_id == 'failed_model').count() == 0
+        assert session.query(ModelReaction).count() == reaction_count
+
+    def test_identity_cache(self, session):
+        from cobradb.loading.identity_cache import get_identity_cache
+        cache = get_identity_cache(session)
+        for cobra_id, db_id in session.query(Metabolite.cobra_id, Metabolite.id):
+            assert cache.get('metabolite', cobra_id) == db_id
+        for component_id, compartment_id, db_id in session.query(
+                CompartmentalizedComponent.component_id,
+                CompartmentalizedComponent.compartment_id,
+                CompartmentalizedComponent.id):
+            assert cache.get('compartmentalized_component',
+                             (component_id, compartment_id)) == db_id
+        # nothing left over from the failed load
+        assert all(len(ids) == 0 for ids in cache._pending.values())
+
     def test_counts(self, session):
         # test the model
         assert session.query(Model).count() == 3
@@ -346,3 +383,31 @@ class TestsWithModels:
                   .first())
         assert res_db.formula == 'C3H4O10P2'
         assert res_db.charge == -4
+
+
+def test_decide_reaction():
+    from cobradb.loading.model_loading import decide_reaction
+
+    class R(object):
+        def __init__(self, id, cobra_id):
+            self.id = id
+            self.cobra_id = cobra_id
+
+    gapd = R(1, 'GAPD')
+    gapdh = R(2, 'GAPDH')
+    id_prefs = [['GAPDH', 'GAPD']]
+
+    decision = decide_reaction('GAPD', None, None, None, id_prefs)
+    assert (decision.case, decision.new_id) == ('1', 'GAPD')
+    decision = decide_reaction('GAPD', gapd, None, None, id_prefs)
+    assert (decision.case, decision.new_id, decision.existing) == ('2', None, None)
+    decision = decide_reaction('GAPD', gapd, gapd, None, id_prefs)
+    assert (decision.case, decision.existing) == ('3b', gapd)
+    decision = decide_reaction('GAPDH', None, gapd, None, id_prefs)
+    assert (decision.case, decision.existing, decision.rename) == ('3a', gapd, 'GAPDH')
+    decision = decide_reaction('GAPD', None, gapdh, None, id_prefs)
+    assert (decision.case, decision.existing, decision.rename) == ('3a', gapdh, None)
+    decision = decide_reaction('G', None, gapdh, 'GAPDH', id_prefs)
+    assert (decision.case, decision.existing) == ('0', gapdh)
+    decision = decide_reaction('G', gapd, gapd, 'GAPDH', id_prefs)
+    assert (decision.case, decision.new_id, decision.move_aside) == ('0', 'GAPDH', 'GAPDH')
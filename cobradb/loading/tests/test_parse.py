@@ -4,10 +4,14 @@ from cobradb.loading.parse import (_has_gene_reaction_rule,
 
 from cobra.core import Reaction, Metabolite
 from cobra.io import read_sbml_model
+from os.path import join, dirname, realpath
 import pytest
 import six
 
 
+test_data_dir = realpath(join(dirname(dirname(dirname(__file__))), 'test_data'))
+
+
 @pytest.fixture(scope='session')
 def example_model(test_model_files):
     return read_sbml_model(test_model_files[0]['path'])
@@ -46,6 +50,26 @@ def test__normalize_pseudoreaction_exchange():
     assert reaction.subsystem == 'Extracellular exchange'
 
 
+def test_classify_pseudoreaction():
+    reaction = Reaction('ATPM_reverse')
+    reaction.add_metabolites({Metabolite('atp_c'): 1, Metabolite('h2o_c'): 1,
+                              Metabolite('pi_c'): -1, Metabolite('h_c'): -1,
+                              Metabolite('adp_c'): -1})
+    assert classify_pseudoreaction(reaction) == ('ATPM', 'Biomass and maintenance functions', True)
+    # reversed
+    assert {m.id: c for m, c in six.iteritems(reaction.metabolites)}['atp_c'] == -1
+
+    reaction = Reaction('GAPD')
+    reaction.add_metabolites({Metabolite('g3p_c'): -1, Metabolite('13dpg_c'): 1})
+    assert classify_pseudoreaction(reaction) is None
+
+    reaction = Reaction('Ec_biomass_core')
+    reaction.add_metabolites({Metabolite('g3p_c'): -1, Metabolite('13dpg_c'): 1})
+    assert classify_pseudoreaction(reaction) == ('BIOMASS_Ec_core',
+                                                 'Biomass and maintenance functions',
+                                                 False)
+
+
 def test__normalize_pseudoreaction_exchange_reversed():
     reaction = Reaction('EX_gone')
     reaction.add_metabolites({Metabolite('glu__L_e'): 1})
@@ -322,3 +346,95 @@ def test_hash_reaction(test_model_files):
     # repeatable
     k1, h1 = next(six.iteritems(hashes))
     assert h1 == hash_reaction(model.reactions.get_by_id(k1))
+
+
+def test_load_and_normalize_cache(test_model_files, tmpdir, monkeypatch):
+    import cobra.io
+    from cobradb import settings
+    monkeypatch.setattr(settings, 'model_cache_directory', str(tmpdir))
+    path = test_model_files[1]['path']
+    model, old_ids = load_and_normalize(path)
+    assert model_cache_path(path).startswith(str(tmpdir))
+
+    def read_sbml_model(path):
+        raise AssertionError('Parsed a cached model')
+    monkeypatch.setattr(cobra.io, 'read_sbml_model', read_sbml_model)
+    cached_model, cached_old_ids = load_and_normalize(path)
+    assert ([r.id for r in cached_model.reactions] ==
+            [r.id for r in model.reactions])
+    assert cached_old_ids == old_ids
+    with pytest.raises(AssertionError):
+        load_and_normalize(path, use_cache=False)
+
+
+def _assert_same_model(model, cobra_model):
+    assert model.id == cobra_model.id
+    assert model.compartments == cobra_model.compartments
+    assert ([(m.id, m.name, m.formula, m.charge, m.compartment)
+             for m in model.metabolites] ==
+            [(m.id, m.name, m.formula, m.charge, m.compartment)
+             for m in cobra_model.metabolites])
+    assert len(model.reactions) == len(cobra_model.reactions)
+    for reaction, cobra_reaction in zip(model.reactions, cobra_model.reactions):
+        assert reaction.id == cobra_reaction.id
+        assert reaction.name == cobra_reaction.name
+        assert reaction.subsystem == cobra_reaction.subsystem
+        assert reaction.bounds == cobra_reaction.bounds
+        assert reaction.gene_reaction_rule == cobra_reaction.gene_reaction_rule
+        assert reaction.objective_coefficient == cobra_reaction.objective_coefficient
+        assert ({m.id: c for m, c in six.iteritems(reaction.metabolites)} ==
+                {m.id: c for m, c in six.iteritems(cobra_reaction.metabolites)})
+    assert {g.id for g in model.genes} == {g.id for g in cobra_model.genes}
+
+
+def test_read_sbml_iterparse(tmpdir):
+    from cobradb.benchmarks import synthetic
+    path = str(tmpdir.join('synthetic.xml'))
+    synthetic.write_model(synthetic.make_model(100), path)
+    _assert_same_model(read_sbml_iterparse(path), read_sbml_model(path))
+
+
+def test_read_sbml_iterparse_level_2_notes():
+    # formulas, charges, subsystems and gene rules in the notes, and bounds in
+    # the kinetic law
+    path = join(test_data_dir, 'l2-notes-model.xml')
+    model = read_sbml_iterparse(path)
+    _assert_same_model(model, read_sbml_model(path))
+    assert model.metabolites.get_by_id('glc__D_c').formula == 'C6H12O6'
+
+
+def test_read_sbml_falls_back_to_cobra(tmpdir):
+    from cobradb.benchmarks import synthetic
+    path = str(tmpdir.join('boundary.xml'))
+    synthetic.write_model(synthetic.make_model(50), path)
+    with open(path) as f:
+        sbml = f.read()
+    with open(path, 'w') as f:
+        f.write(sbml.replace('boundaryCondition="false"',
+                             'boundaryCondition="true"', 1))
+    with pytest.raises(UnsupportedSBML):
+        read_sbml_iterparse(path)
+    assert len(read_sbml(path).reactions) > 50
+
+
+def test_remove_boundary_metabolites_and_orphan_genes():
+    from cobra import Model
+    model = Model('boundary')
+    for i in range(3):
+        model.add_reactions([Reaction('EX_m%d_e' % i)])
+        model.reactions.get_by_id('EX_m%d_e' % i).add_metabolites({
+            Metabolite('m%d_e' % i): -1, Metabolite('m%d_b' % i): 1
+        })
+    model.add_reactions([Reaction('R1')])
+    model.reactions.R1.add_metabolites({model.metabolites.m0_e: -1,
+                                        Metabolite('x_b'): 1})
+    model.reactions.R1.gene_reaction_rule = 'g1 or g2'
+    remove_boundary_metabolites(model)
+    assert sorted(m.id for m in model.metabolites) == ['m0_e', 'm1_e', 'm2_e', 'x_b']
+    assert all(len(r.metabolites) == 1 for r in model.reactions if r.id != 'R1')
+    assert model.metabolites.m1_e is model.metabolites.get_by_id('m1_e')
+
+    model.reactions.R1.gene_reaction_rule = 'g1'
+    remove_orphan_genes(model)
+    assert [g.id for g in model.genes] == ['g1']
+    assert model.genes.get_by_id('g1').id == 'g1'
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+from cobradb.benchmarks import synthetic
+from cobradb.loading import work_queue
+
+from time import sleep
+
+
+def test_work_queue(scratch_schema, test_prefs, tmpdir):
+    engine = scratch_schema('test_queue')
+    url = str(engine.url)
+    work_queue.create_queue(engine)
+
+    # two genomes and their models, plus a model that cannot be loaded
+    reaction_counts = {}
+    for i in [1, 2]:
+        accession = 'NC_QUEUE%d' % i
+        genome_ref = ['ncbi_accession', accession + '.1']
+        gb_path = str(tmpdir.join('%s.gb' % accession))
+        synthetic.write_genbank(30, accession, gb_path)
+        work_queue.enqueue(engine, 'genome', accession,
+                           {'genome_ref': genome_ref, 'file_paths': [gb_path]})
+        model_path = str(tmpdir.join('queue_%d.xml' % i))
+        model = synthetic.make_model(40, 'queue_%d' % i, seed=i)
+        reaction_counts[model.id] = len(model.reactions)
+        synthetic.write_model(model, model_path)
+        work_queue.enqueue(engine, 'model', 'queue_%d.xml' % i,
+                           {'path': model_path, 'pub_ref': None,
+                            'genome_ref': genome_ref})
+    work_queue.enqueue(engine, 'model', 'missing.xml',
+                       {'path': str(tmpdir.join('missing.xml')),
+                        'pub_ref': None, 'genome_ref': None},
+                       max_attempts=2)
+
+    compartment_names = str(tmpdir.join('compartment-names.tsv'))
+    with open(compartment_names, 'w') as f:
+        f.write('c\tcytosol\ne\textracellular space\n')
+    overrides = dict(test_prefs, compartment_names=compartment_names,
+                     model_cache_directory=None)
+    ran = work_queue.run_workers(3, url, schema_name='test_queue',
+                                 settings_overrides=overrides,
+                                 poll_seconds=1)
+    # jobs that lose a race on a shared row are retried, so the number of
+    # runs varies
+    assert sum(ran) >= 4 + 2
+
+    assert work_queue.queue_status(engine) == {('genome', 'done'): 2,
+                                               ('model', 'done'): 2,
+                                               ('model', 'failed'): 1}
+    assert not work_queue.has_unfinished_jobs(engine)
+    # no reactions were skipped because of a race
+    assert dict(list(engine.execute(
+        'SELECT m.cobra_id, count(*) FROM model_reaction mr '
+        'JOIN model m ON m.id = mr.model_id GROUP BY m.cobra_id'
+    ))) == reaction_counts
+    failed = engine.execute(
+        "SELECT attempts, error, seconds FROM load_job WHERE name = 'missing.xml'"
+    ).first()
+    assert failed[0] == 2
+    assert failed[1] is not None
+    assert failed[2] is not None
+
+
+def test_renew_lease(scratch_schema):
+    engine = scratch_schema('test_lease', create_tables=False)
+    work_queue.create_queue(engine)
+    work_queue.enqueue(engine, 'genome', 'slow', {})
+    job = work_queue.claim_job(engine, 'worker_1', lease_seconds=1)
+    with work_queue.renew_lease(engine, job, 'worker_1', lease_seconds=1):
+        sleep(2)
+        # still renewed, so no one else takes the job
+        assert work_queue.claim_job(engine, 'worker_2', lease_seconds=1) is None
+    sleep(1.5)
+    # the lease ran out
+    assert work_queue.claim_job(engine, 'worker_2', lease_seconds=1)['id'] == job['id']
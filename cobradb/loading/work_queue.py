@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+
+"""Load genomes, models and maps from a queue in the database, with any number
+of worker processes on any number of hosts.
+
+load_db --enqueue fills the load_job table, and each worker claims one job at a
+time with SELECT ... FOR UPDATE SKIP LOCKED, so workers never wait for each
+other or take the same job. Jobs run in stages: all genomes, then all models,
+then the maps, because models refer to genomes and maps refer to models. The
+file paths in the jobs must be readable on every host.
+
+A job that fails goes back to the queue until it has been tried max_attempts
+times. Models that are loaded at the same time can try to insert the same new
+universal reaction or metabolite. The loser fails on a unique constraint, and
+workers set session.info['raise_integrity_errors'] so that util.savepoint does
+not skip the row, and the whole job is rolled back and retried later. Shared
+lookup rows, like data sources and publications, are inserted with ON CONFLICT
+DO NOTHING, so they never fail. While a job runs, its worker renews the lease
+on it every lease_seconds / 3. A running job whose lease has not been renewed
+for lease_seconds is taken to belong to a worker that died, and can be claimed
+again.
+
+Jobs with a fingerprint in their payload are recorded in the load journal when
+they finish, like the units that load_db loads itself.
+
+"""
+
+from cobradb import base, settings, profiling
+from cobradb.loading import AlreadyLoadedError, journal
+
+from sqlalchemy import text
+from contextlib import contextmanager
+from time import time, sleep
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+
+
+# job kinds in the order they are loaded
+STAGES = {'genome': 0, 'model': 1, 'maps': 2}
+
+_create_load_job = """
+CREATE TABLE IF NOT EXISTS load_job (
+    id serial PRIMARY KEY,
+    kind text NOT NULL,
+    stage integer NOT NULL,
+    name text NOT NULL,
+    payload text NOT NULL,
+    status text NOT NULL DEFAULT 'pending',
+    attempts integer NOT NULL DEFAULT 0,
+    max_attempts integer NOT NULL,
+    worker text,
+    started_at timestamp with time zone,
+    renewed_at timestamp with time zone,
+    finished_at timestamp with time zone,
+    seconds double precision,
+    error text,
+    UNIQUE (kind, name)
+)
+"""
+
+_claim_sql = """
+UPDATE load_job SET status = 'running', attempts = attempts + 1,
+                    worker = :worker, started_at = now(), renewed_at = now(),
+                    finished_at = NULL
+WHERE id = (
+    SELECT j.id FROM load_job j
+    WHERE (j.status = 'pending'
+           OR (j.status = 'running'
+               AND j.renewed_at < now() - make_interval(secs => :lease_seconds)))
+    AND j.attempts < j.max_attempts
+    AND NOT EXISTS (SELECT 1 FROM load_job d
+                    WHERE d.stage < j.stage AND d.status IN ('pending', 'running'))
+    ORDER BY j.stage, j.id
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING id, kind, name, payload, attempts, max_attempts
+"""
+
+_renew_sql = """
+UPDATE load_job SET renewed_at = now()
+WHERE id = :id AND worker = :worker AND status = 'running'
+"""
+
+
+def create_queue(engine):
+    """Create the load_job table if it does not exist."""
+    with engine.begin() as connection:
+        connection.execute(_create_load_job)
+
+
+def enqueue(engine, kind, name, payload, max_attempts=3):
+    """Add a job to the queue. A job with the same kind and name is reset to
+    pending, so running load_db --enqueue again retries failed jobs.
+
+    Arguments
+    ---------
+
+    engine: An SQLAlchemy engine.
+
+    kind: genome, model or maps.
+
+    name: A name that is unique for the kind, e.g. the model filename.
+
+    payload: The arguments for the loader, as a dictionary that can be
+    serialized to JSON.
+
+    max_attempts: The number of times to try the job before giving up.
+
+    """
+    if kind not in STAGES:
+        raise ValueError('Bad job kind %s' % kind)
+    with engine.begin() as connection:
+        connection.execute(text(
+            'INSERT INTO load_job (kind, stage, name, payload, max_attempts) '
+            'VALUES (:kind, :stage, :name, :payload, :max_attempts) '
+            'ON CONFLICT (kind, name) DO UPDATE SET '
+            "payload = EXCLUDED.payload, status = 'pending', attempts = 0, "
+            'max_attempts = EXCLUDED.max_attempts, error = NULL '
+            "WHERE load_job.status <> 'done'"
+        ), kind=kind, stage=STAGES[kind], name=name,
+            payload=json.dumps(payload), max_attempts=max_attempts)
+
+
+def claim_job(engine, worker, lease_seconds=3600):
+    """Claim the next job that is ready to run. Returns a dictionary with the
+    id, kind, name, payload, attempts and max_attempts of the job, or None if
+    no job is ready.
+
+    """
+    with engine.begin() as connection:
+        # give up on jobs that were on their last attempt when a worker died
+        connection.execute(text(
+            "UPDATE load_job SET status = 'failed', error = 'Lease expired' "
+            "WHERE status = 'running' AND attempts >= max_attempts "
+            'AND renewed_at < now() - make_interval(secs => :lease_seconds)'
+        ), lease_seconds=lease_seconds)
+        row = connection.execute(text(_claim_sql), worker=worker,
+                                 lease_seconds=lease_seconds).first()
+    if row is None:
+        return None
+    job = dict(zip(row.keys(), row))
+    job['payload'] = json.loads(job['payload'])
+    return job
+
+
+@contextmanager
+def renew_lease(engine, job, worker, lease_seconds):
+    """Renew the lease on a claimed job in a background thread until the block
+    ends, so other workers do not claim a job that runs for longer than
+    lease_seconds.
+
+    Arguments
+    ---------
+
+    engine: An SQLAlchemy engine.
+
+    job: The job from claim_job.
+
+    worker: The name of the worker that claimed the job.
+
+    lease_seconds: The lease from claim_job. It is renewed every
+    lease_seconds / 3.
+
+    """
+    stop = threading.Event()
+
+    def renew():
+        while not stop.wait(lease_seconds / 3.0):
+            try:
+                with engine.begin() as connection:
+                    connection.execute(text(_renew_sql), id=job['id'],
+                                       worker=worker)
+            except Exception as e:
+                logging.warning('Could not renew the lease on job %s: %s' %
+                                (job['name'], e))
+
+    thread = threading.Thread(target=renew, name='lease-%d' % job['id'])
+    thread.daemon = True
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _finish_job(engine, job, status, seconds, error=None):
+    with engine.begin() as connection:
+        connection.execute(text(
+            'UPDATE load_job SET status = :status, finished_at = now(), '
+            'seconds = :seconds, error = :error WHERE id = :id'
+        ), status=status, seconds=seconds, error=error, id=job['id'])
+
+
+def has_unfinished_jobs(engine):
+    """Check for jobs that are pending or running."""
+    with engine.connect() as connection:
+        return connection.execute(
+            "SELECT count(*) > 0 FROM load_job "
+            "WHERE status IN ('pending', 'running')"
+        ).scalar()
+
+
+def queue_status(engine):
+    """Count the jobs by kind and status, as a dictionary keyed by (kind,
+    status)."""
+    with engine.connect() as connection:
+        return {(kind, status): n for kind, status, n in connection.execute(
+            'SELECT kind, status, count(*) FROM load_job GROUP BY kind, status'
+        )}
+
+
+def _tuple_or_none(value):
+    return None if value is None else tuple(value)
+
+
+def run_job(session, job):
+    """Run the loader for a job."""
+    from cobradb.loading.component_loading import load_genome
+    from cobradb.loading.model_loading import load_model
+    from cobradb.loading.map_loading import load_maps_from_server
+
+    payload = job['payload']
+    if job['kind'] == 'genome':
+        load_genome(tuple(payload['genome_ref']), payload['file_paths'], session)
+    elif job['kind'] == 'model':
+        load_model(payload['path'], _tuple_or_none(payload['pub_ref']),
+                   _tuple_or_none(payload['genome_ref']), session,
+                   replace=payload.get('replace', False))
+    elif job['kind'] == 'maps':
+        load_maps_from_server(session, drop_maps=payload.get('drop_maps', False),
+                              use_journal=True,
+                              resume=payload.get('resume', False))
+    else:
+        raise ValueError('Bad job kind %s' % job['kind'])
+
+
+def _record(engine, job, seconds):
+    payload = job['payload']
+    if 'fingerprint' in payload:
+        journal.record(engine, job['kind'], job['name'], payload['fingerprint'],
+                       payload.get('inputs'), seconds)
+
+
+def run_worker(engine=None, worker=None, lease_seconds=3600, poll_seconds=5):
+    """Claim and run jobs until the queue is drained. Returns the number of jobs
+    this worker ran.
+
+    Arguments
+    ---------
+
+    engine: An SQLAlchemy engine. Defaults to base.engine.
+
+    worker: A name for the worker. Defaults to the host name and process ID.
+
+    lease_seconds: Reclaim running jobs whose lease has not been renewed for
+    this long.
+
+    poll_seconds: How long to wait when the remaining jobs are blocked by a
+    stage that other workers are still running.
+
+    """
+    if engine is None:
+        engine = base.engine
+    if worker is None:
+        worker = '%s:%d' % (socket.gethostname(), os.getpid())
+    session = base.Session(bind=engine)
+    # fail the job instead of loading a model without a conflicting reaction
+    session.info['raise_integrity_errors'] = True
+    ran = 0
+    try:
+        while True:
+            job = claim_job(engine, worker, lease_seconds)
+            if job is None:
+                if not has_unfinished_jobs(engine):
+                    return ran
+                sleep(poll_seconds)
+                continue
+            logging.info('Worker %s running %s job %s (attempt %d of %d)' %
+                         (worker, job['kind'], job['name'], job['attempts'],
+                          job['max_attempts']))
+            start = time()
+            try:
+                with renew_lease(engine, job, worker, lease_seconds), \
+                        profiling.phase('%s %s' % (job['kind'], job['name'])):
+                    run_job(session, job)
+            except AlreadyLoadedError as e:
+                logging.info(str(e))
+                _finish_job(engine, job, 'done', time() - start)
+                _record(engine, job, time() - start)
+            except Exception as e:
+                logging.exception(e)
+                session.rollback()
+                status = ('failed' if job['attempts'] >= job['max_attempts']
+                          else 'pending')
+                _finish_job(engine, job, status, time() - start,
+                            '%s: %s' % (type(e).__name__, e))
+            else:
+                _finish_job(engine, job, 'done', time() - start)
+                _record(engine, job, time() - start)
+            ran += 1
+    finally:
+        session.close()
+
+
+def _worker_process(connection_string, schema_name, settings_overrides,
+                    lease_seconds, poll_seconds):
+    from cobradb import schema
+
+    logging.basicConfig(level=logging.INFO, format=logging.BASIC_FORMAT)
+    for name, value in settings_overrides.items():
+        setattr(settings, name, value)
+    if schema_name is None:
+        engine = base.make_engine(connection_string)
+    else:
+        engine = schema.schema_engine(schema_name, connection_string)
+    base.Session.configure(bind=engine)
+    try:
+        return run_worker(engine, lease_seconds=lease_seconds,
+                          poll_seconds=poll_seconds)
+    finally:
+        engine.dispose()
+
+
+def run_workers(processes, connection_string=None, schema_name=None,
+                settings_overrides=None, lease_seconds=3600, poll_seconds=5):
+    """Drain the queue with several local worker processes. Returns the number
+    of jobs each worker ran.
+
+    Arguments
+    ---------
+
+    processes: The number of worker processes.
+
+    connection_string: A database URL. Defaults to settings.db_connection_string.
+
+    schema_name: If not None, the workers use the tables in this schema.
+
+    settings_overrides: A dictionary of settings to set in each worker, e.g.
+    paths that were changed in this process.
+
+    lease_seconds, poll_seconds: See run_worker.
+
+    """
+    if connection_string is None:
+        connection_string = settings.db_connection_string
+    # new processes, so the workers do not share the connections of this one
+    context = multiprocessing.get_context('spawn')
+    pool = context.Pool(processes)
+    try:
+        results = [pool.apply_async(_worker_process,
+                                    (connection_string, schema_name,
+                                     settings_overrides or {}, lease_seconds,
+                                     poll_seconds))
+                   for _ in range(processes)]
+        return [result.get() for result in results]
+    finally:
+        pool.close()
+        pool.join()
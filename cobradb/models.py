@@ -74,6 +74,10 @@ class GeneReactionMatrix(Base):
     __tablename__ = 'gene_reaction_matrix'
 
     id = Column(Integer, Sequence('wids'), primary_key=True)
+    # the model of the gene and reaction, so the table can be partitioned
+    model_id = Column(Integer,
+                      ForeignKey('model.id', onupdate="CASCADE", ondelete="CASCADE"),
+                      nullable=False)
     model_gene_id = Column(Integer,
                            ForeignKey('model_gene.id', onupdate="CASCADE", ondelete="CASCADE"),
                            nullable=False)
@@ -172,6 +176,8 @@ class EscherMapMatrix(Base):
     id = Column(Integer, Sequence('wids'), primary_key=True)
     ome_id = Column(Integer, nullable=False)
     escher_map_id = Column(Integer, ForeignKey(EscherMap.id), nullable=False)
+    # the model of the map, so the table can be partitioned
+    model_id = Column(Integer, ForeignKey(Model.id), nullable=False)
     # the reaction id or node id
     escher_map_element_id = Column(String(50))
     type = Column(String, nullable=False)
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+"""Timing and database instrumentation for the loaders.
+
+Start a profiler, run some loaders, and write a JSON report:
+
+    profiler = profiling.start('load_db')
+    with profiling.phase('reactions'):
+        ...
+    profiling.stop()
+    profiler.write_report('load_db_profile.json')
+
+While a profiler is running, every SQL statement on any engine is counted and
+timed, rows inserted are counted per table, and the statements are attributed
+to the phases that are open. Phases nest, and each phase is reported by its
+path, e.g. "load_model/reactions". When no profiler is running, phase() does
+nothing.
+
+"""
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from time import time
+import json
+import logging
+import re
+import sys
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+
+_insert_re = re.compile(r'\s*INSERT\s+INTO\s+"?([\w.]+)', re.IGNORECASE)
+
+# the running profiler
+_profiler = None
+
+
+def peak_rss_mb():
+    """Get the peak resident set size of this process in MB, or None if it is not
+    available.
+
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return rss / 1024.0 / 1024.0
+    return rss / 1024.0
+
+
+class Profiler(object):
+    """Collects phase timings, SQL statistics and inserted row counts.
+
+    Arguments
+    ---------
+
+    name: A name for the report.
+
+    """
+
+    def __init__(self, name='cobradb'):
+        self.name = name
+        self.started_at = datetime.now()
+        self._start = time()
+        self._end = None
+        self._stack = []
+        # phase path -> statistics
+        self.phases = OrderedDict()
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.rows_inserted = defaultdict(int)
+
+    def _phase_stats(self, path):
+        try:
+            return self.phases[path]
+        except KeyError:
+            stats = {'calls': 0, 'seconds': 0.0, 'sql_statements': 0,
+                     'sql_seconds': 0.0}
+            self.phases[path] = stats
+            return stats
+
+    @contextmanager
+    def phase(self, name):
+        """Time a block of code as a phase nested in any open phases."""
+        path = '/'.join(self._stack + [name])
+        self._stack.append(name)
+        start = time()
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            stats = self._phase_stats(path)
+            stats['calls'] += 1
+            stats['seconds'] += time() - start
+
+    def record_sql(self, seconds, table_name=None, rows=0):
+        """Record a statement, attributing it to every open phase.
+
+        Arguments
+        ---------
+
+        seconds: The time spent in the database.
+
+        table_name: For inserts, the name of the table.
+
+        rows: For inserts, the number of rows.
+
+        """
+        self.sql_statements += 1
+        self.sql_seconds += seconds
+        if table_name is not None:
+            self.rows_inserted[table_name] += rows
+        for i in range(len(self._stack)):
+            stats = self._phase_stats('/'.join(self._stack[:i + 1]))
+            stats['sql_statements'] += 1
+            stats['sql_seconds'] += seconds
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters,
+                               context, executemany):
+        conn.info.setdefault('cobradb_query_start', []).append(time())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        seconds = time() - conn.info['cobradb_query_start'].pop()
+        match = _insert_re.match(statement)
+        if match is None:
+            self.record_sql(seconds)
+            return
+        if executemany:
+            rows = len(parameters)
+        else:
+            rows = cursor.rowcount if cursor.rowcount >= 0 else 1
+        self.record_sql(seconds, match.group(1), rows)
+
+    def attach(self):
+        """Listen to statements on all engines."""
+        event.listen(Engine, 'before_cursor_execute',
+                     self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def detach(self):
+        """Stop listening to statements and stop the clock."""
+        event.remove(Engine, 'before_cursor_execute',
+                     self._before_cursor_execute)
+        event.remove(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        self._end = time()
+
+    def report(self):
+        """Get the results as a dictionary that can be serialized to JSON."""
+        end = time() if self._end is None else self._end
+        return OrderedDict([
+            ('name', self.name),
+            ('started_at', self.started_at.isoformat()),
+            ('total_seconds', round(end - self._start, 6)),
+            ('peak_rss_mb', peak_rss_mb()),
+            ('sql', OrderedDict([('statements', self.sql_statements),
+                                 ('seconds', round(self.sql_seconds, 6))])),
+            ('rows_inserted', OrderedDict(sorted(self.rows_inserted.items()))),
+            ('phases', [OrderedDict([('path', path),
+                                     ('calls', stats['calls']),
+                                     ('seconds', round(stats['seconds'], 6)),
+                                     ('sql_statements', stats['sql_statements']),
+                                     ('sql_seconds', round(stats['sql_seconds'], 6))])
+                        for path, stats in self.phases.items()]),
+        ])
+
+    def write_report(self, filepath):
+        """Write the report to a JSON file."""
+        with open(filepath, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        logging.info('Wrote profile to %s' % filepath)
+
+
+def start(name='cobradb'):
+    """Start a new profiler and return it. Stops any running profiler."""
+    global _profiler
+    if _profiler is not None:
+        stop()
+    _profiler = Profiler(name)
+    _profiler.attach()
+    return _profiler
+
+
+def stop():
+    """Stop the running profiler and return it, or None if none was running."""
+    global _profiler
+    profiler = _profiler
+    if profiler is not None:
+        profiler.detach()
+        _profiler = None
+    return profiler
+
+
+def get_profiler():
+    """Get the running profiler, or None."""
+    return _profiler
+
+
+@contextmanager
+def phase(name):
+    """Time a block of code as a phase of the running profiler, if any."""
+    if _profiler is None:
+        yield
+    else:
+        with _profiler.phase(name):
+            yield
+
+
+def record_copy(table_name, rows, seconds):
+    """Record rows written outside of SQLAlchemy, e.g. with COPY."""
+    if _profiler is not None:
+        _profiler.record_sql(seconds, table_name, rows)
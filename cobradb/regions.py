@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+
+"""Interval queries on genome regions."""
+
+from cobradb.base import (GenomeRegion, GenomeRegionMap, Chromosome,
+                          genome_region_range)
+
+from sqlalchemy import or_
+from sqlalchemy.orm import aliased
+import numpy as np
+import six
+
+
+# regions longer than this percentile of the region lengths on a chromosome are
+# checked against every query, instead of widening the search for all regions
+LONG_REGION_PERCENTILE = 99
+
+
+def query_overlapping_regions(session, chromosome_id, leftpos, rightpos):
+    """Query the genome regions on a chromosome that overlap [leftpos, rightpos)
+    using the GiST range index.
+
+    Arguments
+    ---------
+
+    session: An SQLAlchemy session.
+
+    chromosome_id: The database ID of the chromosome.
+
+    leftpos: The start of the interval.
+
+    rightpos: The end of the interval (exclusive).
+
+    """
+    return (session
+            .query(GenomeRegion)
+            .filter(GenomeRegion.chromosome_id == chromosome_id)
+            .filter(GenomeRegion.leftpos.isnot(None))
+            .filter(GenomeRegion.rightpos.isnot(None))
+            .filter(genome_region_range()
+                    .op('&&')(genome_region_range(leftpos, rightpos))))
+
+
+class ChromosomeIntervals(object):
+    """Sorted arrays of the regions on one chromosome, answering overlap and
+    nearest queries for many intervals at once.
+
+    An overlap query looks back from the query start by the length of the
+    longest region, so the few regions that are much longer than the rest,
+    e.g. a region that spans most of the chromosome, are kept apart and
+    checked one by one.
+
+    Arguments
+    ---------
+
+    region_ids: Array of genome region IDs.
+
+    leftpos: Array of region starts.
+
+    rightpos: Array of region ends (exclusive).
+
+    """
+
+    def __init__(self, region_ids, leftpos, rightpos):
+        leftpos, rightpos = (np.asarray(leftpos, dtype=np.int64),
+                             np.asarray(rightpos, dtype=np.int64))
+        leftpos, rightpos = (np.minimum(leftpos, rightpos),
+                             np.maximum(leftpos, rightpos))
+        order = np.argsort(leftpos, kind='mergesort')
+        self.region_ids = np.asarray(region_ids, dtype=np.int64)[order]
+        self.leftpos = leftpos[order]
+        self.rightpos = rightpos[order]
+        lengths = self.rightpos - self.leftpos
+        if len(order) > 0:
+            cutoff = int(np.sort(lengths)[(len(order) - 1) *
+                                          LONG_REGION_PERCENTILE // 100])
+        else:
+            cutoff = 0
+        # positions in the sorted arrays of the long regions, and of the rest
+        self._long = np.flatnonzero(lengths > cutoff)
+        self._short = np.flatnonzero(lengths <= cutoff)
+        self._short_leftpos = self.leftpos[self._short]
+        # the longest short region bounds how far back an overlap can start
+        self.max_length = cutoff
+        # regions ordered by end, for nearest upstream lookups
+        self._end_order = np.argsort(self.rightpos, kind='mergesort')
+        self._sorted_ends = self.rightpos[self._end_order]
+
+    def __len__(self):
+        return len(self.region_ids)
+
+    def overlapping(self, leftpos, rightpos):
+        """Find all regions that overlap each query interval [leftpos, rightpos).
+
+        Returns a tuple of arrays (query_index, region_id) with one entry per
+        overlapping pair.
+
+        """
+        leftpos = np.asarray(leftpos, dtype=np.int64)
+        rightpos = np.asarray(rightpos, dtype=np.int64)
+        # candidates start within max_length before the query and before its end
+        lo = np.searchsorted(self._short_leftpos, leftpos - self.max_length,
+                             side='right')
+        hi = np.searchsorted(self._short_leftpos, rightpos, side='left')
+        counts = np.maximum(hi - lo, 0)
+        query_index = np.repeat(np.arange(len(leftpos)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                      counts)
+        candidates = self._short[np.repeat(lo, counts) + offsets]
+        keep = self.rightpos[candidates] > leftpos[query_index]
+        query_index, candidates = query_index[keep], candidates[keep]
+
+        if len(self._long) > 0:
+            # every query against every long region
+            long_query, long_index = np.nonzero(
+                (self.leftpos[self._long] < rightpos[:, None]) &
+                (self.rightpos[self._long] > leftpos[:, None])
+            )
+            query_index = np.concatenate([query_index, long_query])
+            candidates = np.concatenate([candidates, self._long[long_index]])
+            # by query, then by region start, like the short regions alone
+            order = np.lexsort((candidates, query_index))
+            query_index, candidates = query_index[order], candidates[order]
+        return query_index, self.region_ids[candidates]
+
+    def nearest(self, leftpos, rightpos):
+        """Find the nearest region to each query interval [leftpos, rightpos).
+        Overlapping regions have distance 0. Ties go to the downstream region.
+
+        Returns a tuple of arrays (region_id, distance). Both are -1 when the
+        chromosome has no regions.
+
+        """
+        leftpos = np.asarray(leftpos, dtype=np.int64)
+        rightpos = np.asarray(rightpos, dtype=np.int64)
+        n = len(leftpos)
+        region_id = np.full(n, -1, dtype=np.int64)
+        distance = np.full(n, -1, dtype=np.int64)
+        if len(self) == 0:
+            return region_id, distance
+        big = np.iinfo(np.int64).max
+
+        # closest region that ends at or before the query start
+        up = np.searchsorted(self._sorted_ends, leftpos, side='right') - 1
+        has_up = up >= 0
+        up_index = self._end_order[np.maximum(up, 0)]
+        up_dist = np.where(has_up, leftpos - self.rightpos[up_index], big)
+
+        # closest region that starts at or after the query end
+        down = np.searchsorted(self.leftpos, rightpos, side='left')
+        has_down = down < len(self)
+        down_index = np.minimum(down, len(self) - 1)
+        down_dist = np.where(has_down, self.leftpos[down_index] - rightpos, big)
+
+        use_down = down_dist <= up_dist
+        region_id[:] = np.where(use_down, self.region_ids[down_index],
+                                self.region_ids[up_index])
+        distance[:] = np.where(use_down, down_dist, up_dist)
+
+        # overlaps win
+        query_index, overlap_ids = self.overlapping(leftpos, rightpos)
+        region_id[query_index] = overlap_ids
+        distance[query_index] = 0
+        return region_id, distance
+
+
+def _sorted_pair_gaps(leftpos, rightpos, order, i, j):
+    # with regions sorted by start, the gap between region i and a later j
+    return np.maximum(leftpos[order[j]] - rightpos[order[i]], 0)
+
+
+def region_pairs_within(leftpos, rightpos, max_distance):
+    """Find all pairs of regions on one chromosome within max_distance bp of
+    each other (0 for overlapping regions), with a sort-and-sweep in
+    O(n log n + number of pairs).
+
+    Returns a tuple of arrays (index_1, index_2, distance), where the indices
+    refer to the input arrays and region index_1 starts first.
+
+    Arguments
+    ---------
+
+    leftpos: Array of region starts.
+
+    rightpos: Array of region ends (exclusive).
+
+    max_distance: The largest gap, in bp, for a pair to be included.
+
+    """
+    leftpos = np.asarray(leftpos, dtype=np.int64)
+    rightpos = np.asarray(rightpos, dtype=np.int64)
+    order = np.argsort(leftpos, kind='mergesort')
+    sorted_left = leftpos[order]
+    n = len(order)
+    # every later region that starts within max_distance of the end of region i
+    hi = np.searchsorted(sorted_left, rightpos[order] + max_distance, side='right')
+    lo = np.arange(n) + 1
+    counts = np.maximum(hi - lo, 0)
+    i = np.repeat(np.arange(n), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    j = np.repeat(lo, counts) + offsets
+    distance = _sorted_pair_gaps(leftpos, rightpos, order, i, j)
+    return order[i], order[j], distance
+
+
+def region_pairs_adjacent(leftpos, rightpos, k=1):
+    """Pair each region on one chromosome with the next k regions by start
+    position.
+
+    Returns a tuple of arrays (index_1, index_2, distance). See
+    region_pairs_within.
+
+    Arguments
+    ---------
+
+    leftpos: Array of region starts.
+
+    rightpos: Array of region ends (exclusive).
+
+    k: The number of downstream neighbors for each region.
+
+    """
+    leftpos = np.asarray(leftpos, dtype=np.int64)
+    rightpos = np.asarray(rightpos, dtype=np.int64)
+    order = np.argsort(leftpos, kind='mergesort')
+    n = len(order)
+    i = np.concatenate([np.arange(n - d) for d in range(1, k + 1)]
+                       or [np.empty(0, dtype=np.int64)]).astype(np.int64)
+    j = np.concatenate([np.arange(d, n) for d in range(1, k + 1)]
+                       or [np.empty(0, dtype=np.int64)]).astype(np.int64)
+    distance = _sorted_pair_gaps(leftpos, rightpos, order, i, j)
+    return order[i], order[j], distance
+
+
+def get_region_neighbors(session, genome_region_ids, max_distance=None):
+    """Look up the stored neighbors (see loading.region_map_loading) of many
+    genome regions with one query.
+
+    Returns a dictionary where keys are genome region IDs and values are lists
+    of (neighbor ID, distance) tuples, sorted by distance.
+
+    Arguments
+    ---------
+
+    session: An SQLAlchemy session.
+
+    genome_region_ids: An iterable of genome region IDs.
+
+    max_distance: Optionally, only return neighbors within this distance.
+
+    """
+    genome_region_ids = list(set(genome_region_ids))
+    out = {x: [] for x in genome_region_ids}
+    if len(genome_region_ids) == 0:
+        return out
+    query = (session
+             .query(GenomeRegionMap.genome_region_id_1,
+                    GenomeRegionMap.genome_region_id_2,
+                    GenomeRegionMap.distance)
+             .filter(or_(GenomeRegionMap.genome_region_id_1.in_(genome_region_ids),
+                         GenomeRegionMap.genome_region_id_2.in_(genome_region_ids))))
+    if max_distance is not None:
+        query = query.filter(GenomeRegionMap.distance <= max_distance)
+    for id_1, id_2, distance in query:
+        if id_1 in out:
+            out[id_1].append((id_2, distance))
+        if id_2 in out:
+            out[id_2].append((id_1, distance))
+    for neighbors in out.values():
+        neighbors.sort(key=lambda x: (x[1], x[0]))
+    return out
+
+
+def get_neighborhoods(session, genome_id, max_distance, same_strand=True):
+    """Group the regions of a genome into neighborhoods (e.g. candidate operons)
+    by chaining stored neighbor pairs within max_distance.
+
+    Returns a list of neighborhoods, each a sorted list of genome region IDs.
+    Regions without neighbors are not included.
+
+    Arguments
+    ---------
+
+    session: An SQLAlchemy session.
+
+    genome_id: The database ID of the genome.
+
+    max_distance: The largest gap between neighbors in a neighborhood.
+
+    same_strand: If True, only chain regions on the same strand.
+
+    """
+    Region1 = aliased(GenomeRegion)
+    Region2 = aliased(GenomeRegion)
+    query = (session
+             .query(GenomeRegionMap.genome_region_id_1,
+                    GenomeRegionMap.genome_region_id_2)
+             .join(Region1, Region1.id == GenomeRegionMap.genome_region_id_1)
+             .join(Region2, Region2.id == GenomeRegionMap.genome_region_id_2)
+             .join(Chromosome, Chromosome.id == Region1.chromosome_id)
+             .filter(Chromosome.genome_id == genome_id)
+             .filter(GenomeRegionMap.distance <= max_distance))
+    if same_strand:
+        query = query.filter(Region1.strand == Region2.strand)
+
+    # union-find over the pairs
+    parent = {}
+
+    def find(x):
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for id_1, id_2 in query:
+        root_1, root_2 = find(id_1), find(id_2)
+        if root_1 != root_2:
+            parent[max(root_1, root_2)] = min(root_1, root_2)
+
+    groups = {}
+    for region_id in parent:
+        groups.setdefault(find(region_id), []).append(region_id)
+    return sorted(sorted(x) for x in groups.values())
+
+
+class GenomeRegionIndex(object):
+    """In-memory interval index over the genome regions of a genome, with one
+    ChromosomeIntervals per chromosome. All regions are read with one query.
+
+    Arguments
+    ---------
+
+    session: An SQLAlchemy session.
+
+    genome_id: The database ID of the genome.
+
+    region_type: Optionally, only index regions of this polymorphic type,
+    e.g. 'gene'.
+
+    """
+
+    def __init__(self, session, genome_id, region_type=None):
+        query = (session
+                 .query(GenomeRegion.chromosome_id, GenomeRegion.id,
+                        GenomeRegion.leftpos, GenomeRegion.rightpos)
+                 .join(Chromosome, Chromosome.id == GenomeRegion.chromosome_id)
+                 .filter(Chromosome.genome_id == genome_id)
+                 .filter(GenomeRegion.leftpos.isnot(None))
+                 .filter(GenomeRegion.rightpos.isnot(None)))
+        if region_type is not None:
+            query = query.filter(GenomeRegion.type == region_type)
+        by_chromosome = {}
+        for chromosome_id, region_id, leftpos, rightpos in query:
+            by_chromosome.setdefault(chromosome_id, []).append((region_id,
+                                                                leftpos,
+                                                                rightpos))
+        self.chromosomes = {
+            chromosome_id: ChromosomeIntervals(*zip(*rows))
+            for chromosome_id, rows in six.iteritems(by_chromosome)
+        }
+
+    def _get(self, chromosome_id):
+        return self.chromosomes.get(chromosome_id,
+                                    ChromosomeIntervals([], [], []))
+
+    def overlapping(self, chromosome_id, leftpos, rightpos):
+        """Batch overlap query on one chromosome. See
+        ChromosomeIntervals.overlapping."""
+        return self._get(chromosome_id).overlapping(leftpos, rightpos)
+
+    def nearest(self, chromosome_id, leftpos, rightpos):
+        """Batch nearest query on one chromosome. See
+        ChromosomeIntervals.nearest."""
+        return self._get(chromosome_id).nearest(leftpos, rightpos)
+
+
+_index_cache = {}
+
+
+def get_genome_region_index(session, genome_id, region_type='gene'):
+    """Get a cached GenomeRegionIndex for a genome.
+
+    Arguments
+    ---------
+
+    session: An SQLAlchemy session.
+
+    genome_id: The database ID of the genome.
+
+    region_type: See GenomeRegionIndex. Defaults to genes.
+
+    """
+    key = (str(session.get_bind().url), genome_id, region_type)
+    if key not in _index_cache:
+        _index_cache[key] = GenomeRegionIndex(session, genome_id, region_type)
+    return _index_cache[key]
+
+
+def clear_genome_region_index_cache():
+    """Forget all cached interval indexes, e.g. after loading new genes."""
+    _index_cache.clear()
@@ -0,0 +1,718 @@
+# -*- coding: utf-8 -*-
+
+"""Schema management for full rebuilds: deferred constraint checks and index
+builds, rebuilds in a shadow schema, and partitioning of the model tables.
+
+Call defer_constraints after create_all and before bulk loading. It drops the
+foreign keys and the secondary indexes, plus the unique constraints on the
+COPY-loaded tables. Call restore_constraints after loading. It rebuilds the
+unique constraints and indexes in parallel, adds the foreign keys as NOT VALID
+and then validates them, and runs ANALYZE.
+
+The definitions of the deferred objects are stored in the deferred_ddl table,
+so an interrupted load can be finished with restore_constraints.
+
+The other unique constraints are kept while loading, because the loaders look
+up existing rows by those columns. Without their indexes the lookups would scan
+whole tables.
+
+For a rebuild without downtime, load into a shadow schema while readers keep
+using the live one:
+
+    create_shadow_schema(base.engine)
+    engine = schema_engine(SHADOW_SCHEMA)
+    base.Session.configure(bind=engine)
+    base.Base.metadata.create_all(engine)
+    set_unlogged(engine)
+    ... load ...
+    set_logged(engine)
+    if not smoke_check(engine, base.engine):
+        swap_schemas(base.engine)
+
+swap_schemas moves the tables, sequences and types, not the schemas, so
+extensions and other objects in the live schema are left alone.
+
+The model tables can be partitioned by model_id with partition_model_tables.
+With list partitioning every model gets its own partitions, which are created
+by create_model_partitions before the model is loaded, so drop_model removes
+a model by dropping tables instead of deleting rows, and queries for one model
+only read its partitions. Hash partitioning spreads the models over a fixed
+number of partitions, which keeps the catalog small for many models.
+
+"""
+
+from cobradb import base
+
+from sqlalchemy import event, text
+
+from multiprocessing.pool import ThreadPool
+import logging
+import re
+
+
+# tables that are written with COPY after deduplicating in Python, so their
+# unique constraints are not needed while loading
+COPY_LOADED_TABLES = ['genome_data', 'genome_region_map']
+
+_create_deferred_ddl = """
+CREATE TABLE IF NOT EXISTS deferred_ddl (
+    id serial PRIMARY KEY,
+    table_name text NOT NULL,
+    name text NOT NULL,
+    kind char(1) NOT NULL,
+    definition text NOT NULL
+)
+"""
+
+_constraints_sql = """
+SELECT c.conrelid::regclass::text, c.conname, c.contype,
+       pg_get_constraintdef(c.oid)
+FROM pg_constraint c
+WHERE c.connamespace = current_schema()::regnamespace
+AND (c.contype = 'f' OR (c.contype = 'u' AND c.conrelid::regclass::text = ANY(:tables)))
+AND c.conparentid = 0
+ORDER BY c.contype, c.conrelid::regclass::text, c.conname
+"""
+
+_indexes_sql = """
+SELECT i.tablename, i.indexname, i.indexdef
+FROM pg_indexes i
+WHERE i.schemaname = current_schema()
+AND i.tablename <> 'deferred_ddl'
+AND NOT EXISTS (SELECT 1 FROM pg_constraint c
+                WHERE c.conname = i.indexname
+                AND c.connamespace = current_schema()::regnamespace)
+AND NOT EXISTS (SELECT 1 FROM pg_inherits h
+                WHERE h.inhrelid = quote_ident(i.indexname)::regclass)
+ORDER BY i.tablename, i.indexname
+"""
+
+
+def _has_deferred_ddl(connection):
+    return connection.execute(
+        text("SELECT to_regclass('deferred_ddl') IS NOT NULL")
+    ).scalar()
+
+
+def deferred_constraints(engine):
+    """Get the deferred constraints and indexes that still need to be restored,
+    as a list of (id, table_name, name, kind, definition) tuples. kind is u for
+    a unique constraint, f for a foreign key, or i for an index.
+
+    """
+    with engine.connect() as connection:
+        if not _has_deferred_ddl(connection):
+            return []
+        return [tuple(row) for row in connection.execute(
+            'SELECT id, table_name, name, kind, definition FROM deferred_ddl '
+            'ORDER BY id'
+        )]
+
+
+def defer_constraints(engine):
+    """Drop the foreign keys, secondary indexes, and unique constraints of the
+    COPY-loaded tables, and remember their definitions. Returns the number of
+    dropped objects.
+
+    Arguments
+    ---------
+
+    engine: An SQLAlchemy engine.
+
+    """
+    with engine.begin() as connection:
+        connection.execute(_create_deferred_ddl)
+        constraints = connection.execute(text(_constraints_sql),
+                                         tables=COPY_LOADED_TABLES).fetchall()
+        indexes = connection.execute(text(_indexes_sql)).fetchall()
+        for table_name, name, kind, definition in constraints:
+            connection.execute(
+                text('INSERT INTO deferred_ddl (table_name, name, kind, definition) '
+                     'VALUES (:table_name, :name, :kind, :definition)'),
+                table_name=table_name, name=name, kind=kind,
+                definition=definition
+            )
+            connection.execute('ALTER TABLE %s DROP CONSTRAINT %s' %
+                               (table_name, name))
+        for table_name, name, definition in indexes:
+            connection.execute(
+                text('INSERT INTO deferred_ddl (table_name, name, kind, definition) '
+                     "VALUES (:table_name, :name, 'i', :definition)"),
+                table_name=table_name, name=name, definition=definition
+            )
+            connection.execute('DROP INDEX %s' % name)
+    n = len(constraints) + len(indexes)
+    logging.info('Deferred %d constraints and indexes' % n)
+    return n
+
+
+def _run_ddl(engine, statements, ddl_id, maintenance_workers):
+    with engine.begin() as connection:
+        if maintenance_workers is not None:
+            connection.execute('SET LOCAL max_parallel_maintenance_workers = %d'
+                               % maintenance_workers)
+        for statement in statements:
+            connection.execute(statement)
+        connection.execute(text('DELETE FROM deferred_ddl WHERE id = :id'),
+                           id=ddl_id)
+
+
+def _run_all(engine, jobs, items, maintenance_workers):
+    """Run (deferred_ddl id, name, statements) items on up to jobs connections,
+    each in its own transaction. Returns the names that failed."""
+    def run(item):
+        ddl_id, name, statements = item
+        try:
+            _run_ddl(engine, statements, ddl_id, maintenance_workers)
+        except Exception as e:
+            logging.error('Could not restore %s: %s' % (name, e))
+            return name
+        logging.debug('Restored %s' % name)
+        return None
+
+    if jobs <= 1 or len(items) <= 1:
+        results = [run(item) for item in items]
+    else:
+        pool = ThreadPool(min(jobs, len(items)))
+        try:
+            results = pool.map(run, items, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    return [name for name in results if name is not None]
+
+
+def restore_constraints(engine, jobs=4, maintenance_workers=None,
+                        analyze=True):
+    """Rebuild everything that defer_constraints dropped. Returns a list with the
+    names of any constraints or indexes that could not be restored, e.g. because
+    of duplicate rows. Those stay in deferred_ddl.
+
+    Arguments
+    ---------
+
+    engine: An SQLAlchemy engine. Its pool should allow at least jobs
+    connections.
+
+    jobs: The number of indexes and constraints to build at the same time.
+
+    maintenance_workers: If not None, set max_parallel_maintenance_workers for
+    each index build.
+
+    analyze: If True, run ANALYZE at the end.
+
+    """
+    pending = deferred_constraints(engine)
+    if len(pending) == 0:
+        return []
+    logging.info('Restoring %d constraints and indexes' % len(pending))
+
+    # unique constraints and indexes first, then the foreign keys as NOT VALID,
+    # which is quick, and then validate them
+    builds = [(ddl_id, name, ['ALTER TABLE %s ADD CONSTRAINT %s %s' %
+                              (table_name, name, definition)]
+               if kind == 'u' else [definition])
+              for ddl_id, table_name, name, kind, definition in pending
+              if kind in ('u', 'i')]
+    failed = _run_all(engine, jobs, builds, maintenance_workers)
+
+    foreign_keys = [(ddl_id, table_name, name, definition)
+                    for ddl_id, table_name, name, kind, definition in pending
+                    if kind == 'f']
+    with engine.begin() as connection:
+        partitioned = partitioned_tables(connection)
+        for ddl_id, table_name, name, definition in foreign_keys:
+            # left from an earlier restore that could not validate it
+            exists = connection.execute(
+                text('SELECT count(*) > 0 FROM pg_constraint WHERE conname = :name '
+                     'AND conrelid = CAST(:table_name AS regclass)'),
+                name=name, table_name=table_name
+            ).scalar()
+            if not exists and table_name not in partitioned:
+                connection.execute('ALTER TABLE %s ADD CONSTRAINT %s %s NOT VALID'
+                                   % (table_name, name, definition))
+    # a foreign key on a partitioned table cannot be NOT VALID, so it is added
+    # and checked in one step
+    validations = [(ddl_id, name, ['ALTER TABLE %s ADD CONSTRAINT %s %s' %
+                                   (table_name, name, definition)]
+                    if table_name in partitioned else
+                    ['ALTER TABLE %s VALIDATE CONSTRAINT %s' % (table_name, name)])
+                   for ddl_id, table_name, name, definition in foreign_keys]
+    failed += _run_all(engine, jobs, validations, None)
+
+    if analyze:
+        logging.info('Analyzing')
+        with engine.begin() as connection:
+            connection.execute('ANALYZE')
+
+    if len(failed) > 0:
+        logging.error('Could not restore %d constraints and indexes: %s' %
+                      (len(failed), ', '.join(failed)))
+    return failed
+
+
+# schema names for shadow rebuilds
+LIVE_SCHEMA = 'public'
+SHADOW_SCHEMA = 'cobradb_shadow'
+OLD_SCHEMA = 'cobradb_old'
+
+# tables that must have rows after a full load
+SMOKE_CHECK_TABLES = ['genome', 'model', 'reaction', 'component',
+                      'model_reaction', 'database_version']
+
+
+def create_shadow_schema(engine, name=SHADOW_SCHEMA):
+    """Drop and create an empty schema for a rebuild.
+
+    Arguments
+    ---------
+
+    engine: An SQLAlchemy engine for the database.
+
+    name: The schema name.
+
+    """
+    with engine.begin() as connection:
+        connection.execute('DROP SCHEMA IF EXISTS %s CASCADE' % name)
+        connection.execute('CREATE SCHEMA %s' % name)
+    logging.info('Created schema %s' % name)
+
+
+def schema_engine(name, connection_string=None, **overrides):
+    """Create an engine whose connections use the given schema for all tables,
+    types and sequences. Not supported in PgBouncer mode, because search_path
+    is set once per connection.
+
+    Arguments
+    ---------
+
+    name: The schema name.
+
+    connection_string, overrides: See base.make_engine.
+
+    """
+    engine = base.make_engine(connection_string, **overrides)
+
+    @event.listens_for(engine, 'connect')
+    def set_search_path(dbapi_connection, connection_record):
+        # SET is transactional, so run it outside of a transaction
+        autocommit = dbapi_connection.autocommit
+        dbapi_connection.autocommit = True
+        cursor = dbapi_connection.cursor()
+        cursor.execute('SET search_path TO %s' % name)
+        cursor.close()
+        dbapi_connection.autocommit = autocommit
+
+    return engine
+
+
+def set_unlogged(engine):
+    """Make the cobradb tables unlogged, so loading them skips the WAL. Run
+    set_logged before using the data. An unlogged table is emptied after a
+    crash and is not replicated.
+
+    """
+    # a logged table cannot reference an unlogged one, so start with the tables
+    # that reference others
+    with engine.begin() as connection:
+        for table_name in reversed(_plain_tables(connection)):
+            connection.execute('ALTER TABLE %s SET UNLOGGED' % table_name)
+
+
+def set_logged(engine):
+    """Make the cobradb tables logged again. Each table is rewritten into the
+    WAL."""
+    with engine.begin() as connection:
+        for table_name in _plain_tables(connection):
+            connection.execute('ALTER TABLE %s SET LOGGED' % table_name)
+
+
+def _plain_tables(connection):
+    # partitioned tables have no storage of their own, so they are left out
+    partitioned = partitioned_tables(connection)
+    return [table.name for table in base.Base.metadata.sorted_tables
+            if table.name not in partitioned]
+
+
+def _table_counts(engine, tables):
+    with engine.connect() as connection:
+        return {t: connection.execute('SELECT count(*) FROM %s' % t).scalar()
+                for t in tables}
+
+
+_dependent_views_sql = """
+SELECT DISTINCT v.relname, t.relname FROM pg_depend d
+JOIN pg_rewrite r ON r.oid = d.objid
+JOIN pg_class v ON v.oid = r.ev_class
+JOIN pg_class t ON t.oid = d.refobjid
+WHERE d.classid = 'pg_rewrite'::regclass AND d.refclassid = 'pg_class'::regclass
+AND t.relnamespace = current_schema()::regnamespace
+AND t.relname = ANY(:tables) AND v.oid <> t.oid
+ORDER BY v.relname, t.relname
+"""
+
+_table_grants_sql = """
+SELECT relname, CAST(relacl AS text) FROM pg_class
+WHERE relnamespace = current_schema()::regnamespace AND relname = ANY(:tables)
+"""
+
+
+def _foreign_object_problems(engine, live_engine):
+    tables = [table.name for table in base.Base.metadata.sorted_tables]
+    try:
+        with live_engine.connect() as connection:
+            views = connection.execute(text(_dependent_views_sql),
+                                       tables=tables).fetchall()
+            live_grants = dict(connection.execute(text(_table_grants_sql),
+                                                  tables=tables).fetchall())
+    except Exception as e:
+        logging.warning('Could not check the live schema for views and grants: %s'
+                        % e)
+        return []
+    with engine.connect() as connection:
+        grants = dict(connection.execute(text(_table_grants_sql),
+                                         tables=tables).fetchall())
+    problems = ['View %s reads table %s and would keep reading the old table'
+                % (view, table) for view, table in views]
+    problems.extend('Table %s has grants that the rebuilt table does not have'
+                    % table_name
+                    for table_name, acl in sorted(live_grants.items())
+                    if acl is not None and grants.get(table_name) != acl)
+    return problems
+
+
+def smoke_check(engine, live_engine=None, min_fraction=0.9):
+    """Check that a rebuilt schema looks complete. Returns a list of problems,
+    which is empty when the schema is ready to swap in.
+
+    Arguments
+    ---------
+
+    engine: An engine for the rebuilt schema. See schema_engine.
+
+    live_engine: An engine for the live schema. If given, each checked table
+    must have at least min_fraction of the rows in the live table.
+
+    min_fraction: See live_engine.
+
+    With live_engine, it also finds what swap_schemas would leave behind: views
+    in the live schema that read a cobradb table would keep reading the old
+    table, and grants on a live table are not copied to the rebuilt one.
+
+    """
+    problems = []
+    if len(deferred_constraints(engine)) > 0:
+        problems.append('Some constraints or indexes were not restored')
+    counts = _table_counts(engine, SMOKE_CHECK_TABLES)
+    for table_name in SMOKE_CHECK_TABLES:
+        if counts[table_name] == 0:
+            problems.append('Table %s is empty' % table_name)
+    if live_engine is not None:
+        try:
+            live_counts = _table_counts(live_engine, SMOKE_CHECK_TABLES)
+        except Exception as e:
+            logging.warning('Could not count rows in the live schema: %s' % e)
+            live_counts = {}
+        for table_name, live_count in live_counts.items():
+            if counts[table_name] < live_count * min_fraction:
+                problems.append('Table %s has %d rows, down from %d' %
+                                (table_name, counts[table_name], live_count))
+        problems.extend(_foreign_object_problems(engine, live_engine))
+    for problem in problems:
+        logging.error('Smoke check: %s' % problem)
+    return problems
+
+
+# the tables, partitions, sequences and enum types in a schema. Sequences that
+# belong to a serial column move with their table.
+_schema_objects_sql = """
+SELECT 'TABLE', c.relname FROM pg_class c
+WHERE c.relnamespace = CAST(:name AS regnamespace) AND c.relkind IN ('r', 'p')
+UNION ALL
+SELECT 'SEQUENCE', c.relname FROM pg_class c
+WHERE c.relnamespace = CAST(:name AS regnamespace) AND c.relkind = 'S'
+AND NOT EXISTS (SELECT 1 FROM pg_depend d
+                WHERE d.classid = 'pg_class'::regclass AND d.objid = c.oid
+                AND d.deptype IN ('a', 'i'))
+UNION ALL
+SELECT 'TYPE', t.typname FROM pg_type t
+WHERE t.typnamespace = CAST(:name AS regnamespace) AND t.typtype = 'e'
+"""
+
+
+def swap_schemas(engine, shadow=SHADOW_SCHEMA, live=LIVE_SCHEMA,
+                 old=OLD_SCHEMA, lock_timeout=10000):
+    """Swap the rebuilt tables in for the live ones in one transaction. The
+    tables, sequences and types of the shadow schema are moved into the live
+    schema, and the live objects with the same names are moved into old,
+    replacing any earlier old schema. The shadow schema is dropped. Anything
+    else in the live schema, like extensions, other tables and the grants on
+    the schema, stays where it is. The swap can be reversed with
+    swap_schemas(engine, shadow=OLD_SCHEMA, old=SHADOW_SCHEMA).
+
+    Views and grants on the live tables are not moved over, so run smoke_check
+    with the live engine first. See there.
+
+    Arguments
+    ---------
+
+    engine: An SQLAlchemy engine for the database.
+
+    shadow: The rebuilt schema.
+
+    live: The live schema.
+
+    old: The schema for the previous live objects.
+
+    lock_timeout: Give up after this many milliseconds waiting for readers,
+    instead of blocking new queries behind the swap.
+
+    """
+    with engine.begin() as connection:
+        connection.execute('SET LOCAL lock_timeout = %d' % lock_timeout)
+        connection.execute('DROP SCHEMA IF EXISTS %s CASCADE' % old)
+        connection.execute('CREATE SCHEMA %s' % old)
+        objects = connection.execute(text(_schema_objects_sql),
+                                     name=shadow).fetchall()
+        live_objects = set(connection.execute(text(_schema_objects_sql),
+                                              name=live).fetchall())
+        # make room for all of them first, because they refer to each other
+        for kind, name in objects:
+            if (kind, name) in live_objects:
+                connection.execute('ALTER %s %s.%s SET SCHEMA %s' %
+                                   (kind, live, name, old))
+        for kind, name in objects:
+            connection.execute('ALTER %s %s.%s SET SCHEMA %s' %
+                               (kind, shadow, name, live))
+        connection.execute('DROP SCHEMA %s CASCADE' % shadow)
+    logging.info('Swapped the tables in %s in for the ones in %s. The previous '
+                 'tables are in %s' % (shadow, live, old))
+
+
+# model tables that can be partitioned by model_id, with the tables that are
+# referenced by foreign keys first
+PARTITIONED_TABLES = ['model_gene', 'model_reaction',
+                      'model_compartmentalized_component',
+                      'gene_reaction_matrix', 'old_id_model_synonym',
+                      'escher_map_matrix']
+
+
+def partitioned_tables(connection):
+    """Get a dictionary with the partitioned tables in the current schema and
+    their strategies, l for list or h for hash.
+
+    """
+    # dict() would take the result for a mapping because it has keys()
+    return {name: strategy for name, strategy in connection.execute(
+        "SELECT p.partrelid::regclass::text, p.partstrat "
+        "FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relnamespace = current_schema()::regnamespace"
+    )}
+
+
+def _partition_name(table_name, model_db_id):
+    return '%s_m%d' % (table_name, model_db_id)
+
+
+def _partition_table(connection, table_name, method, partitions):
+    """Replace a table with a partitioned copy of itself, keeping its rows and
+    constraints."""
+    old_name = '%s_unpartitioned' % table_name
+    constraints = connection.execute(text(
+        'SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint '
+        'WHERE conrelid = CAST(:table_name AS regclass) ORDER BY contype, conname'
+    ), table_name=table_name).fetchall()
+    indexes = connection.execute(text(
+        'SELECT indexname, indexdef FROM pg_indexes '
+        'WHERE schemaname = current_schema() AND tablename = :table_name '
+        'AND NOT EXISTS (SELECT 1 FROM pg_constraint c '
+        '                WHERE c.conname = indexname '
+        '                AND c.conrelid = CAST(:table_name AS regclass))'
+    ), table_name=table_name).fetchall()
+
+    # free the constraint and index names for the new table
+    connection.execute('ALTER TABLE %s RENAME TO %s' % (table_name, old_name))
+    for name, kind, definition in constraints:
+        connection.execute('ALTER TABLE %s DROP CONSTRAINT %s' % (old_name, name))
+    for name, definition in indexes:
+        connection.execute('DROP INDEX %s' % name)
+
+    connection.execute('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS) '
+                       'PARTITION BY %s (model_id)' %
+                       (table_name, old_name, method.upper()))
+    # unique constraints must include the partition key. The other columns of
+    # these constraints point at rows of a single model, so adding model_id
+    # does not loosen them.
+    for name, kind, definition in constraints:
+        if kind == 'p':
+            definition = 'PRIMARY KEY (id, model_id)'
+        elif kind == 'u' and 'model_id' not in definition:
+            definition = definition[:-1] + ', model_id)'
+        connection.execute('ALTER TABLE %s ADD CONSTRAINT %s %s' %
+                           (table_name, name, definition))
+    for name, definition in indexes:
+        connection.execute(definition)
+
+    if method == 'list':
+        # every model gets a partition, even if it has no rows in this table
+        for (model_db_id,) in connection.execute('SELECT id FROM model'):
+            connection.execute('CREATE TABLE %s PARTITION OF %s FOR VALUES IN (%d)' %
+                               (_partition_name(table_name, model_db_id),
+                                table_name, model_db_id))
+    else:
+        for i in range(partitions):
+            connection.execute('CREATE TABLE %s_p%d PARTITION OF %s '
+                               'FOR VALUES WITH (MODULUS %d, REMAINDER %d)' %
+                               (table_name, i, table_name, partitions, i))
+    connection.execute('INSERT INTO %s SELECT * FROM %s' % (table_name, old_name))
+    connection.execute('DROP TABLE %s' % old_name)
+
+
+def _foreign_key_with_model_id(table_name, name, definition):
+    """Rewrite a foreign key to a partitioned table so it also matches
+    model_id, because the primary key of the table is (id, model_id)."""
+    match = re.match(r'FOREIGN KEY \((\w+)\) REFERENCES ([\w.]+)\(id\)(.*)$',
+                     definition)
+    if match is None:
+        raise ValueError('Cannot add model_id to foreign key %s on %s'
+                         % (name, table_name))
+    column, referenced, actions = match.groups()
+    return ('FOREIGN KEY (%s, model_id) REFERENCES %s(id, model_id)%s' %
+            (column, referenced, actions))
+
+
+def partition_model_tables(engine, method='list', partitions=16):
+    """Partition the model tables by model_id. Existing rows are kept. Tables
+    that are already partitioned are left alone.
+
+    A partitioned table has no unique constraint on id alone, so the foreign
+    keys to the partitioned tables, e.g. from gene_reaction_matrix to
+    model_gene, are replaced by foreign keys on (id, model_id).
+
+    Arguments
+    ---------
+
+    engine: An SQLAlchemy engine.
+
+    method: list for one partition per model, or hash for a fixed number of
+    partitions.
+
+    partitions: The number of partitions for hash partitioning.
+
+    """
+    if method not in ('list', 'hash'):
+        raise ValueError('Bad partitioning method %s' % method)
+    with engine.begin() as connection:
+        partitioned = partitioned_tables(connection)
+        tables = [t for t in PARTITIONED_TABLES if t not in partitioned]
+        if len(tables) == 0:
+            return
+        foreign_keys = connection.execute(text(
+            'SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid) '
+            "FROM pg_constraint WHERE contype = 'f' AND conparentid = 0 "
+            'AND confrelid::regclass::text = ANY(:tables)'
+        ), tables=tables).fetchall()
+        # check them all before changing anything
+        restored = [(table_name, name,
+                     _foreign_key_with_model_id(table_name, name, definition))
+                    for table_name, name, definition in foreign_keys]
+        for table_name, name, _ in foreign_keys:
+            connection.execute('ALTER TABLE %s DROP CONSTRAINT %s' %
+                               (table_name, name))
+        for table_name in tables:
+            _partition_table(connection, table_name, method, partitions)
+        for table_name, name, definition in restored:
+            logging.info('Adding foreign key %s on %s with model_id' %
+                         (name, table_name))
+            connection.execute('ALTER TABLE %s ADD CONSTRAINT %s %s' %
+                               (table_name, name, definition))
+    logging.info('Partitioned %s by model_id with %s partitioning' %
+                 (', '.join(tables), method))
+
+
+def create_model_partitions(engine, model_db_id):
+    """Create the partitions for a model in the list partitioned tables, in a
+    short transaction of their own.
+
+    Creating a partition locks the partitioned table, so call this before the
+    transaction that loads the model, with an ID from ids.allocate_ids. Then
+    queries for other models only wait for this transaction.
+
+    Arguments
+    ---------
+
+    engine: An SQLAlchemy engine.
+
+    model_db_id: The database ID of the model.
+
+    """
+    with engine.begin() as connection:
+        partitioned = partitioned_tables(connection)
+        for table_name in PARTITIONED_TABLES:
+            if partitioned.get(table_name) == 'l':
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS %s PARTITION OF %s FOR VALUES IN (%d)' %
+                    (_partition_name(table_name, model_db_id), table_name,
+                     model_db_id)
+                )
+
+
+def _drop_partitions(connection, model_db_id, partitioned):
+    # detach before dropping, which also removes the foreign keys to the
+    # partition, and the referencing partitions go first
+    for table_name in reversed(PARTITIONED_TABLES):
+        if partitioned.get(table_name) != 'l':
+            continue
+        partition_name = _partition_name(table_name, model_db_id)
+        if connection.execute(text('SELECT to_regclass(:name)'),
+                              name=partition_name).scalar() is None:
+            continue
+        connection.execute('ALTER TABLE %s DETACH PARTITION %s' %
+                           (table_name, partition_name))
+        connection.execute('DROP TABLE %s' % partition_name)
+
+
+def drop_model_partitions(engine, model_db_id):
+    """Drop the partitions of a model that was not loaded, e.g. after
+    create_model_partitions and a failed load.
+
+    Arguments
+    ---------
+
+    engine: An SQLAlchemy engine.
+
+    model_db_id: The database ID of the model.
+
+    """
+    with engine.begin() as connection:
+        _drop_partitions(connection, model_db_id, partitioned_tables(connection))
+
+
+def drop_model(connection, model_db_id):
+    """Remove a model and everything that belongs to it. With list partitioning
+    the partitions of the model are dropped, and otherwise its rows are deleted.
+    The universal reactions, metabolites and genes are kept.
+
+    Run this in the transaction that loads the replacement, so readers see
+    either the old model or the new one.
+
+    Arguments
+    ---------
+
+    connection: An SQLAlchemy connection, e.g. from session.connection().
+
+    model_db_id: The database ID of the model.
+
+    """
+    partitioned = partitioned_tables(connection)
+    _drop_partitions(connection, model_db_id, partitioned)
+    for table_name in reversed(PARTITIONED_TABLES):
+        if partitioned.get(table_name) != 'l':
+            connection.execute(text('DELETE FROM %s WHERE model_id = :model_id' %
+                                    table_name),
+                               model_id=model_db_id)
+    connection.execute(text('DELETE FROM escher_map WHERE model_id = :model_id'),
+                       model_id=model_db_id)
+    # model_count and publication_model cascade
+    connection.execute(text('DELETE FROM model WHERE id = :model_id'),
+                       model_id=model_db_id)
@@ -1,8 +1,16 @@
 # -*- coding: utf-8 -*-
 
-"""Retrive local user settings"""
+"""Retrive local user settings.
+
+Settings are read from settings.ini and the environment the first time one is
+accessed, so importing cobradb does not require a settings file. Settings
+assigned directly on this module (e.g. in tests) take precedence over the
+values that are read.
+
+"""
 
 from configparser import SafeConfigParser, NoOptionError
+import logging
 import os
 from os.path import join, split, abspath, isfile, expanduser, dirname
 from sys import modules
@@ -13,13 +21,8 @@ self = modules[__name__]
 # define various filepaths
 
 config = SafeConfigParser()
-
-# overwrite defaults settings with settings from the file
 filepath = abspath(join(dirname(__file__), 'settings.ini'))
-if isfile(filepath):
-    config.read(filepath)
-else:
-    raise Exception('No settings files at path: %s' % filepath)
+_loaded = False
 
 # prefer environment variables for database settings
 env_names = {
@@ -30,49 +33,126 @@ env_names = {
     'postgres_database': 'COBRADB_POSTGRES_DATABASE',
     'postgres_test_database': 'COBRADB_POSTGRES_TEST_DATABASE',
 }
-for setting_name, env_name in six.iteritems(env_names):
-    if env_name in os.environ:
-        print('Setting %s with environment variable %s' % (setting_name,
-                                                           env_name))
-        setattr(self, setting_name, os.environ[env_name])
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    if value.strip().lower() in ('1', 'true', 'yes', 'on'):
+        return True
+    if value.strip().lower() in ('0', 'false', 'no', 'off', ''):
+        return False
+    raise Exception('Could not parse boolean setting: %s' % value)
+
+
+# optional connection pool and engine settings. Like the database settings,
+# environment variables take precedence over settings.ini.
+engine_settings = {
+    # setting name: (environment variable, type, default)
+    'pool_size': ('COBRADB_POOL_SIZE', int, 5),
+    'max_overflow': ('COBRADB_MAX_OVERFLOW', int, 10),
+    'pool_timeout': ('COBRADB_POOL_TIMEOUT', int, 30),
+    'pool_recycle': ('COBRADB_POOL_RECYCLE', int, -1),
+    'pool_pre_ping': ('COBRADB_POOL_PRE_PING', _parse_bool, False),
+    # milliseconds. 0 means no timeout
+    'statement_timeout': ('COBRADB_STATEMENT_TIMEOUT', int, 0),
+    # psycopg2 executemany mode: default, batch, or values
+    'executemany_mode': ('COBRADB_EXECUTEMANY_MODE', str, 'values'),
+    'server_side_cursors': ('COBRADB_SERVER_SIDE_CURSORS', _parse_bool, False),
+    # no client-side pool and only transaction-scoped settings, for running
+    # behind PgBouncer in transaction pooling mode
+    'pgbouncer': ('COBRADB_PGBOUNCER', _parse_bool, False),
+    # IDs reserved from the wids sequence at a time for new rows. 0 means one
+    # nextval per insert
+    'id_block_size': ('COBRADB_ID_BLOCK_SIZE', int, 1000),
+}
+
+
+def _set(name, value):
+    # do not overwrite settings that were assigned directly
+    if name not in vars(self):
+        setattr(self, name, value)
+
+
+def load():
+    """Read settings.ini and the environment. Called automatically the first
+    time a setting is accessed.
+
+    """
+    if self._loaded:
+        return
+
+    # overwrite defaults settings with settings from the file
+    if isfile(filepath):
+        config.read(filepath)
+    else:
+        raise Exception('No settings files at path: %s' % filepath)
+
+    for setting_name, env_name in six.iteritems(env_names):
+        if env_name in os.environ:
+            logging.info('Setting %s with environment variable %s' %
+                         (setting_name, env_name))
+            _set(setting_name, os.environ[env_name])
+        else:
+            _set(setting_name, config.get('DATABASE', setting_name))
+
+    # set up the database connection string
+    _set('db_connection_string', 'postgresql://%s:%s@%s:%s/%s' %
+         (self.postgres_user, self.postgres_password, self.postgres_host,
+          self.postgres_port, self.postgres_database))
+
+    for setting_name, (env_name, cast, default) in six.iteritems(engine_settings):
+        if env_name in os.environ:
+            value = cast(os.environ[env_name])
+        elif config.has_option('DATABASE', setting_name):
+            value = cast(config.get('DATABASE', setting_name))
+        else:
+            value = default
+        _set(setting_name, value)
+
+    # get the java executable (optional, for running Model Polisher)
+    if config.has_option('EXECUTABLES', 'java'):
+        _set('java', config.get('EXECUTABLES', 'java'))
     else:
-        setattr(self, setting_name, config.get('DATABASE', setting_name))
-
-# set up the database connection string
-self.db_connection_string = ('postgresql://%s:%s@%s:%s/%s' %
-                             (self.postgres_user, self.postgres_password,
-                              self.postgres_host, self.postgres_port,
-                              self.postgres_database))
-
-# get the java executable (optional, for running Model Polisher)
-if config.has_option('EXECUTABLES', 'java'):
-    self.java = config.get('EXECUTABLES', 'java')
-else:
-    print('No Java executable provided.')
-
-if not config.has_section('DATA'):
-    raise Exception('DATA section was not found in settings.ini')
-
-# these are required
-try:
-    self.model_directory = expanduser(config.get('DATA', 'model_directory'))
-except NoOptionError:
-    raise Exception('model_directory was not supplied in settings.ini')
-
-try:
-    self.refseq_directory = expanduser(config.get('DATA', 'refseq_directory'))
-except NoOptionError:
-    raise Exception('refseq_directory was not supplied in settings.ini')
-try:
-    self.model_genome = expanduser(config.get('DATA', 'model_genome'))
-except NoOptionError:
-    raise Exception('model_genome path was not supplied in settings.ini')
-
-# these are optional
-for data_pref in ['compartment_names', 'reaction_id_prefs',
-                  'reaction_hash_prefs', 'gene_reaction_rule_prefs',
-                  'data_source_preferences']:
+        logging.debug('No Java executable provided.')
+
+    if not config.has_section('DATA'):
+        raise Exception('DATA section was not found in settings.ini')
+
+    # these are required
+    try:
+        _set('model_directory',
+             expanduser(config.get('DATA', 'model_directory')))
+    except NoOptionError:
+        raise Exception('model_directory was not supplied in settings.ini')
     try:
-        setattr(self, data_pref, expanduser(config.get('DATA', data_pref)))
+        _set('refseq_directory',
+             expanduser(config.get('DATA', 'refseq_directory')))
     except NoOptionError:
-        setattr(self, data_pref, None)
+        raise Exception('refseq_directory was not supplied in settings.ini')
+    try:
+        _set('model_genome', expanduser(config.get('DATA', 'model_genome')))
+    except NoOptionError:
+        raise Exception('model_genome path was not supplied in settings.ini')
+
+    # these are optional
+    for data_pref in ['compartment_names', 'reaction_id_prefs',
+                      'reaction_hash_prefs', 'gene_reaction_rule_prefs',
+                      'data_source_preferences', 'model_cache_directory']:
+        try:
+            _set(data_pref, expanduser(config.get('DATA', data_pref)))
+        except NoOptionError:
+            _set(data_pref, None)
+
+    self._loaded = True
+
+
+def __getattr__(name):
+    # only called for names that have not been set yet
+    if name.startswith('__') or self._loaded:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    load()
+    try:
+        return vars(self)[name]
+    except KeyError:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+from cobradb.base import make_engine
+
+import pytest
+from sqlalchemy.pool import NullPool, QueuePool
+
+
+def test_make_engine_pool():
+    engine = make_engine('postgresql://u:p@localhost/db', pool_size=2,
+                         max_overflow=0)
+    assert isinstance(engine.pool, QueuePool)
+    assert engine.pool.size() == 2
+
+
+def test_make_engine_pgbouncer():
+    engine = make_engine('postgresql://u:p@localhost/db', pgbouncer=True,
+                         statement_timeout=1000)
+    assert isinstance(engine.pool, NullPool)
+
+
+def test_make_engine_bad_setting():
+    with pytest.raises(TypeError):
+        make_engine('postgresql://u:p@localhost/db', not_a_setting=1)
+
+
+def test_make_engine_id_blocks():
+    from cobradb import ids
+    engine = make_engine('postgresql://u:p@localhost/db', id_block_size=50)
+    assert ids._allocators[engine].block_size == 50
+    engine = make_engine('postgresql://u:p@localhost/db', id_block_size=0)
+    assert engine not in ids._allocators
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+from cobradb.base import *
+from cobradb.components import *
+
+import pytest
+
+
+@pytest.fixture(scope='function')
+def nested_complexes(test_db, session):
+    # outer -> (inner, m1); inner -> (m2, m3); other -> (m3)
+    mets = [Metabolite(cobra_id='cplx_m%d' % i) for i in range(1, 4)]
+    inner = Complex(cobra_id='cplx_inner')
+    outer = Complex(cobra_id='cplx_outer')
+    other = Complex(cobra_id='cplx_other')
+    empty = Complex(cobra_id='cplx_empty')
+    session.add_all(mets + [inner, outer, other, empty])
+    session.flush()
+    session.add_all([
+        ComplexComposition(complex_id=outer.id, component_id=inner.id),
+        ComplexComposition(complex_id=outer.id, component_id=mets[0].id),
+        ComplexComposition(complex_id=inner.id, component_id=mets[1].id),
+        ComplexComposition(complex_id=inner.id, component_id=mets[2].id),
+        ComplexComposition(complex_id=other.id, component_id=mets[2].id),
+    ])
+    session.commit()
+    ids = [x.id for x in mets + [inner, outer, other, empty]]
+    yield {'outer': outer, 'inner': inner, 'other': other, 'empty': empty,
+           'mets': mets}
+    session.rollback()
+    # complex and metabolite rows point to their component rows, so delete
+    # them first
+    session.query(ComplexComposition).delete()
+    for table in [Complex.__table__, Metabolite.__table__, Component.__table__]:
+        session.execute(table.delete().where(table.c.id.in_(ids)))
+    session.commit()
+
+
+def test_get_complex_children_ids(nested_complexes, session):
+    c = nested_complexes
+    m1, m2, m3 = [m.id for m in c['mets']]
+    res = get_complex_children_ids(session, [c['outer'].id, c['other'].id,
+                                             c['empty'].id])
+    assert res[c['outer'].id] == sorted([c['inner'].id, m1, m2, m3])
+    assert res[c['other'].id] == [m3]
+    assert res[c['empty'].id] == []
+    assert get_complex_children_ids(session, []) == {}
+
+
+def test_all_children(nested_complexes, session):
+    c = nested_complexes
+    assert ({x.cobra_id for x in c['outer'].all_children} ==
+            {'cplx_inner', 'cplx_m1', 'cplx_m2', 'cplx_m3'})
+
+
+def test_bulk_create_dna(test_db, session):
+    cobra_ids = ['dna_0', 'dna_1', 'dna_2', 'rna_0', 'rna_1', 'rna_2']
+    try:
+        rows = [{'cobra_id': 'dna_%d' % i, 'leftpos': i * 10,
+                 'rightpos': i * 10 + 5, 'strand': '+'} for i in range(3)]
+        ids = bulk_create_dna(session, rows)
+        assert len(ids) == 3
+        dna_db = session.query(DNA).get(ids[1])
+        assert dna_db.cobra_id == 'dna_1'
+        assert dna_db.genome_region.leftpos == 10
+        # reuse an existing region
+        region_count = session.query(GenomeRegion).count()
+        rna_ids = bulk_create_rna(session, [
+            {'cobra_id': 'rna_0', 'genome_region_id': dna_db.genome_region_id},
+            {'cobra_id': 'rna_1'},
+        ])
+        assert session.query(GenomeRegion).count() == region_count + 1
+        assert session.query(RNA).get(rna_ids[0]).genome_region_id == dna_db.genome_region_id
+        # regions without a chromosome are found again
+        region = GenomeRegion(cobra_id='rna_2')
+        session.add(region)
+        session.commit()
+        rna_ids = bulk_create_rna(session, [{'cobra_id': 'rna_2'}])
+        assert session.query(GenomeRegion).count() == region_count + 2
+        assert session.query(RNA).get(rna_ids[0]).genome_region_id == region.id
+    finally:
+        session.rollback()
+        for table in [RNA.__table__, DNA.__table__]:
+            session.execute(table.delete().where(table.c.id.in_(
+                session.query(Component.id).filter(Component.cobra_id.in_(cobra_ids))
+            )))
+        session.query(Component).filter(Component.cobra_id.in_(cobra_ids)).delete(synchronize_session=False)
+        session.query(GenomeRegion).filter(GenomeRegion.cobra_id.in_(cobra_ids)).delete(synchronize_session=False)
+        session.commit()
+
+
+def test_dna_reuses_genome_region(test_db, session):
+    first = DNA('dna_reuse', leftpos=10, rightpos=20, strand='+', session=session)
+    # another cobra_id gets another region
+    second = DNA('dna_reuse_2', leftpos=11, rightpos=21, strand='+',
+                 session=session)
+    assert first.genome_region_id is not None
+    assert first.genome_region_id != second.genome_region_id
+    # the same cobra_id with other positions reuses the region
+    third = RNA('dna_reuse', leftpos=12, rightpos=22, strand='-', session=session)
+    assert third.genome_region_id == first.genome_region_id
+    session.rollback()
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+
+from cobradb.base import *
+from cobradb.datasets import *
+
+import pytest
+
+
+def test_bulk_create_datasets(test_db, session):
+    ids = bulk_create_datasets(session, [{'name': 'rnaseq_1'},
+                                         {'name': 'rnaseq_2', 'group_name': 'g'},
+                                         {'name': 'chip_1', 'data_source': 'my_lab'}])
+    assert len(ids) == 3
+    generic_id = get_generic_data_source_id(session)
+    assert session.query(Dataset).get(ids[0]).data_source_id == generic_id
+    assert session.query(Dataset).get(ids[1]).group_name == 'g'
+    assert (session.query(Dataset).get(ids[2]).data_source.cobra_id ==
+            'my_lab')
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+from cobradb import garbage_collection
+from cobradb.base import Reaction, Synonym
+from cobradb.models import Model, ModelReaction
+
+
+def _insert(engine, table, **values):
+    return engine.execute(table.insert(), **values).inserted_primary_key[0]
+
+
+def test_collect_garbage(scratch_schema):
+    engine = scratch_schema('test_gc')
+    model_id = _insert(engine, Model.__table__, cobra_id='m')
+    used_id = _insert(engine, Reaction.__table__, cobra_id='USED',
+                      reaction_hash='a', type='reaction')
+    orphan_id = _insert(engine, Reaction.__table__, cobra_id='ORPHAN',
+                        reaction_hash='b', type='reaction')
+    _insert(engine, ModelReaction.__table__, reaction_id=used_id,
+            model_id=model_id, copy_number=1, objective_coefficient=0,
+            lower_bound=0, upper_bound=0, gene_reaction_rule='')
+    for ome_id in [used_id, orphan_id]:
+        _insert(engine, Synonym.__table__, ome_id=ome_id, synonym='x',
+                type='reaction')
+
+    counts = garbage_collection.count_orphans(engine)
+    assert counts['reaction'] == 1
+    assert counts['synonym'] == 0
+
+    reclaimed = garbage_collection.collect_garbage(engine, batch_size=1)
+    assert reclaimed['reaction'] == 1
+    assert reclaimed['synonym'] == 1
+    assert [r[0] for r in engine.execute('SELECT cobra_id FROM reaction')] == ['USED']
+    assert engine.execute('SELECT ome_id FROM synonym').scalar() == used_id
+
+    # nothing left
+    assert sum(garbage_collection.collect_garbage(engine).values()) == 0
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+from cobradb import ids
+from cobradb.base import Genome
+
+from sqlalchemy import create_engine
+import os
+import pytest
+
+
+def test_allocate_ids(test_db, session):
+    engine = session.get_bind()
+    ids.use_id_blocks(engine, 10)
+    try:
+        first = ids.allocate_ids(session, 3)
+        second = ids.allocate_ids(session, 3)
+        assert first + second == list(range(first[0], first[0] + 6))
+        # larger than a block
+        assert len(set(ids.allocate_ids(session, 25))) == 25
+
+        genomes = [Genome(accession_type='ncbi_accession',
+                          accession_value='ID_BLOCK_%d' % i) for i in range(3)]
+        session.add_all(genomes)
+        session.flush()
+        new_ids = [g.id for g in genomes]
+        assert new_ids == sorted(new_ids)
+        assert session.execute("SELECT nextval('wids')").scalar() > max(new_ids)
+        session.rollback()
+    finally:
+        ids.use_id_blocks(engine, 0)
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_fork_clears_id_blocks():
+    engine = create_engine('postgresql://u:p@localhost/db')
+    ids.use_id_blocks(engine, 10)
+    try:
+        ids._allocators[engine]._ids.extend([1, 2, 3])
+        pid = os.fork()
+        if pid == 0:
+            allocator = ids._allocators[engine]
+            os._exit(0 if len(allocator._ids) == 0 and
+                     allocator.block_size == 10 else 1)
+        _, status = os.waitpid(pid, 0)
+        assert os.WEXITSTATUS(status) == 0
+        # the parent keeps its IDs
+        assert list(ids._allocators[engine]._ids) == [1, 2, 3]
+    finally:
+        ids.use_id_blocks(engine, 0)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+from cobradb import profiling
+from cobradb.util import timing
+
+import json
+from sqlalchemy import create_engine
+
+
+@timing
+def _timed_function():
+    return 3
+
+
+def test_profiler(tmpdir):
+    engine = create_engine('sqlite://')
+    engine.execute('CREATE TABLE t (a INTEGER)')
+    profiler = profiling.start('test')
+    try:
+        with profiling.phase('outer'):
+            engine.execute('INSERT INTO t (a) VALUES (?)', [(1,), (2,), (3,)])
+            with profiling.phase('inner'):
+                engine.execute('SELECT * FROM t').fetchall()
+                assert _timed_function() == 3
+        profiling.record_copy('t', 5, 0.1)
+    finally:
+        assert profiling.stop() is profiler
+    # not recorded after stopping
+    engine.execute('SELECT * FROM t').fetchall()
+
+    report = profiler.report()
+    assert report['sql']['statements'] == 3
+    assert report['rows_inserted'] == {'t': 8}
+    phases = {p['path']: p for p in report['phases']}
+    assert set(phases) == {'outer', 'outer/inner', 'outer/inner/_timed_function'}
+    assert phases['outer']['sql_statements'] == 2
+    assert phases['outer/inner']['sql_statements'] == 1
+    assert phases['outer/inner/_timed_function']['calls'] == 1
+
+    path = str(tmpdir.join('profile.json'))
+    profiler.write_report(path)
+    with open(path) as f:
+        assert json.load(f)['name'] == 'test'
+
+
+def test_phase_without_profiler():
+    assert profiling.get_profiler() is None
+    with profiling.phase('nothing'):
+        pass
+    assert _timed_function() == 3
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+from cobradb.regions import *
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture(scope='function')
+def intervals():
+    return ChromosomeIntervals([1, 2, 3, 4], [0, 50, 60, 200], [100, 70, 65, 300])
+
+
+def test_overlapping(intervals):
+    query_index, region_ids = intervals.overlapping([10, 66, 150, 1000],
+                                                    [20, 80, 210, 1001])
+    assert list(zip(query_index, region_ids)) == [(0, 1), (1, 1), (1, 2), (2, 4)]
+
+
+def test_overlapping_brute_force():
+    rng = np.random.RandomState(0)
+    left = rng.randint(0, 10000, 500)
+    right = left + rng.randint(1, 300, 500)
+    intervals = ChromosomeIntervals(np.arange(500), left, right)
+    q_left = rng.randint(0, 10000, 300)
+    q_right = q_left + rng.randint(0, 100, 300)
+    query_index, region_ids = intervals.overlapping(q_left, q_right)
+    expected = {(q, i) for q in range(300) for i in range(500)
+                if left[i] < q_right[q] and right[i] > q_left[q]}
+    assert set(zip(query_index.tolist(), region_ids.tolist())) == expected
+
+
+def test_overlapping_long_region():
+    rng = np.random.RandomState(2)
+    left = rng.randint(0, 100000, 300)
+    right = left + rng.randint(1, 1000, 300)
+    # one region that covers most of the chromosome
+    left[17], right[17] = 500, 99000
+    intervals = ChromosomeIntervals(np.arange(300), left, right)
+    assert intervals.max_length < 1000
+    q_left = rng.randint(0, 100000, 200)
+    q_right = q_left + rng.randint(0, 100, 200)
+    query_index, region_ids = intervals.overlapping(q_left, q_right)
+    expected = sorted((q, left[i], i) for q in range(200) for i in range(300)
+                      if left[i] < q_right[q] and right[i] > q_left[q])
+    assert (list(zip(query_index.tolist(), region_ids.tolist())) ==
+            [(q, i) for q, _, i in expected])
+    assert 17 in region_ids
+
+
+def test_nearest(intervals):
+    region_ids, distances = intervals.nearest([10, 150, 1000, -50],
+                                              [20, 160, 1001, -40])
+    assert list(region_ids) == [1, 4, 4, 1]
+    assert list(distances) == [0, 40, 700, 40]
+
+
+def test_empty():
+    intervals = ChromosomeIntervals([], [], [])
+    assert len(intervals.overlapping([1], [2])[0]) == 0
+    assert list(intervals.nearest([1], [2])[0]) == [-1]
+
+
+def test_region_pairs_within():
+    rng = np.random.RandomState(1)
+    left = rng.randint(0, 100000, 800)
+    right = left + rng.randint(1, 2000, 800)
+    index_1, index_2, distances = region_pairs_within(left, right, 500)
+
+    def gap(a, b):
+        return max(0, max(left[a], left[b]) - min(right[a], right[b]))
+
+    expected = {(a, b): gap(a, b) for a in range(800) for b in range(a + 1, 800)
+                if gap(a, b) <= 500}
+    found = {(min(a, b), max(a, b)): d for a, b, d
+             in zip(index_1.tolist(), index_2.tolist(), distances.tolist())}
+    assert found == expected
+    assert all(left[index_1] <= left[index_2])
+
+
+def test_region_pairs_adjacent():
+    index_1, index_2, distances = region_pairs_adjacent([300, 0, 100],
+                                                        [400, 50, 350], k=1)
+    assert list(zip(index_1, index_2, distances)) == [(1, 2, 50), (2, 0, 0)]
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+from cobradb import schema
+
+from sqlalchemy import text
+import pytest
+
+
+def _count_constraints(engine):
+    return engine.execute(text(
+        "SELECT contype, count(*) FROM pg_constraint "
+        "WHERE connamespace = current_schema()::regnamespace "
+        "AND contype IN ('f', 'u') GROUP BY contype ORDER BY contype"
+    )).fetchall()
+
+
+def _index_names(engine):
+    return {row[0] for row in engine.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()"
+    ))}
+
+
+def test_defer_and_restore_constraints(test_db, session):
+    session.commit()
+    engine = session.get_bind()
+    constraints = _count_constraints(engine)
+    # deferred_ddl may be left from an earlier test
+    indexes = _index_names(engine) - {'deferred_ddl_pkey'}
+    assert 'genome_region_range_idx' in indexes
+
+    n = schema.defer_constraints(engine)
+    assert n > 0
+    assert len(schema.deferred_constraints(engine)) == n
+    assert 'genome_region_range_idx' not in _index_names(engine)
+    assert dict(_count_constraints(engine)).get('f', 0) == 0
+
+    assert schema.restore_constraints(engine, jobs=2) == []
+    assert schema.deferred_constraints(engine) == []
+    assert _count_constraints(engine) == constraints
+    assert _index_names(engine) - {'deferred_ddl_pkey'} == indexes
+
+
+def test_shadow_rebuild(scratch_schema, session):
+    from cobradb.base import Genome
+
+    live_engine = session.get_bind()
+    engine = scratch_schema('test_shadow')
+    schema.set_unlogged(engine)
+    assert engine.execute(
+        "SELECT relpersistence FROM pg_class WHERE oid = 'genome'::regclass"
+    ).scalar() == 'u'
+    engine.execute(Genome.__table__.insert(),
+                   accession_type='ncbi_accession', accession_value='SHADOW')
+    schema.set_logged(engine)
+    assert engine.execute(
+        "SELECT relpersistence FROM pg_class WHERE oid = 'genome'::regclass"
+    ).scalar() == 'p'
+    problems = schema.smoke_check(engine)
+    assert 'Table genome is empty' not in problems
+    assert 'Table model is empty' in problems
+
+    # swap with a scratch schema, leaving the live schema alone
+    swapped_engine = scratch_schema('test_swapped')
+    scratch_schema('test_swapped_old', create_tables=False)
+    swapped_engine.execute('CREATE TABLE other (x integer)')
+    swapped_engine.execute('CREATE VIEW genome_view AS SELECT * FROM genome')
+    assert ('View genome_view reads table genome and would keep reading the '
+            'old table' in schema.smoke_check(engine, swapped_engine))
+    swapped_engine.execute('DROP VIEW genome_view')
+    schema.swap_schemas(live_engine, shadow='test_shadow',
+                        live='test_swapped', old='test_swapped_old')
+    assert live_engine.execute(
+        "SELECT accession_value FROM test_swapped.genome"
+    ).scalar() == 'SHADOW'
+    # the previous tables are kept, and other objects are left alone
+    assert live_engine.execute(
+        "SELECT count(*) FROM test_swapped_old.genome"
+    ).scalar() == 0
+    assert live_engine.execute(
+        "SELECT to_regclass('test_swapped.other') IS NOT NULL"
+    ).scalar()
+    assert live_engine.execute(
+        "SELECT to_regnamespace('test_shadow') IS NULL"
+    ).scalar()
+
+
+def _partition_count(engine, table_name):
+    return engine.execute(
+        "SELECT count(*) FROM pg_inherits WHERE inhparent = '%s'::regclass" %
+        table_name
+    ).scalar()
+
+
+def test_partition_model_tables(scratch_schema):
+    from cobradb import base
+    from cobradb.models import (Model, ModelGene, ModelReaction,
+                                GeneReactionMatrix)
+    from cobradb.base import Reaction
+    from cobradb.components import Gene
+    from sqlalchemy.exc import IntegrityError
+
+    engine = scratch_schema('test_partitions')
+    scratch = base.Session(bind=engine)
+    model = Model(cobra_id='old')
+    gene = Gene(cobra_id='b0001', name='thrL', mapped_to_genbank=False)
+    reaction = Reaction(cobra_id='PGI', reaction_hash='h')
+    scratch.add_all([model, gene, reaction])
+    scratch.flush()
+    model_gene = ModelGene(model_id=model.id, gene_id=gene.id)
+    model_reaction = ModelReaction(model_id=model.id, reaction_id=reaction.id,
+                                   copy_number=1, objective_coefficient=0,
+                                   lower_bound=0, upper_bound=0,
+                                   gene_reaction_rule='b0001')
+    scratch.add_all([model_gene, model_reaction])
+    scratch.flush()
+    scratch.add(GeneReactionMatrix(model_id=model.id,
+                                   model_gene_id=model_gene.id,
+                                   model_reaction_id=model_reaction.id))
+    scratch.commit()
+    model_gene_id = model_gene.id
+    model_reaction_id = model_reaction.id
+    model_id = model.id
+    scratch.close()
+
+    schema.partition_model_tables(engine, 'list')
+    with engine.connect() as connection:
+        assert schema.partitioned_tables(connection) == {
+            t: 'l' for t in schema.PARTITIONED_TABLES
+        }
+    # the existing rows are moved into a partition for their model
+    assert _partition_count(engine, 'model_gene') == 1
+    # and a model without rows in a table still gets a partition there
+    assert _partition_count(engine, 'model_reaction') == 1
+    assert engine.execute('SELECT count(*) FROM model_gene_m%d' %
+                          model_id).scalar() == 1
+    assert engine.execute('SELECT count(*) FROM gene_reaction_matrix_m%d' %
+                          model_id).scalar() == 1
+    # again does nothing
+    schema.partition_model_tables(engine, 'list')
+
+    new_id = engine.execute(Model.__table__.insert(),
+                            cobra_id='new').inserted_primary_key[0]
+    schema.create_model_partitions(engine, new_id)
+    assert _partition_count(engine, 'model_reaction') == 2
+    assert _partition_count(engine, 'gene_reaction_matrix') == 2
+
+    # the foreign keys to model_gene and model_reaction include model_id,
+    # so a gene of another model is rejected
+    with pytest.raises(IntegrityError):
+        engine.execute(GeneReactionMatrix.__table__.insert(),
+                       model_id=new_id, model_gene_id=model_gene_id,
+                       model_reaction_id=model_reaction_id)
+
+    with engine.begin() as connection:
+        schema.drop_model(connection, model_id)
+    assert _partition_count(engine, 'model_gene') == 1
+    assert engine.execute('SELECT count(*) FROM model_gene').scalar() == 0
+    assert (engine.execute('SELECT count(*) FROM gene_reaction_matrix')
+            .scalar() == 0)
+    assert [r[0] for r in engine.execute('SELECT cobra_id FROM model')] == ['new']
+    # still a regular table
+    assert engine.execute('SELECT count(*) FROM gene').scalar() == 1
+
+
+def test_partition_model_tables_hash(scratch_schema):
+    engine = scratch_schema('test_partitions')
+    schema.partition_model_tables(engine, 'hash', partitions=4)
+    assert _partition_count(engine, 'model_reaction') == 4
+    # no partitions per model
+    schema.create_model_partitions(engine, 1)
+    assert _partition_count(engine, 'model_reaction') == 4
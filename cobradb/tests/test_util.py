@@ -60,6 +60,24 @@ def test_get_or_create_data_source(test_db, session, test_prefs, tmpdir):
             .count()) == 1
 
 
+def test_insert_or_get_id(test_db, session):
+    new_id, exists = insert_or_get_id(session, DataSource, ['cobra_id'],
+                                      cobra_id='shared_source', name='first')
+    assert exists is False
+    # the second insert does nothing and finds the first row
+    same_id, exists = insert_or_get_id(session, DataSource, ['cobra_id'],
+                                       cobra_id='shared_source', name='second')
+    assert exists is True
+    assert same_id == new_id
+    assert session.query(DataSource.name).filter(DataSource.id == new_id).scalar() == 'first'
+    session.rollback()
+
+
+def test_load_tsv_missing(tmpdir):
+    assert load_tsv(None) == []
+    assert load_tsv(str(tmpdir.join('missing.tsv'))) == []
+
+
 def test_format_formula():
     assert format_formula("['abc']") == 'abc'
 
@@ -90,3 +108,20 @@ def test_load_tsv(tmpdir):
     # with required_column_num
     rows = load_tsv(str(a_file), required_column_num=3)
     assert rows == []
+
+
+def test_incremented_id_allocator():
+    allocator = IncrementedIdAllocator(['ACALD', 'ACALD_1', 'ACALD_3', 'EX_glc_e'])
+    assert 'ACALD_1' in allocator
+    assert 'ACALD_2' not in allocator
+    assert allocator.next_id('ACALD') == 'ACALD_2'
+    assert allocator.next_id('ACALD') == 'ACALD_4'
+    assert allocator.next_id('ACALD_3') == 'ACALD_5'
+    assert allocator.next_id('EX_glc_e') == 'EX_glc_e_1'
+    assert allocator.next_id('GAPD_9') == 'GAPD_10'
+    # same as probing with increment_id
+    taken = {'PGI', 'PGI_1', 'PGI_2', 'PGI_5'}
+    new_id = increment_id('PGI')
+    while new_id in taken:
+        new_id = increment_id(new_id)
+    assert IncrementedIdAllocator(taken).next_id('PGI') == new_id
@@ -1,12 +1,18 @@
 """Utility functions"""
 import re
 import os
+import math
 import logging
+import six
 
 from time import time
 from sys import stdout
+from functools import wraps
+from contextlib import contextmanager
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
-from cobradb import settings
+from cobradb import settings, profiling
 from cobradb.base import DataSource
 
 
@@ -34,22 +40,137 @@ def get_or_create(session, query_class, **kwargs):
         return res, True
     res = query_class(**kwargs)
     session.add(res)
-    session.commit()
+    session.flush()
     return res, False
 
 
+def insert_or_get_id(session, query_class, key_columns, **kwargs):
+    """Insert a row unless one with the same unique key exists, and return its
+    ID. Unlike get_or_create, this is safe when other transactions insert the
+    same row at the same time: they wait for each other instead of failing on
+    the unique constraint.
+
+    Returns a tuple: (database ID, Boolean: the row already existed)
+
+    Arguments
+    ---------
+
+    session: The SQLAlchemy session.
+
+    query_class: The class of the row. Must have an integer id column.
+
+    key_columns: The names of the columns in the unique constraint.
+
+    """
+    table = query_class.__table__
+    new_id = session.execute(
+        pg_insert(table)
+        .values(**kwargs)
+        .on_conflict_do_nothing(index_elements=key_columns)
+        .returning(table.c.id)
+    ).scalar()
+    if new_id is not None:
+        return new_id, False
+    res = (session
+           .query(query_class.id)
+           .filter_by(**{k: kwargs[k] for k in key_columns})
+           .scalar())
+    return res, True
+
+
+@contextmanager
+def savepoint(session, description):
+    """Run a block of code in a savepoint. If it raises a database error, roll
+    back the savepoint, log the error, and continue, so the rest of the
+    transaction is kept.
+
+    If session.info['raise_integrity_errors'] is True, integrity errors are
+    raised after the rollback instead. Queue workers set it, because another
+    worker can insert the same universal row at the same time, and skipping
+    the row would load the model without it.
+
+    Arguments
+    ---------
+
+    session: The SQLAlchemy session.
+
+    description: A description of the work for the error message, e.g.
+    'reaction GAPD in model iJO1366'.
+
+    """
+    nested = session.begin_nested()
+    try:
+        yield
+    except SQLAlchemyError as e:
+        nested.rollback()
+        if (isinstance(e, IntegrityError) and
+                session.info.get('raise_integrity_errors')):
+            raise
+        logging.error('Could not load %s. Skipping it. %s' % (description, e))
+    else:
+        nested.commit()
+
+
+def _format_copy_value(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return '\\N'
+    if isinstance(value, float):
+        return repr(value)
+    return (str(value)
+            .replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n'))
+
+
+def copy_rows(session, table_name, columns, rows):
+    """Write rows to a table with a single COPY on the connection of the
+    session, so they are part of the current transaction. Returns the number of
+    rows written.
+
+    Arguments
+    ---------
+
+    session: The SQLAlchemy session.
+
+    table_name: The name of the table.
+
+    columns: A list of column names.
+
+    rows: An iterable of tuples with one value per column. None and NaN are
+    written as NULL.
+
+    """
+    n = 0
+    lines = []
+    for row in rows:
+        lines.append('\t'.join(_format_copy_value(v) for v in row) + '\n')
+        n += 1
+    buf = six.StringIO(''.join(lines))
+    cursor = session.connection().connection.cursor()
+    start = time()
+    try:
+        cursor.copy_expert('COPY %s (%s) FROM STDIN' % (table_name, ', '.join(columns)),
+                           buf)
+    finally:
+        cursor.close()
+    profiling.record_copy(table_name, n, time() - start)
+    return n
+
+
 def load_tsv(filename, required_column_num=None):
     """Try to load a tsv prefs file. Ignore empty lines and lines beginning with #.
 
     Arguments
     ---------
 
-    filename: A tsv path to load.
+    filename: A tsv path to load. If it is None or does not exist, returns an
+    empty list.
 
     required_column_num: The number of columns to check for.
 
     """
-    if not os.path.exists(filename):
+    # optional prefs files can be unset
+    if filename is None or not os.path.exists(filename):
         return []
     with open(filename, 'r') as f:
         # split non-empty rows by tab
@@ -111,16 +232,19 @@ def get_or_create_data_source(session, cobra_id):
         # get gene url_prefs
         url_prefs = load_tsv(settings.data_source_preferences)
         cobra_id, name, url_prefix = _find_data_source_url(cobra_id, url_prefs)
-        # data source may already exist if this is a synonym
-        data_source_db, exists = get_or_create(session, DataSource,
-                                               cobra_id=cobra_id,
-                                               name=name,
-                                               url_prefix=url_prefix)
+        # data source may already exist if this is a synonym, or another loader
+        # may be adding it at the same time
+        data_source_id, exists = insert_or_get_id(session, DataSource,
+                                                  ['cobra_id'],
+                                                  cobra_id=cobra_id,
+                                                  name=name,
+                                                  url_prefix=url_prefix)
         if not exists:
             if name is None:
                 logging.warning('No name found for data source %s', cobra_id)
             if url_prefix is None:
                 logging.warning('No URL found for data source %s', cobra_id)
+        return data_source_id
     return data_source_db.id
 
 
@@ -132,22 +256,85 @@ def increment_id(id, increment_name=''):
         return '%s_%s%d' % (id, increment_name, 1)
 
 
+_increment_regex = re.compile(r'(.*)_([0-9]+)$')
+
+
+def split_incremented_id(the_id):
+    """Split an ID into the base ID and the increment, e.g. ('ACALD', 2) for
+    ACALD_2. The increment is None for an ID without one.
+
+    """
+    match = _increment_regex.match(the_id)
+    if match:
+        return match.group(1), int(match.group(2))
+    return the_id, None
+
+
+class IncrementedIdAllocator(object):
+    """Hands out free incremented IDs, giving the same result as calling
+    increment_id until the ID is not taken.
+
+    The taken increments are kept in a set for each base ID, and the search
+    continues where the last one for the same starting ID stopped, so many
+    conflicts for one base ID (e.g. EX_glc__D_e) do not mean long probe chains.
+
+    Arguments
+    ---------
+
+    taken_ids: IDs that are already taken.
+
+    """
+
+    def __init__(self, taken_ids=()):
+        self._taken = {}
+        # IDs like ACALD_01 that increment_id never produces
+        self._other = set()
+        self._next = {}
+        for the_id in taken_ids:
+            self.add(the_id)
+
+    def _key(self, the_id):
+        base, increment = split_incremented_id(the_id)
+        if increment is not None and the_id != '%s_%d' % (base, increment):
+            return None, None
+        return base, increment
+
+    def add(self, the_id):
+        base, increment = self._key(the_id)
+        if base is None:
+            self._other.add(the_id)
+        else:
+            self._taken.setdefault(base, set()).add(increment)
+
+    def __contains__(self, the_id):
+        base, increment = self._key(the_id)
+        if base is None:
+            return the_id in self._other
+        return increment in self._taken.get(base, ())
+
+    def next_id(self, the_id):
+        """Get the first free incremented ID after the_id, and mark it as taken."""
+        base, increment = split_incremented_id(the_id)
+        taken = self._taken.setdefault(base, set())
+        candidate = max((increment or 0) + 1,
+                        self._next.get((base, increment), 0))
+        while candidate in taken:
+            candidate += 1
+        taken.add(candidate)
+        self._next[(base, increment)] = candidate + 1
+        return '%s_%d' % (base, candidate)
+
+
 def make_reaction_copy_id(cobra_id, copy_number):
     return '{}_copy{}'.format(cobra_id, copy_number)
 
 
+# ATPM, exchanges, demands, sinks and biomass reactions, in one pattern
+_pseudoreaction_regex = re.compile(r'^(?:ATPM$|EX_|DM_|SK_|BIOMASS_)')
+
+
 def check_pseudoreaction(reaction_id):
-    patterns = [
-        r'^ATPM$',
-        r'^EX_.*',
-        r'^DM_.*',
-        r'^SK_.*',
-        r'^BIOMASS_.*' # case insensitive
-    ]
-    for pattern in patterns:
-        if re.match(pattern, reaction_id):
-            return True
-    return False
+    return _pseudoreaction_regex.match(reaction_id) is not None
 
 
 def format_formula(formula):
@@ -193,18 +380,20 @@ def ref_tuple_to_str(key, val):
 
 
 def timing(function):
+    """Log the run time of the function, and record it as a phase when a profiler
+    is running (see cobradb.profiling)."""
+    try:
+        name = function.__name__
+    except AttributeError:
+        name = function.func_name
+
+    @wraps(function)
     def wrapper(*args, **kwargs):
-        arg_str = str(args)
-        if arg_str[-2] == ',': # trailing comma
-            arg_str = arg_str[:-2] + ')'
-        try:
-            name = function.__name__
-        except AttributeError:
-            name = function.func_name
         logging.debug('starting %s', name)
         stdout.flush()
         start = time()
-        res = function(*args, **kwargs)
+        with profiling.phase(name):
+            res = function(*args, **kwargs)
         logging.debug('%s complete (%.2f sec)', name, time() - start)
         return res
     return wrapper
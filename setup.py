@@ -27,15 +27,16 @@ setup(
     license='MIT',
     classifiers=[
         'License :: OSI Approved :: MIT License',
-        'Programming Language :: Python :: 2',
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.7',
     ],
+    # settings and base.engine are loaded lazily with module __getattr__
+    python_requires='>=3.7',
     keywords='systems biology, genome-scale model',
     packages=find_packages(),
-    package_data={'cobradb':  ['settings.ini']},
-    install_requires=['SQLAlchemy>=1.0.12',
+    package_data={'cobradb':  ['settings.ini', 'benchmarks/counts.json']},
+    install_requires=['SQLAlchemy>=1.3.7',
                       'cobra>=0.4.0',
                       'numpy>=1.9.1',
                       'psycopg2>=2.5.4',